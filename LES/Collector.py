@@ -1,14 +1,37 @@
+import time
+startup_began = time.perf_counter()
+import os
 import sys
 import json
+import math
 from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, \
     QScrollArea, QFrame, QLineEdit, QDialog, QFormLayout
 from PyQt6.QtGui import QFont
-from Report import ReportGenerator
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Entry import EntryMixin
+from common.Instruments import load_module, questions_path
+from common.Norms import load_norms
+from common.Pages import PageCache
+from common.Registry import get_instrument
+from common.Reports import score_record
+from common.Responses import ResponseSet, json_default
+from common.Startup import StartupTimer, Warmup
+from common.Station import Station, argument_parser, open_pipeline, open_store
+from common.Trace import sample_event_loop_lag, traced, tracer
 
+
+def load_reporting():
+    """Import the reporting stack (numpy, matplotlib, reportlab, fonts)."""
+    return load_module('les', 'Report')
+
+
+@traced('les.save_to_json')
 def save_to_json(filename, data):
     with open(filename, 'w') as fp:
-        json.dump(data, fp, indent=4)
+        json.dump(data, fp, indent=4, default=json_default)
 
 
 class StartDialog(QDialog):
@@ -47,12 +70,19 @@ class Survey(QWidget):
         self.layout.addWidget(self.scroll_area)
 
         self.questions = []
-        self.responses_year = {}
-        self.responses_week = {}
         self.user_id = ""
+        self.reporting = Warmup(load_reporting)
+        self.store = None
+        self.journal = None
+        self.pipeline = None
 
         # Load questions from the JSON file
         self.load_questions(filename)
+        # answer codes by item position, filled in directly by the combo boxes
+        self.responses_year = ResponseSet(self.instrument)
+        self.responses_week = ResponseSet(self.instrument)
+        self.pages = self.make_pages()
+        self.questions_layout.addWidget(self.pages)
 
         # Navigation buttons
         self.nav_layout = QHBoxLayout()
@@ -73,28 +103,36 @@ class Survey(QWidget):
         self.layout.addLayout(self.nav_layout)
         self.setLayout(self.layout)
 
+    @traced('les.load_questions')
     def load_questions(self, filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            self.questions = data['questions']
+        self.instrument = get_instrument('les', filename)
+        self.questions = self.instrument.questions
 
+    @traced('les.show_page')
     def show_page(self, page):
-        for i in reversed(range(self.questions_layout.count())):
-            widget = self.questions_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setParent(None)
+        self.pages.show_page(page)
+        self.scroll_area.verticalScrollBar().setValue(0)
 
         start = page * self.questions_per_page
         end = min(start + self.questions_per_page, len(self.questions))
 
-        for question in self.questions[start:end]:
-            self.add_question(question)
-
         self.prev_button.setEnabled(page > 0)
         self.next_button.setEnabled(end < len(self.questions))
         self.submit_button.setEnabled(end >= len(self.questions))
 
-    def add_question(self, question):
+    def make_pages(self):
+        # Pages are built once and kept, so answers survive going back and forth
+        return PageCache(math.ceil(len(self.questions) / self.questions_per_page), self.build_page)
+
+    def build_page(self, page):
+        page_widget = QWidget()
+        page_layout = QVBoxLayout(page_widget)
+        start = page * self.questions_per_page
+        for question in self.questions[start:start + self.questions_per_page]:
+            self.add_question(question, page_layout)
+        return page_widget
+
+    def add_question(self, question, page_layout):
         question_frame = QFrame()
         question_layout = QVBoxLayout()
 
@@ -105,8 +143,10 @@ class Survey(QWidget):
         combo_box_year = QComboBox()
         combo_box_year.addItem("请选择一年以来最符合真实情况的一项", None)
         for option in question['options']:
-            combo_box_year.addItem(str(option), option)
+            combo_box_year.addItem(str(option), self.instrument.code(question['item'], option))
 
+        if question['item'] in self.responses_year:
+            combo_box_year.setCurrentIndex(combo_box_year.findData(self.responses_year[question['item']]))
         combo_box_year.currentIndexChanged.connect(
             lambda _, b=combo_box_year, q=question['item']: self.record_response(b, q, "year"))
         question_layout.addWidget(combo_box_year)
@@ -115,20 +155,25 @@ class Survey(QWidget):
         combo_box_week = QComboBox()
         combo_box_week.addItem("请选择一周以来最符合真实情况的一项", None)
         for option in question['options']:
-            combo_box_week.addItem(str(option), option)
+            combo_box_week.addItem(str(option), self.instrument.code(question['item'], option))
 
+        if question['item'] in self.responses_week:
+            combo_box_week.setCurrentIndex(combo_box_week.findData(self.responses_week[question['item']]))
         combo_box_week.currentIndexChanged.connect(
             lambda _, b=combo_box_week, q=question['item']: self.record_response(b, q, "week"))
         question_layout.addWidget(combo_box_week)
 
         question_frame.setLayout(question_layout)
-        self.questions_layout.addWidget(question_frame)
+        page_layout.addWidget(question_frame)
 
+    @traced('les.record_response')
     def record_response(self, combo_box, question_item, period):
         if period == "year":
             self.responses_year[question_item] = combo_box.currentData()
         elif period == "week":
             self.responses_week[question_item] = combo_box.currentData()
+        if self.journal is not None:
+            self.journal.record(question_item, combo_box.currentData(), period)
 
     def show_next_page(self):
         self.current_page += 1
@@ -139,32 +184,68 @@ class Survey(QWidget):
             self.current_page -= 1
         self.show_page(self.current_page)
 
+    @traced('les.submit_answers')
     def submit_answers(self):
         print("问卷采集已完成！")
-        mapping = {"没有遇到或无影响": 0, "有轻微影响": 1, "有一定影响": 2, "有较大影响": 3, "影响非常大": 4}
-        num_responses_year = {key: mapping[value] for key, value in self.responses_year.items()}
-        num_responses_week = {key: mapping[value] for key, value in self.responses_week.items()}
 
-        report = ReportGenerator(self.user_id, num_responses_year, num_responses_week, 'LES.json')
-        report.generate_pdf()
         # Save to JSON
-        save_to_json(f"les_{self.user_id}.json",
-                     {"year": num_responses_year, "week": num_responses_week})
+        record = {"year": self.responses_year, "week": self.responses_week}
+        save_to_json(f"les_{self.user_id}.json", record)
+        if self.journal is not None:
+            self.journal.compact(record)
+        if self.store is not None:
+            self.store.save_record('les', self.user_id, record, score_record('les', record, self.user_id))
+
+        if self.pipeline is not None:
+            self.pipeline.submit('les', self.user_id, record, f"{self.user_id}_report.pdf")
+        else:
+            report_module = self.reporting.result()
+            report = report_module.ReportGenerator(self.user_id, self.responses_year, self.responses_week,
+                                                   questions_path('les'), load_norms('les'))
+            report.generate_pdf()
         self.close()
 
 
+class EntrySurvey(EntryMixin, Survey):
+    """Keyboard entry of a paper form: year and week codes of each item in turn (see common.Entry)."""
+
+    entry_key = 'les'
+    entry_periods = {'year': 'responses_year', 'week': 'responses_week'}
+
+
 def main():
-    app = QApplication(sys.argv)
+    args, qt_args = argument_parser("生活事件量表（LES）").parse_known_args()
+    timer = StartupTimer(startup_began, enabled=args.startup_timing, expected=['first paint', 'reporting ready'])
+    timer.mark('imports')
+    if args.trace:
+        tracer.configure(args.trace, 'les')
+        tracer.record('startup.imports', time.perf_counter() - startup_began)
+    app = QApplication(sys.argv[:1] + qt_args)
+    lag_sampler = sample_event_loop_lag()
     default_font = QFont('Arial', 11)
     app.setFont(default_font)
-    dialog = StartDialog()
-    if dialog.exec():
-        user_id = dialog.get_id()
-        main_window = Survey('LES.json')
+
+    reporting = Warmup(load_reporting, timer)
+    store = open_store(args)
+    pipeline = open_pipeline(args)
+
+    def make_survey(user_id, journal, answers):
+        main_window = (EntrySurvey if args.entry else Survey)(questions_path('les'))
         main_window.user_id = user_id
-        main_window.show()
-        main_window.show_page(main_window.current_page)
-        sys.exit(app.exec())
+        main_window.reporting = reporting
+        main_window.store = store
+        main_window.journal = journal
+        main_window.pipeline = pipeline
+        main_window.responses_year.update(answers.get('year', {}))
+        main_window.responses_week.update(answers.get('week', {}))
+        return main_window
+
+    station = Station(args, 'les', StartDialog, make_survey, pipeline)
+    station.start()
+    reporting.start_after_paint(station.dialog)
+    if pipeline is not None:
+        pipeline.prewarm('les')
+    sys.exit(station.run(app))
 
 
 if __name__ == "__main__":
@@ -1,53 +1,59 @@
-import io
-import json
-import numpy as np
-import matplotlib.pyplot as plt
+import os
+import sys
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from PIL import Image
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-from matplotlib.font_manager import FontProperties
+from reportlab.lib.utils import ImageReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Charts import ChartCache, RadarChartRenderer, check_chart_backend, draw_radar_chart
+from common.Fonts import font_service
+from common.Norms import norm_text
+from common.Trace import traced
+from common.Registry import get_instrument
+from common.Responses import ResponseSet
 
 
 # set Chinese fonts manually
-font_path_regular = 'font/NotoSansSC-Regular.ttf'
-font_path_bold = 'font/NotoSansSC-Bold.ttf'
-font_path_light = 'font/NotoSansSC-Light.ttf'
-pdfmetrics.registerFont(TTFont('NotoSansSC', font_path_regular))
-pdfmetrics.registerFont(TTFont('NotoSansSC-b', font_path_bold))
-notoregu = FontProperties(fname=font_path_regular)
-notolight = FontProperties(fname=font_path_light)
+font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font')
+font_path_regular = os.path.join(font_dir, 'NotoSansSC-Regular.ttf')
+font_path_bold = os.path.join(font_dir, 'NotoSansSC-Bold.ttf')
+font_path_light = os.path.join(font_dir, 'NotoSansSC-Light.ttf')
+font_service.register('NotoSansSC', font_path_regular)
+font_service.register('NotoSansSC-b', font_path_bold)
+notoregu = font_service.properties(font_path_regular)
+notolight = font_service.properties(font_path_light)
+radar_chart = RadarChartRenderer(label_font=notolight, title_font=notoregu, cache=ChartCache())
+
+# category -> item numbers
+CATEGORIES = {'婚姻恋爱': range(1, 18), '家庭生活': range(18, 29), '工作学习': range(29, 41), '社会人际': range(41, 50)}
 
 class ReportGenerator:
-    def __init__(self, user_id, num_responses_year, num_responses_week, les_path):
+    def __init__(self, user_id, num_responses_year, num_responses_week, les_path, norms=None):
         self.user_id = user_id
-        self.impact_year = num_responses_year
-        self.impact_week = num_responses_week
+        self.norms = norms
         self.les_file_path = les_path
+        self.instrument = get_instrument('les', les_path)
+        self.impact_year = ResponseSet.of(self.instrument, num_responses_year)
+        self.impact_week = ResponseSet.of(self.instrument, num_responses_week)
         self.les_data = self.load_les_data()
-        self.categories = {'婚姻恋爱': range(1, 18), '家庭生活': range(18, 29), '工作学习': range(29, 41), '社会人际': range(41, 50)}
+        self.categories = CATEGORIES
 
     def load_les_data(self):
-        """Load LES data from a JSON file."""
-        with open(self.les_file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        return data
+        """LES data as parsed from the JSON file (shared through the instrument registry)."""
+        return self.instrument.data
 
     def categorize_impacts(self, impacts):
         """Categorize impacts into the predefined categories and sum their values."""
-        category_impacts = {category: 0 for category in self.categories}
-        for category, indices in self.categories.items():
-            category_impacts[category] = sum(impacts[str(i)] for i in indices if str(i) in impacts)
-        return category_impacts
+        return {category: impacts.total(self.instrument.index(i) for i in indices)
+                for category, indices in self.categories.items()}
 
     def get_event_description(self, item_number):
         """Retrieve the event description from LES data."""
-        for question in self.les_data['questions']:
-            if question['item'] == str(item_number):
-                return question['description']
-        return None
+        return self.instrument.description(item_number)
 
+    @traced('les.scocer')
     def scocer(self):
         category_year = self.categorize_impacts(self.impact_year)
         category_week = self.categorize_impacts(self.impact_week)
@@ -57,34 +63,37 @@ class ReportGenerator:
         week_total_impact = sum(week_impacts.values())
         return category_year, category_week, year_impacts, week_impacts, year_total_impact, week_total_impact
 
+    def norm_scores(self, category_year, category_week, year_total_impact, week_total_impact):
+        """{"year:..." / "week:...": (T, percentile)} against the norm table, empty without one."""
+        if self.norms is None:
+            return {}
+        scores = {f"year:{category}": impact for category, impact in category_year.items()}
+        scores.update({f"week:{category}": impact for category, impact in category_week.items()})
+        scores.update({'year:total': year_total_impact, 'week:total': week_total_impact})
+        return self.norms.lookup(scores)
+
+    @traced('les.plot_radar_chart')
     def plot_radar_chart(self, data, labels, title):
-        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
-        data += data[:1]
-        angles += angles[:1]
-
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
-        ax.fill(angles, data, color='red', alpha=0.25)
-        ax.plot(angles, data, color='red', linewidth=2)
-        ax.set_xticks(angles[:-1])
-        ax.set_xticklabels(labels, fontsize=12, rotation=45, fontproperties=notolight)
-        plt.title(title, size=15, color='black', y=1.1, fontsize=15, fontproperties=notoregu)
-
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='PNG')
-        plt.close()
-        img_data.seek(0)
-
-        img = Image.open(img_data)
-        return img
-
-    def generate_pdf(self, font_size=8):
+        return radar_chart.render(data, labels, title)
+
+    @traced('les.generate_pdf')
+    def generate_pdf(self, font_size=8, filename=None, chart_backend='matplotlib'):
+        """chart_backend is 'matplotlib' (embedded bitmaps) or 'vector' (reportlab paths)."""
+        pdf = canvas.Canvas(filename or f"{self.user_id}_report.pdf", pagesize=letter)
+        self.draw(pdf, font_size, chart_backend)
+        pdf.save()
+
+    def draw(self, pdf, font_size=8, chart_backend='matplotlib'):
+        """Draw the report on the current page of pdf, so that batch mode can put many reports in one file."""
+        check_chart_backend(chart_backend)
         label = ["婚姻恋爱", "家庭生活", "工作学习", "社会人际"]
         category_year, category_week, year_impacts, week_impacts, year_total_impact, week_total_impact = self.scocer()
+        norms = self.norm_scores(category_year, category_week, year_total_impact, week_total_impact)
 
-        year_chart_img = self.plot_radar_chart(list(category_year.values()), label, "一年以来的生活事件压力分布图")
-        week_chart_img = self.plot_radar_chart(list(category_week.values()), label,"最近一周的生活事件压力分布图")
+        if chart_backend == 'matplotlib':
+            year_chart_img = self.plot_radar_chart(list(category_year.values()), label, "一年以来的生活事件压力分布图")
+            week_chart_img = self.plot_radar_chart(list(category_week.values()), label,"最近一周的生活事件压力分布图")
 
-        pdf = canvas.Canvas(f"{self.user_id}_report.pdf", pagesize=letter)
         width, height = letter
 
         column1_x = 50
@@ -109,7 +118,7 @@ class ReportGenerator:
 
         pdf.setFont("NotoSansSC-b", font_size)
         y_position -= font_size * 1
-        pdf.drawString(column1_x, y_position, f'一年以来对您的生活压力总值为: {year_total_impact}')
+        pdf.drawString(column1_x, y_position, f'一年以来对您的生活压力总值为: {year_total_impact}{norm_text(norms, "year:total")}')
         pdf.setFont("NotoSansSC", font_size)
         y_position -= font_size * 3
 
@@ -125,14 +134,18 @@ class ReportGenerator:
 
         pdf.setFont("NotoSansSC-b", font_size)
         y_position -= font_size * 1
-        pdf.drawString(column1_x, y_position, f'一周以来对您的生活压力总值为:{week_total_impact}')
+        pdf.drawString(column1_x, y_position, f'一周以来对您的生活压力总值为:{week_total_impact}{norm_text(norms, "week:total")}')
         pdf.setFont("NotoSansSC", font_size)
         y_position -= font_size * 3
 
         image_width = 300
         image_height = 300
 
-        pdf.drawInlineImage(year_chart_img, 270, 410, width=image_width, height=image_height)
-        pdf.drawInlineImage(week_chart_img, 270, 80, width=image_width, height=image_height)
-
-        pdf.save()
+        if chart_backend == 'matplotlib':
+            pdf.drawImage(ImageReader(year_chart_img), 270, 410, width=image_width, height=image_height)
+            pdf.drawImage(ImageReader(week_chart_img), 270, 80, width=image_width, height=image_height)
+        else:
+            draw_radar_chart(pdf, list(category_year.values()), label, "一年以来的生活事件压力分布图",
+                             270, 410, image_width, image_height)
+            draw_radar_chart(pdf, list(category_week.values()), label, "最近一周的生活事件压力分布图",
+                             270, 80, image_width, image_height)
@@ -1,14 +1,36 @@
-from Report import ReportGenerator
-from Scorer import PID5Scorer
+import time
+startup_began = time.perf_counter()
+import os
 import sys
 import json
+import math
 from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, \
     QScrollArea, QFrame, QLineEdit, QDialog, QFormLayout
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Entry import EntryMixin
+from common.Instruments import load_module, questions_path
+from common.Norms import load_norms
+from common.Pages import PageCache
+from common.Registry import get_instrument
+from common.Reports import score_record
+from common.Responses import ResponseSet, json_default
+from common.Startup import StartupTimer, Warmup
+from common.Station import Station, argument_parser, open_pipeline, open_store
+from common.Trace import sample_event_loop_lag, span, traced, tracer
 
+
+def load_reporting():
+    """Import the scorer and the reporting stack (numpy, matplotlib, reportlab, fonts)."""
+    return load_module('pid', 'Report'), load_module('pid', 'Scorer')
+
+
+@traced('pid.save_to_json')
 def save_to_json(filename, data):
     with open(filename, 'w') as fp:
-        json.dump(data, fp, indent=4)
+        json.dump(data, fp, indent=4, default=json_default)
 
 
 class StartDialog(QDialog):
@@ -47,11 +69,18 @@ class Survey(QWidget):
         self.layout.addWidget(self.scroll_area)
 
         self.questions = []
-        self.responses = {}
         self.user_id = ""
+        self.reporting = Warmup(load_reporting)
+        self.store = None
+        self.journal = None
+        self.pipeline = None
 
         # Load questions from the JSON file
         self.load_questions(filename)
+        # answer codes by item position, filled in directly by the combo boxes
+        self.responses = ResponseSet(self.instrument)
+        self.pages = self.make_pages()
+        self.questions_layout.addWidget(self.pages)
 
         # Navigation buttons
         self.nav_layout = QHBoxLayout()
@@ -72,28 +101,36 @@ class Survey(QWidget):
         self.layout.addLayout(self.nav_layout)
         self.setLayout(self.layout)
 
+    @traced('pid.load_questions')
     def load_questions(self, filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            self.questions = data['questions']
+        self.instrument = get_instrument('pid', filename)
+        self.questions = self.instrument.questions
 
+    @traced('pid.show_page')
     def show_page(self, page):
-        for i in reversed(range(self.questions_layout.count())):
-            widget = self.questions_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setParent(None)
+        self.pages.show_page(page)
+        self.scroll_area.verticalScrollBar().setValue(0)
 
         start = page * self.questions_per_page
         end = min(start + self.questions_per_page, len(self.questions))
 
-        for question in self.questions[start:end]:
-            self.add_question(question)
-
         self.prev_button.setEnabled(page > 0)
         self.next_button.setEnabled(end < len(self.questions))
         self.submit_button.setEnabled(end >= len(self.questions))
 
-    def add_question(self, question):
+    def make_pages(self):
+        # Pages are built once and kept, so answers survive going back and forth
+        return PageCache(math.ceil(len(self.questions) / self.questions_per_page), self.build_page)
+
+    def build_page(self, page):
+        page_widget = QWidget()
+        page_layout = QVBoxLayout(page_widget)
+        start = page * self.questions_per_page
+        for question in self.questions[start:start + self.questions_per_page]:
+            self.add_question(question, page_layout)
+        return page_widget
+
+    def add_question(self, question, page_layout):
         question_frame = QFrame()
         question_layout = QVBoxLayout()
 
@@ -105,16 +142,21 @@ class Survey(QWidget):
         combo_box = QComboBox()
         combo_box.addItem("请选择最符合的一项", None)
         for option in question['options']:
-            combo_box.addItem(str(option), option)
+            combo_box.addItem(str(option), self.instrument.code(question['item'], option))
 
+        if question['item'] in self.responses:
+            combo_box.setCurrentIndex(combo_box.findData(self.responses[question['item']]))
         combo_box.currentIndexChanged.connect(lambda _, b=combo_box, q=question['item']: self.record_response(b, q))
         question_layout.addWidget(combo_box)
 
         question_frame.setLayout(question_layout)
-        self.questions_layout.addWidget(question_frame)
+        page_layout.addWidget(question_frame)
 
+    @traced('pid.record_response')
     def record_response(self, combo_box, question_item):
         self.responses[question_item] = combo_box.currentData()
+        if self.journal is not None:
+            self.journal.record(question_item, combo_box.currentData())
 
     def show_next_page(self):
         self.current_page += 1
@@ -125,35 +167,195 @@ class Survey(QWidget):
             self.current_page -= 1
         self.show_page(self.current_page)
 
+    def score(self, scorer_module):
+        return scorer_module.PID5Scorer(self.responses).get_scores()
+
+    def make_record(self, facet_scores, domain_scores):
+        return {"responses": self.responses, "facet_scores": facet_scores, "domain_scores": domain_scores}
+
+    @traced('pid.submit_answers')
     def submit_answers(self):
         print("问卷采集已完成！")
-        print("Responses:", self.responses)
-        raw = self.responses
-        scorer = PID5Scorer(raw)
-        facet_scores, domain_scores = scorer.get_scores()
+        print("Responses:", self.responses.to_dict())
+        report_module, scorer_module = self.reporting.result()
+        with span('pid.score'):
+            facet_scores, domain_scores = self.score(scorer_module)
         print("facet_scores:", facet_scores, "domain_scores:", domain_scores)
 
         # Save to JSON
-        save_to_json(f"pid_{self.user_id}.json",
-                     {"responses": self.responses, "facet_scores": facet_scores, "domain_scores": domain_scores})
-
-        report_generator = ReportGenerator(self.user_id, facet_scores, domain_scores)
-        report_generator.generate_pdf()
+        record = self.make_record(facet_scores, domain_scores)
+        save_to_json(f"pid_{self.user_id}.json", record)
+        if self.journal is not None:
+            self.journal.compact(record)
+        if self.store is not None:
+            self.store.save_record('pid', self.user_id, record, score_record('pid', record, self.user_id))
+
+        if self.pipeline is not None:
+            self.pipeline.submit('pid', self.user_id, record, f"{self.user_id}_report.pdf")
+        else:
+            report_generator = report_module.ReportGenerator(self.user_id, facet_scores, domain_scores,
+                                                             load_norms('pid'))
+            report_generator.generate_pdf()
 
         self.close()
 
 
-def main():
-    app = QApplication(sys.argv)
+class AdaptiveSurvey(Survey):
+    """One item at a time, picked by an AdaptiveTest, until every facet is measured precisely enough.
+
+    An answer can be changed until 下一题 is pressed; after that it is part of
+    the estimate and the test moves on, so there is no going back. Each
+    confirmation is journaled under its own period, so that a resumed
+    session tells a confirmed answer from one only picked in the combo box.
+    """
+
+    CONFIRMED = 'confirmed'
+
+    def __init__(self, filename, test):
+        super().__init__(filename)
+        self.setWindowTitle("DSM-5人格量表 (PID-5) - 自适应")
+        self.test = test
+        self.questions_by_item = {question['item']: question for question in self.questions}
+        self.current_item = None
+        self.item_widget = None
+        self.prev_button.hide()
+        self.next_button.setText('下一题')  # next item
+        self.progress = QLabel()
+        self.nav_layout.insertWidget(0, self.progress)
+
+    def resume(self, answers):
+        """Replay a journal ({period: {item: value}}): the confirmed answers go into the estimate, in order.
+
+        An item answered but not confirmed is shown again as the current item, with its answer selected.
+        """
+        picked = [(item, value) for item, value in answers.get('', {}).items() if value is not None]
+        if self.CONFIRMED in answers:
+            confirmed = answers[self.CONFIRMED]
+        else:
+            # a journal without confirmations: every item before the last one was confirmed to get past it
+            confirmed = dict(picked[:-1])
+        for item, value in confirmed.items():
+            self.responses[item] = value
+            self.test.answer(item, value)
+        pending = [(item, value) for item, value in picked if item not in confirmed]
+        if pending:
+            item, value = pending[-1]
+            self.responses[item] = value
+            self.current_item = int(item)
+            self.show_item(self.current_item)
+
+    @traced('pid.show_page')
+    def show_page(self, page):
+        # the test, not the page number, decides what comes next
+        if self.current_item is None:
+            with span('pid.next_item'):
+                self.current_item = self.test.next_item()
+            if self.current_item is not None:
+                self.show_item(self.current_item)
+            else:
+                self.show_finished()
+        self.progress.setText(f"已答 {len(self.test.responses)} 题")
+        answered = self.current_item is not None and self.responses.get(str(self.current_item)) is not None
+        self.next_button.setEnabled(answered)
+        self.submit_button.setEnabled(self.current_item is None)
+
+    def replace_item_widget(self, widget):
+        if self.item_widget is not None:
+            self.pages.removeWidget(self.item_widget)
+            self.item_widget.deleteLater()
+        self.item_widget = widget
+        self.pages.addWidget(widget)
+        self.pages.setCurrentWidget(widget)
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def show_item(self, item):
+        widget = QWidget()
+        self.add_question(self.questions_by_item[str(item)], QVBoxLayout(widget))
+        self.replace_item_widget(widget)
+
+    def show_finished(self):
+        widget = QWidget()
+        QVBoxLayout(widget).addWidget(QLabel("所有题目已完成，请点击提交。"))  # all done, please submit
+        self.replace_item_widget(widget)
 
-    dialog = StartDialog()
-    if dialog.exec():
-        user_id = dialog.get_id()
-        main_window = Survey('PID-5.json')
+    def record_response(self, combo_box, question_item):
+        super().record_response(combo_box, question_item)
+        self.next_button.setEnabled(combo_box.currentData() is not None)
+
+    def show_next_page(self):
+        value = self.responses.get(str(self.current_item))
+        if value is None:
+            return
+        self.test.answer(self.current_item, value)
+        if self.journal is not None:
+            self.journal.record(str(self.current_item), value, self.CONFIRMED)
+        self.current_item = None
+        self.show_page(0)
+
+    def score(self, scorer_module):
+        return self.test.scores()
+
+    def make_record(self, facet_scores, domain_scores):
+        record = super().make_record(facet_scores, domain_scores)
+        record["adaptive"] = self.test.summary()
+        return record
+
+
+class EntrySurvey(EntryMixin, Survey):
+    """Keyboard entry of a paper form, one code per item (see common.Entry)."""
+
+    entry_key = 'pid'
+
+
+def main():
+    parser = argument_parser("DSM-5人格量表 (PID-5)")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="ask only as many items per facet as needed for a precise score (see Adaptive.py)")
+    parser.add_argument('--se', type=float, help="with --adaptive, stop a facet at this standard error (default: 0.4)")
+    args, qt_args = parser.parse_known_args()
+    if args.adaptive and args.entry:
+        parser.error("--adaptive and --entry cannot be combined: a paper form has every item")
+    bank = None
+    if args.adaptive:
+        adaptive = load_module('pid', 'Adaptive')
+        try:
+            bank = adaptive.load_bank()
+        except (OSError, ValueError, KeyError) as error:
+            # the default parameters would put made-up model estimates into the reports
+            parser.error(f"--adaptive needs a calibrated item bank; run Adaptive.py calibrate DATA_DIR first ({error})")
+    timer = StartupTimer(startup_began, enabled=args.startup_timing, expected=['first paint', 'reporting ready'])
+    timer.mark('imports')
+    if args.trace:
+        tracer.configure(args.trace, 'pid')
+        tracer.record('startup.imports', time.perf_counter() - startup_began)
+    app = QApplication(sys.argv[:1] + qt_args)
+    lag_sampler = sample_event_loop_lag()
+
+    reporting = Warmup(load_reporting, timer)
+    store = open_store(args)
+    pipeline = open_pipeline(args)
+
+    def make_survey(user_id, journal, answers):
+        if args.adaptive:
+            test = adaptive.AdaptiveTest(bank, args.se or adaptive.DEFAULT_SE)
+            main_window = AdaptiveSurvey(questions_path('pid'), test)
+            main_window.resume(answers)
+        else:
+            main_window = (EntrySurvey if args.entry else Survey)(questions_path('pid'))
+            main_window.responses.update(answers.get('', {}))
         main_window.user_id = user_id
-        main_window.show()
-        main_window.show_page(main_window.current_page)
-        sys.exit(app.exec())
+        main_window.reporting = reporting
+        main_window.store = store
+        main_window.journal = journal
+        main_window.pipeline = pipeline
+        return main_window
+
+    station = Station(args, 'pid', StartDialog, make_survey, pipeline)
+    station.start()
+    reporting.start_after_paint(station.dialog)
+    if pipeline is not None:
+        pipeline.prewarm('pid')
+    sys.exit(station.run(app))
 
 
 if __name__ == "__main__":
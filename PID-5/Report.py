@@ -1,63 +1,93 @@
-import io
-import numpy as np
-import matplotlib.pyplot as plt
+import os
+import sys
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from PIL import Image
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-from matplotlib.font_manager import FontProperties
+from reportlab.lib.utils import ImageReader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Charts import ChartCache, RadarChartRenderer, check_chart_backend, check_radar_data, draw_radar_chart
+from common.Fonts import font_service
+from common.Norms import norm_text
+from common.Trace import traced
 
 
 # set Chinese fonts manually
-font_path_regular = 'font/NotoSansSC-Regular.ttf'
-font_path_bold = 'font/NotoSansSC-Bold.ttf'
-font_path_light = 'font/NotoSansSC-Light.ttf'
-pdfmetrics.registerFont(TTFont('NotoSansSC', font_path_regular))
-pdfmetrics.registerFont(TTFont('NotoSansSC-b', font_path_bold))
-notoregu = FontProperties(fname=font_path_regular)
-notolight = FontProperties(fname=font_path_light)
+font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font')
+font_path_regular = os.path.join(font_dir, 'NotoSansSC-Regular.ttf')
+font_path_bold = os.path.join(font_dir, 'NotoSansSC-Bold.ttf')
+font_path_light = os.path.join(font_dir, 'NotoSansSC-Light.ttf')
+font_service.register('NotoSansSC', font_path_regular)
+font_service.register('NotoSansSC-b', font_path_bold)
+notoregu = font_service.properties(font_path_regular)
+notolight = font_service.properties(font_path_light)
+radar_chart = RadarChartRenderer(label_font=notolight, title_font=notoregu, cache=ChartCache())
 
 class ReportGenerator:
-    def __init__(self, user_id, facet_scores, domain_scores):
+    def __init__(self, user_id, facet_scores, domain_scores, norms=None):
         self.user_id = user_id
         self.facet_scores = facet_scores
         self.domain_scores = domain_scores
+        self.norms = norms
+
+    def norm_scores(self):
+        """{"facet:..." / "domain:...": (T, percentile)} against the norm table, empty without one."""
+        if self.norms is None:
+            return {}
+        scores = {f"facet:{facet}": score for facet, score in self.facet_scores.items()}
+        scores.update({f"domain:{domain}": score for domain, score in self.domain_scores.items()})
+        return self.norms.lookup(scores)
 
+    @traced('pid.plot_radar_chart')
     def plot_radar_chart(self, data, labels, title):
-        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
-        data += data[:1]
-        angles += angles[:1]
-
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
-        ax.fill(angles, data, color='red', alpha=0.25)
-        ax.plot(angles, data, color='red', linewidth=2)
-        ax.set_xticks(angles[:-1])
-        ax.set_xticklabels(labels, fontsize=12, rotation=45, fontproperties=notolight)
-        plt.title(title, size=15, color='black', y=1.1, fontsize=15, fontproperties=notoregu)
-
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='PNG')
-        plt.close()
-        img_data.seek(0)
-
-        img = Image.open(img_data)
-        return img
-
-    def generate_pdf(self, font_size=8):
+        return radar_chart.render(data, labels, title, rmax=3)
+
+    @staticmethod
+    def draw_score(pdf, x, y, text, norm, font_size, width):
+        """Draw a score line; the norm text goes on a line of its own when the two do not fit in width.
+
+        Returns the y of the last line drawn.
+        """
+        if norm and pdf.stringWidth(text + norm, "NotoSansSC", font_size) > width:
+            pdf.drawString(x, y, text)
+            y -= font_size * 1.3
+            pdf.drawString(x + font_size * 2, y, norm.strip())
+            return y
+        pdf.drawString(x, y, text + norm)
+        return y
+
+    @traced('pid.generate_pdf')
+    def generate_pdf(self, font_size=8, filename=None, chart_backend='matplotlib'):
+        """chart_backend is 'matplotlib' (embedded bitmaps) or 'vector' (reportlab paths)."""
+        pdf = canvas.Canvas(filename or f"{self.user_id}_report.pdf", pagesize=letter)
+        self.draw(pdf, font_size, chart_backend)
+        pdf.save()
+
+    def draw(self, pdf, font_size=8, chart_backend='matplotlib'):
+        """Draw the report on the current page of pdf, so that batch mode can put many reports in one file."""
+        check_chart_backend(chart_backend)
         facet_label = ["快感缺乏", "焦虑", "寻求关注", "麻木", "欺骗", "抑郁", "注意分散", "怪异", "情绪稳定性", "傲慢", "敌对",
                        "冲动", "亲密回避", "不负责任", "操控", "感知失调", "持续", "情感受限", "完美主义", "冒险", "分离焦虑",
                        "顺从", "多疑", "不寻常的信念与经历", "退缩"]
         domain_label = ["负性情感", "解离", "敌意", "失抑制", "精神病性"]
-        facet_chart_img = self.plot_radar_chart(list(self.facet_scores.values()), facet_label,
-                                                "特质得分")
-        domain_chart_img = self.plot_radar_chart(list(self.domain_scores.values()), domain_label,
-                                                 "维度得分")
+        # a session with unscored facets has fewer scores than spokes; refuse it before anything is drawn
+        check_radar_data(self.facet_scores, facet_label)
+        check_radar_data(self.domain_scores, domain_label)
+        if chart_backend == 'matplotlib':
+            facet_chart_img = self.plot_radar_chart(list(self.facet_scores.values()), facet_label,
+                                                    "特质得分")
+            domain_chart_img = self.plot_radar_chart(list(self.domain_scores.values()), domain_label,
+                                                     "维度得分")
+
+        norms = self.norm_scores()
 
-        pdf = canvas.Canvas(f"{self.user_id}_report.pdf", pagesize=letter)
         width, height = letter
 
         column1_x = 50
+        chart_x = 270
+        # the charts are opaque, so the score lines have to end before them
+        text_width = chart_x - 8 - column1_x
 
         pdf.setFont("NotoSansSC-b", font_size)
 
@@ -73,7 +103,8 @@ class ReportGenerator:
         y_position -= font_size * 3
         for facet, score in self.facet_scores.items():
             formatted_score = f"{score:.2f}"
-            pdf.drawString(column1_x, y_position, f"{facet}: {formatted_score}")
+            y_position = self.draw_score(pdf, column1_x, y_position, f"{facet}: {formatted_score}",
+                                         norm_text(norms, f'facet:{facet}'), font_size, text_width)
             y_position -= font_size * 1.8
 
         pdf.setFont("NotoSansSC-b", font_size)
@@ -83,16 +114,21 @@ class ReportGenerator:
         y_position -= font_size * 3
         for domain, score in self.domain_scores.items():
             formatted_score = f"{score:.2f}"
-            pdf.drawString(column1_x, y_position, f"{domain}: {formatted_score}")
+            y_position = self.draw_score(pdf, column1_x, y_position, f"{domain}: {formatted_score}",
+                                         norm_text(norms, f'domain:{domain}'), font_size, text_width)
             y_position -= font_size * 1.6
 
         image_width = 300
         image_height = 300
 
-        pdf.drawInlineImage(facet_chart_img, 270, 410, width=image_width, height=image_height)
-        pdf.drawInlineImage(domain_chart_img, 270, 80, width=image_width, height=image_height)
-
-        pdf.save()
+        if chart_backend == 'matplotlib':
+            pdf.drawImage(ImageReader(facet_chart_img), chart_x, 410, width=image_width, height=image_height)
+            pdf.drawImage(ImageReader(domain_chart_img), chart_x, 80, width=image_width, height=image_height)
+        else:
+            draw_radar_chart(pdf, list(self.facet_scores.values()), facet_label, "特质得分",
+                             chart_x, 410, image_width, image_height, rmax=3)
+            draw_radar_chart(pdf, list(self.domain_scores.values()), domain_label, "维度得分",
+                             chart_x, 80, image_width, image_height, rmax=3)
 
 
 def main():
@@ -137,4 +173,4 @@ def main():
     print(f"Report for user {user_id} has been generated.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,44 +1,68 @@
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Responses import ResponseSet
+
+N_ITEMS = 220
+
+# Scores of following items need to be reversed (3 to 0, 2 to 1, 1 to 2, and 0 to 3)
+REVERSE_ITEMS = [7, 30, 35, 58, 87, 90, 96, 97, 98, 131, 142, 155, 164, 177, 210, 215]
+
+FACETS = {
+    "快感缺乏（Anhedonia）": [1, 23, 26, 30, 124, 155, 157, 189],
+    "焦虑（Anxiousness）": [79, 93, 95, 96, 109, 110, 130, 141, 174],
+    "寻求关注（Attention Seeking）": [14, 43, 74, 111, 113, 173, 191, 211],
+    "麻木（Callousness）": [11, 13, 19, 54, 72, 73, 90, 153, 166, 183, 198, 200, 207, 208],
+    "欺骗（Deceitfulness）": [41, 53, 56, 76, 126, 134, 142, 206, 214, 218],
+    "抑郁（Depressivity）": [27, 61, 66, 81, 86, 104, 119, 148, 151, 163, 168, 169, 178, 212],
+    "注意分散（Distractibility）": [6, 29, 47, 68, 88, 118, 132, 144, 199],
+    "怪异性（Eccentricity）": [5, 21, 24, 25, 33, 52, 55, 70, 71, 152, 172, 185, 205],
+    "情绪稳定性（Emotional Lability）": [18, 62, 102, 122, 138, 165, 181],
+    "傲慢（Grandiosity）": [40, 65, 114, 179, 187, 197],
+    "敌对（Hostility）": [28, 32, 38, 85, 92, 116, 158, 170, 188, 216],
+    "冲动（Impulsivity）": [4, 16, 17, 22, 58, 204],
+    "亲密回避（Intimacy Avoidance）": [89, 97, 108, 120, 145, 203],
+    "不负责任（Irresponsibility）": [31, 129, 156, 160, 171, 201, 210],
+    "操控（Manipulativeness）": [107, 125, 162, 180, 219],
+    "感知失调（Perceptual Dysregulation）": [36, 37, 42, 44, 59, 77, 83, 154, 192, 193, 213, 217],
+    "持续性（Perseveration）": [46, 51, 60, 78, 80, 100, 121, 128, 137],
+    "情感受限（Restricted Affectivity）": [8, 45, 84, 91, 101, 167, 184],
+    "完美主义（Rigid Perfectionism）": [34, 49, 105, 115, 123, 135, 140, 176, 196, 220],
+    "冒险（Risk Taking）": [3, 7, 35, 39, 48, 67, 69, 87, 98, 112, 159, 164, 195, 215],
+    "分离焦虑（Separation Insecurity）": [12, 50, 57, 64, 127, 149, 175],
+    "顺从（Submissiveness）": [9, 15, 63, 202],
+    "多疑（Suspiciousness）": [2, 103, 117, 131, 133, 177, 190],
+    "不寻常的信念与经历（Unusual Beliefs & Experiences）": [94, 99, 106, 139, 143, 150, 194, 209],
+    "退缩（Withdrawal）": [10, 20, 75, 82, 136, 146, 147, 161, 182, 186]
+}
+DOMAIN = {
+    "负性情感（Negative Affect）": ["情绪稳定性（Emotional Lability）", "焦虑（Anxiousness）", "分离焦虑（Separation Insecurity）"],
+    "解离（Detachment）": ["退缩（Withdrawal）", "快感缺乏（Anhedonia）", "亲密回避（Intimacy Avoidance）"],
+    "敌意（Antagonism）": ["操控（Manipulativeness）", "欺骗（Deceitfulness）", "傲慢（Grandiosity）"],
+    "失抑制（Disinhibition）": ["不负责任（Irresponsibility）", "冲动（Impulsivity）", "注意分散（Distractibility）"],
+    "精神病性（Psychoticism）": ["不寻常的信念与经历（Unusual Beliefs & Experiences）", "怪异性（Eccentricity）", "感知失调（Perceptual Dysregulation）"]
+}
+
+
 class PID5Scorer:
     def __init__(self, responses):
+        self.reverse_items = REVERSE_ITEMS
+        self.facets = FACETS
+        self.domain = DOMAIN
+        if isinstance(responses, ResponseSet):
+            # the codes are already an array; score them as a batch of one, which gives the same results
+            self.responses = responses
+            facet_scores, domain_scores = batch_scorer().score(*ResponseSet.stack([responses]))
+            self.facet_scores, self.domain_scores = batch_scorer().to_dicts(facet_scores[0], domain_scores[0])
+            return
 
-        self.responses = responses
-        # Scores of following items need to be reversed (3 to 0, 2 to 1, 1 to 2, and 0 to 3)
-        self.reverse_items = [7, 30, 35, 58, 87, 90, 96, 97, 98, 131, 142, 155, 164, 177, 210, 215]
-
-        self.facets = {
-            "快感缺乏（Anhedonia）": [1, 23, 26, 30, 124, 155, 157, 189],
-            "焦虑（Anxiousness）": [79, 93, 95, 96, 109, 110, 130, 141, 174],
-            "寻求关注（Attention Seeking）": [14, 43, 74, 111, 113, 173, 191, 211],
-            "麻木（Callousness）": [11, 13, 19, 54, 72, 73, 90, 153, 166, 183, 198, 200, 207, 208],
-            "欺骗（Deceitfulness）": [41, 53, 56, 76, 126, 134, 142, 206, 214, 218],
-            "抑郁（Depressivity）": [27, 61, 66, 81, 86, 104, 119, 148, 151, 163, 168, 169, 178, 212],
-            "注意分散（Distractibility）": [6, 29, 47, 68, 88, 118, 132, 144, 199],
-            "怪异性（Eccentricity）": [5, 21, 24, 25, 33, 52, 55, 70, 71, 152, 172, 185, 205],
-            "情绪稳定性（Emotional Lability）": [18, 62, 102, 122, 138, 165, 181],
-            "傲慢（Grandiosity）": [40, 65, 114, 179, 187, 197],
-            "敌对（Hostility）": [28, 32, 38, 85, 92, 116, 158, 170, 188, 216],
-            "冲动（Impulsivity）": [4, 16, 17, 22, 58, 204],
-            "亲密回避（Intimacy Avoidance）": [89, 97, 108, 120, 145, 203],
-            "不负责任（Irresponsibility）": [31, 129, 156, 160, 171, 201, 210],
-            "操控（Manipulativeness）": [107, 125, 162, 180, 219],
-            "感知失调（Perceptual Dysregulation）": [36, 37, 42, 44, 59, 77, 83, 154, 192, 193, 213, 217],
-            "持续性（Perseveration）": [46, 51, 60, 78, 80, 100, 121, 128, 137],
-            "情感受限（Restricted Affectivity）": [8, 45, 84, 91, 101, 167, 184],
-            "完美主义（Rigid Perfectionism）": [34, 49, 105, 115, 123, 135, 140, 176, 196, 220],
-            "冒险（Risk Taking）": [3, 7, 35, 39, 48, 67, 69, 87, 98, 112, 159, 164, 195, 215],
-            "分离焦虑（Separation Insecurity）": [12, 50, 57, 64, 127, 149, 175],
-            "顺从（Submissiveness）": [9, 15, 63, 202],
-            "多疑（Suspiciousness）": [2, 103, 117, 131, 133, 177, 190],
-            "不寻常的信念与经历（Unusual Beliefs & Experiences）": [94, 99, 106, 139, 143, 150, 194, 209],
-            "退缩（Withdrawal）": [10, 20, 75, 82, 136, 146, 147, 161, 182, 186]
-        }
-        self.domain = {
-            "负性情感（Negative Affect）": ["情绪稳定性（Emotional Lability）", "焦虑（Anxiousness）", "分离焦虑（Separation Insecurity）"],
-            "解离（Detachment）": ["退缩（Withdrawal）", "快感缺乏（Anhedonia）", "亲密回避（Intimacy Avoidance）"],
-            "敌意（Antagonism）": ["操控（Manipulativeness）", "欺骗（Deceitfulness）", "傲慢（Grandiosity）"],
-            "失抑制（Disinhibition）": ["不负责任（Irresponsibility）", "冲动（Impulsivity）", "注意分散（Distractibility）"],
-            "精神病性（Psychoticism）": ["不寻常的信念与经历（Unusual Beliefs & Experiences）", "怪异性（Eccentricity）", "感知失调（Perceptual Dysregulation）"]
-        }
+        # Scored on a copy so that the caller's answers are not reverse-keyed in place
+        self.responses = dict(responses)
         self._invert_scores()
         self.facet_scores = self._calculate_facet_scores()
         self.domain_scores = self._calculate_domain_scores()
@@ -76,3 +100,86 @@ class PID5Scorer:
 
     def get_scores(self):
         return self.facet_scores, self.domain_scores
+
+
+class PID5BatchScorer:
+    """Score many respondents at once from an N x 220 response matrix.
+
+    The reverse-keying, facet and domain tables are compiled into index arrays
+    once, so scoring a batch is a handful of array operations. Results are
+    identical to PID5Scorer: a facet is the mean of its answered items only, a
+    domain is the mean of its scored facets, and unscored values are NaN.
+    """
+
+    def __init__(self):
+        self.facet_names = list(FACETS)
+        self.domain_names = list(DOMAIN)
+
+        self.reverse = np.zeros(N_ITEMS, dtype=bool)
+        self.reverse[np.array(REVERSE_ITEMS) - 1] = True
+
+        # item x facet membership, integer so that facet sums stay exact
+        self.facet_weights = np.zeros((N_ITEMS, len(FACETS)), dtype=np.int64)
+        for column, items in enumerate(FACETS.values()):
+            self.facet_weights[np.array(items) - 1, column] = 1
+
+        # domain x facet column indices, in the order PID5Scorer adds them up
+        self.domain_facets = np.array([[self.facet_names.index(facet) for facet in facets]
+                                       for facets in DOMAIN.values()])
+
+    @staticmethod
+    def to_matrix(responses_list):
+        """Stack per-respondent response dicts ({"1": 2, ...}) or ResponseSets into codes and a missing mask."""
+        if responses_list and all(isinstance(responses, ResponseSet) for responses in responses_list):
+            return ResponseSet.stack(responses_list)
+        codes = np.zeros((len(responses_list), N_ITEMS), dtype=np.uint8)
+        missing = np.ones((len(responses_list), N_ITEMS), dtype=bool)
+        for row, responses in enumerate(responses_list):
+            for item, value in responses.items():
+                if value is None:
+                    continue
+                column = int(item) - 1
+                if not 0 <= column < N_ITEMS:
+                    raise ValueError(f"PID-5 item {item!r} is not between 1 and {N_ITEMS}")
+                codes[row, column] = value
+                missing[row, column] = False
+        return codes, missing
+
+    def score(self, codes, missing=None):
+        """Return (N x 25 facet scores, N x 5 domain scores) for raw, un-reversed codes."""
+        codes = np.asarray(codes, dtype=np.int64)
+        answered = np.ones(codes.shape, dtype=bool) if missing is None else ~np.asarray(missing, dtype=bool)
+
+        keyed = np.where(self.reverse, 3 - codes, codes) * answered
+        totals = keyed @ self.facet_weights
+        counts = answered.astype(np.int64) @ self.facet_weights
+        with np.errstate(invalid='ignore', divide='ignore'):
+            facet_scores = np.where(counts > 0, totals / counts, np.nan)
+
+        domain_total = np.zeros((codes.shape[0], len(self.domain_names)))
+        domain_count = np.zeros((codes.shape[0], len(self.domain_names)), dtype=np.int64)
+        for k in range(self.domain_facets.shape[1]):
+            values = facet_scores[:, self.domain_facets[:, k]]
+            scored = ~np.isnan(values)
+            domain_total += np.where(scored, values, 0.0)
+            domain_count += scored
+        with np.errstate(invalid='ignore', divide='ignore'):
+            domain_scores = np.where(domain_count > 0, domain_total / domain_count, np.nan)
+        return facet_scores, domain_scores
+
+    def to_dicts(self, facet_row, domain_row):
+        """Convert one row of batch results into the dicts PID5Scorer.get_scores returns."""
+        facet_scores = {name: float(value) for name, value in zip(self.facet_names, facet_row) if not np.isnan(value)}
+        domain_scores = {name: float(value) for name, value in zip(self.domain_names, domain_row) if not np.isnan(value)}
+        return facet_scores, domain_scores
+
+
+_batch_scorer = None
+
+
+def batch_scorer():
+    """A PID5BatchScorer shared by the single-session scorers of this process."""
+    global _batch_scorer
+    if _batch_scorer is None:
+        _batch_scorer = PID5BatchScorer()
+    return _batch_scorer
@@ -1,55 +1,70 @@
-import io
-import json
+import os
+import sys
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-from matplotlib.font_manager import FontProperties
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Fonts import font_service
+from common.Norms import norm_text
+from common.Trace import traced
+from common.Registry import get_instrument
+from common.Responses import ResponseSet
 
 
 # set Chinese fonts manually
-font_path_regular = 'font/NotoSansSC-Regular.ttf'
-font_path_bold = 'font/NotoSansSC-Bold.ttf'
-font_path_light = 'font/NotoSansSC-Light.ttf'
-pdfmetrics.registerFont(TTFont('NotoSansSC', font_path_regular))
-pdfmetrics.registerFont(TTFont('NotoSansSC-b', font_path_bold))
-notoregu = FontProperties(fname=font_path_regular)
-notolight = FontProperties(fname=font_path_light)
+font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font')
+font_path_regular = os.path.join(font_dir, 'NotoSansSC-Regular.ttf')
+font_path_bold = os.path.join(font_dir, 'NotoSansSC-Bold.ttf')
+font_service.register('NotoSansSC', font_path_regular)
+font_service.register('NotoSansSC-b', font_path_bold)
+
+# objective support, subjective support, utilization of support
+SUBSCALES = {'objective': ['2', '13', '14'], 'subjective': ['1', '3', '4', '5', '6', '7', '8', '9'],
+             'utilization': ['10', '11', '12']}
 
 class ReportGenerator:
-    def __init__(self, user_id, num_responses, responses, ssrs_path):
+    def __init__(self, user_id, num_responses, responses, ssrs_path, norms=None):
+        """responses are the option labels to print; an item without one is printed from its code."""
         self.user_id = user_id
-        self.num_response = num_responses
-        self.responses = responses
+        self.norms = norms
+        self.responses = responses or {}
         self.file_path = ssrs_path
+        self.instrument = get_instrument('ssrs', ssrs_path)
+        self.num_response = ResponseSet.of(self.instrument, num_responses)
         self.data = self.load_data()
         
     def load_data(self):
-
-        with open(self.file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        return data
+        return self.instrument.data
 
     def description(self, item_number):
         """Retrieve the event description from data."""
-        for question in self.data['questions']:
-            if question['item'] == str(item_number):
-                return question['brief']
-        return None
+        return self.instrument.brief(item_number)
     
+    @traced('ssrs.scorer')
     def scorer(self):
-        total = sum(self.num_response.values())
-        obj = self.num_response["2"] + self.num_response["13"] + self.num_response["14"]
-        sub = (self.num_response["1"] + self.num_response["3"] + self.num_response["4"] + self.num_response["5"] +
-               self.num_response["6"] + self.num_response["7"] + self.num_response["8"] + self.num_response["9"])
-        ult = self.num_response["10"] + self.num_response["11"] + self.num_response["12"]
+        """Total and subscale sums; unanswered items add nothing (see num_response.missing())."""
+        total = self.num_response.total()
+        obj, sub, ult = (self.num_response.total(self.instrument.index(item) for item in items)
+                         for items in SUBSCALES.values())
         return total, obj, sub, ult
 
-    def generate_pdf(self, font_size=8):
+    @traced('ssrs.generate_pdf')
+    def generate_pdf(self, font_size=8, filename=None):
+        pdf = canvas.Canvas(filename or f"{self.user_id}_report.pdf", pagesize=letter)
+        self.draw(pdf, font_size)
+        pdf.save()
+
+    def draw(self, pdf, font_size=8):
+        """Draw the report on the current page of pdf, so that batch mode can put many reports in one file."""
         
         total, obj, sub, ult = self.scorer()
+        missing = self.num_response.missing()
+        # the norms are for complete questionnaires
+        norms = {} if self.norms is None or missing else self.norms.lookup(
+            {'total': total, 'objective': obj, 'subjective': sub, 'utilization': ult})
 
-        pdf = canvas.Canvas(f"{self.user_id}_report.pdf", pagesize=letter)
         width, height = letter
 
         column1_x = 50
@@ -67,19 +82,26 @@ class ReportGenerator:
         pdf.setFont("NotoSansSC", font_size)
         y_position -= font_size * 3
 
-        for item, answer in self.responses.items():
+        for item in self.instrument.items:
+            code = self.num_response.get(item)
+            answer = '未作答' if code is None else self.responses.get(item) or self.instrument.option(item, code)
             pdf.drawString(column1_x, y_position, f'{self.description(item)}  :   {answer}')
             y_position -= font_size * 1.8
+        if missing:
+            y_position -= font_size * 1
+            # items left unanswered; the scores below only add up the answered ones
+            pdf.drawString(column1_x, y_position, f'有 {len(missing)} 题未作答（第 {"、".join(missing)} 题），以下得分仅计入已作答的题目')
+            y_position -= font_size * 1.8
 
         pdf.setFont("NotoSansSC-b", font_size)
         y_position -= font_size * 1
-        pdf.drawString(column1_x, y_position, f'您的社会支持总分为: {total} （最高56分）')
+        pdf.drawString(column1_x, y_position, f'您的社会支持总分为: {total} （最高56分）{norm_text(norms, "total")}')
         y_position -= font_size * 3
-        pdf.drawString(column1_x, y_position, f'您的客观支持分为: {obj} （最高12分）')
+        pdf.drawString(column1_x, y_position, f'您的客观支持分为: {obj} （最高12分）{norm_text(norms, "objective")}')
         y_position -= font_size * 3
-        pdf.drawString(column1_x, y_position, f'您的主观支持分为: {sub} （最高32分）')
+        pdf.drawString(column1_x, y_position, f'您的主观支持分为: {sub} （最高32分）{norm_text(norms, "subjective")}')
         y_position -= font_size * 3
-        pdf.drawString(column1_x, y_position, f'您对支持的利用度为: {ult} （最高12分）')
+        pdf.drawString(column1_x, y_position, f'您对支持的利用度为: {ult} （最高12分）{norm_text(norms, "utilization")}')
         y_position -= font_size * 6
         pdf.drawString(column1_x, y_position, "客观支持是指客观可见的支持，如物质支持、社会网络、以及团体关系的存在和参与等")
         y_position -= font_size * 3
@@ -87,10 +109,13 @@ class ReportGenerator:
         y_position -= font_size * 3
         pdf.drawString(column1_x, y_position, "对社会支持的利用度是指个体对可获取的社会支持的利用意愿")
 
-        pdf.save()
+
+def main():
+    response = {'1': '一个也没有', '2': '住处经常变动，多数时间和陌生人住在一起', '3': '相互之间从不关心，只是点头之交', '4': '遇到困难可能会稍微关心', '5': '极少', '6': '全力支持', '7': '无', '8': '极少', '9': '极少', '10': '只向关系极为密切的1-2人倾诉', '14': '3-5个', '13': '3-5个', '12': '经常参加', '11': '只靠自己，不接受别人帮助'}
+    num_res = {'1': 1, '2': 2, '3': 1, '4': 2, '5': 2, '6': 4, '7': 1, '8': 2, '9': 2, '10': 2, '14': 3, '13': 3, '12': 3, '11': 1}
+    rep = ReportGenerator(1,num_res,response,'SSRS.json')
+    rep.generate_pdf()
 
 
-response = {'1': '一个也没有', '2': '住处经常变动，多数时间和陌生人住在一起', '3': '相互之间从不关心，只是点头之交', '4': '遇到困难可能会稍微关心', '5': '极少', '6': '全力支持', '7': '无', '8': '极少', '9': '极少', '10': '只向关系极为密切的1-2人倾诉', '14': '3-5个', '13': '3-5个', '12': '经常参加', '11': '只靠自己，不接受别人帮助'}
-num_res = {'1': 1, '2': 2, '3': 1, '4': 2, '5': 2, '6': 4, '7': 1, '8': 2, '9': 2, '10': 2, '14': 3, '13': 3, '12': 3, '11': 1}
-rep = ReportGenerator(1,num_res,response,'SSRS.json')
-rep.generate_pdf()
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
+import time
+startup_began = time.perf_counter()
+import os
 import sys
 import json
+import math
 from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QScrollArea, QFrame, QLineEdit, QDialog, QFormLayout
-from SsrsRepo import ReportGenerator
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from common.Entry import EntryMixin
+from common.Instruments import load_module, questions_path
+from common.Norms import load_norms
+from common.Pages import PageCache
+from common.Registry import get_instrument
+from common.Reports import score_record
+from common.Responses import ResponseSet, json_default
+from common.Startup import StartupTimer, Warmup
+from common.Station import Station, argument_parser, open_pipeline, open_store
+from common.Trace import sample_event_loop_lag, traced, tracer
 
+
+def load_reporting():
+    """Import the reporting stack (reportlab, fonts)."""
+    return load_module('ssrs', 'SsrsRepo')
+
+
+@traced('ssrs.save_to_json')
 def save_to_json(filename, data):
     with open(filename, 'w') as fp:
-        json.dump(data, fp, indent=4)
+        json.dump(data, fp, indent=4, default=json_default)
 
 
 class StartDialog(QDialog):
@@ -45,11 +68,18 @@ class Survey(QWidget):
         self.layout.addWidget(self.scroll_area)
 
         self.questions = []
-        self.responses = {}
         self.user_id = ""
+        self.reporting = Warmup(load_reporting)
+        self.store = None
+        self.journal = None
+        self.pipeline = None
 
         # Load questions from the JSON file
         self.load_questions(filename)
+        # answer codes by item position, filled in directly by the combo boxes
+        self.responses = ResponseSet(self.instrument)
+        self.pages = self.make_pages()
+        self.questions_layout.addWidget(self.pages)
 
         # Navigation buttons
         self.nav_layout = QHBoxLayout()
@@ -70,28 +100,36 @@ class Survey(QWidget):
         self.layout.addLayout(self.nav_layout)
         self.setLayout(self.layout)
 
+    @traced('ssrs.load_questions')
     def load_questions(self, filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            self.questions = data['questions']
+        self.instrument = get_instrument('ssrs', filename)
+        self.questions = self.instrument.questions
 
+    @traced('ssrs.show_page')
     def show_page(self, page):
-        for i in reversed(range(self.questions_layout.count())):
-            widget = self.questions_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setParent(None)
+        self.pages.show_page(page)
+        self.scroll_area.verticalScrollBar().setValue(0)
 
         start = page * self.questions_per_page
         end = min(start + self.questions_per_page, len(self.questions))
 
-        for question in self.questions[start:end]:
-            self.add_question(question)
-
         self.prev_button.setEnabled(page > 0)
         self.next_button.setEnabled(end < len(self.questions))
         self.submit_button.setEnabled(end >= len(self.questions))
 
-    def add_question(self, question):
+    def make_pages(self):
+        # Pages are built once and kept, so answers survive going back and forth
+        return PageCache(math.ceil(len(self.questions) / self.questions_per_page), self.build_page)
+
+    def build_page(self, page):
+        page_widget = QWidget()
+        page_layout = QVBoxLayout(page_widget)
+        start = page * self.questions_per_page
+        for question in self.questions[start:start + self.questions_per_page]:
+            self.add_question(question, page_layout)
+        return page_widget
+
+    def add_question(self, question, page_layout):
         question_frame = QFrame()
         question_layout = QVBoxLayout()
 
@@ -101,16 +139,21 @@ class Survey(QWidget):
         combo_box = QComboBox()
         combo_box.addItem("请选择最符合的一项", None)
         for option in question['options']:
-            combo_box.addItem(str(option), option)
+            combo_box.addItem(str(option), self.instrument.code(question['item'], option))
 
+        if question['item'] in self.responses:
+            combo_box.setCurrentIndex(combo_box.findData(self.responses[question['item']]))
         combo_box.currentIndexChanged.connect(lambda _, b=combo_box, q=question['item']: self.record_response(b, q))
         question_layout.addWidget(combo_box)
 
         question_frame.setLayout(question_layout)
-        self.questions_layout.addWidget(question_frame)
+        page_layout.addWidget(question_frame)
 
+    @traced('ssrs.record_response')
     def record_response(self, combo_box, question_item):
         self.responses[question_item] = combo_box.currentData()
+        if self.journal is not None:
+            self.journal.record(question_item, combo_box.currentData())
 
     def show_next_page(self):
         self.current_page += 1
@@ -121,39 +164,65 @@ class Survey(QWidget):
             self.current_page -= 1
         self.show_page(self.current_page)
 
+    @traced('ssrs.submit_answers')
     def submit_answers(self):
         print("问卷采集已完成！")
-        print("Responses:", self.responses)
-
-        mapping = {"一个也没有": 1, "1-2个": 2, "3-5个": 3, "6个或以上": 4,
-                   "远离家人，且独居一室": 1, "住处经常变动，多数时间和陌生人住在一起": 2, "和同学、同事或朋友住在一起": 3, "和家人住在一起": 4,
-                   "相互之间从不关心，只是点头之交": 1, "遇到困难可能会稍微关心": 2, "有些人很关心您": 3, "大多数人都很关心您": 4,
-                   "无": 1, "极少": 2, "一般": 3, "全力支持": 4,
-                   "从不向任何人倾诉": 1, "只向关系极为密切的1-2人倾诉": 2, "如果朋友主动询问会说出来": 3, "主动倾诉自己的烦恼以获得支持和理解": 4,
-                   "只靠自己，不接受别人帮助": 1, "很少请求别人帮助": 2, "有时请求别人帮助": 3, "有困难时经常向亲友、组织求援": 4,
-                   "从不参加": 1, "偶尔参加": 2, "经常参加": 3, "主动参加并积极活动": 4,
-                   }
-        num_responses = {key: mapping[value] for key, value in self.responses.items()}
-        print(num_responses)
-        report = ReportGenerator(self.user_id, num_responses, self.responses, 'SSRS.json')
-        report.generate_pdf()
-
-        save_to_json(f"ssrs_{self.user_id}.json", {"response": num_responses})
+        print("Responses:", self.responses.to_dict())
+
+        record = {"response": self.responses}
+        save_to_json(f"ssrs_{self.user_id}.json", record)
+        if self.journal is not None:
+            self.journal.compact(record)
+        if self.store is not None:
+            self.store.save_record('ssrs', self.user_id, record, score_record('ssrs', record, self.user_id))
+
+        if self.pipeline is not None:
+            self.pipeline.submit('ssrs', self.user_id, record, f"{self.user_id}_report.pdf")
+        else:
+            report_module = self.reporting.result()
+            report = report_module.ReportGenerator(self.user_id, self.responses, None, questions_path('ssrs'),
+                                                     load_norms('ssrs'))
+            report.generate_pdf()
 
         self.close()
 
 
-def main():
-    app = QApplication(sys.argv)
+class EntrySurvey(EntryMixin, Survey):
+    """Keyboard entry of a paper form, one code per item (see common.Entry)."""
+
+    entry_key = 'ssrs'
 
-    dialog = StartDialog()
-    if dialog.exec():
-        user_id = dialog.get_id()
-        main_window = Survey('SSRS.json')
+
+def main():
+    args, qt_args = argument_parser("社会支持评定量表（SSRS）").parse_known_args()
+    timer = StartupTimer(startup_began, enabled=args.startup_timing, expected=['first paint', 'reporting ready'])
+    timer.mark('imports')
+    if args.trace:
+        tracer.configure(args.trace, 'ssrs')
+        tracer.record('startup.imports', time.perf_counter() - startup_began)
+    app = QApplication(sys.argv[:1] + qt_args)
+    lag_sampler = sample_event_loop_lag()
+
+    reporting = Warmup(load_reporting, timer)
+    store = open_store(args)
+    pipeline = open_pipeline(args)
+
+    def make_survey(user_id, journal, answers):
+        main_window = (EntrySurvey if args.entry else Survey)(questions_path('ssrs'))
         main_window.user_id = user_id
-        main_window.show()
-        main_window.show_page(main_window.current_page)
-        sys.exit(app.exec())
+        main_window.reporting = reporting
+        main_window.store = store
+        main_window.journal = journal
+        main_window.pipeline = pipeline
+        main_window.responses.update(answers.get('', {}))
+        return main_window
+
+    station = Station(args, 'ssrs', StartDialog, make_survey, pipeline)
+    station.start()
+    reporting.start_after_paint(station.dialog)
+    if pipeline is not None:
+        pipeline.prewarm('ssrs')
+    sys.exit(station.run(app))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+"""Regenerate the PDF reports of a directory of saved sessions.
+
+    python batch_reports.py DATA_DIR [--output OUT_DIR] [--workers N] [--charts vector] [--only les pid ssrs]
+                            [--combined] [--force]
+
+Reads every les_<id>.json, pid_<id>.json and ssrs_<id>.json in DATA_DIR,
+rescores them and renders "<instrument>_<id>_report.pdf" into OUT_DIR across
+a pool of worker processes. With --combined, each instrument's reports go
+into a single "<instrument>_reports.pdf" instead, one page and bookmark per
+respondent, with fonts and chart grids embedded once. A file that fails is
+reported and skipped; the exit status is 1 if anything failed.
+
+Runs are incremental: OUT_DIR/.build_manifest.json records the hash of the
+inputs of every report built (see common/Build.py), and a report whose
+inputs hash the same and whose PDF is still there is skipped without
+reading its session. --force rebuilds everything.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from common.Archive import check_record, iter_archive, read_entry
+from common.Build import BuildManifest, combined_hash, input_hash
+from common.Reports import render_combined, render_report, rescore_pid
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate LES, PID-5 and SSRS reports from saved sessions.")
+    parser.add_argument('data_dir', help="directory with les_*.json, pid_*.json and ssrs_*.json files")
+    parser.add_argument('--output', help="where to write the PDFs (default: DATA_DIR)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes (default: CPU count)")
+    parser.add_argument('--charts', choices=['matplotlib', 'vector'],
+                        help="draw radar charts as embedded bitmaps or as PDF vector paths "
+                             "(default: matplotlib, or vector with --combined)")
+    parser.add_argument('--only', nargs='+', choices=['les', 'pid', 'ssrs'], help="limit to these instruments")
+    parser.add_argument('--combined', action='store_true',
+                        help="write one <instrument>_reports.pdf per instrument instead of a file per respondent")
+    parser.add_argument('--force', action='store_true', help="rebuild every report, even those that are up to date")
+    args = parser.parse_args(argv)
+    if args.charts is None:
+        args.charts = 'vector' if args.combined else 'matplotlib'
+    return args
+
+
+def load_jobs(entries, failures):
+    """Read every entry; PID-5 sessions are rescored together with the batch scorer.
+
+    Each PID-5 session is checked on its own first, so that a bad file is
+    reported alone instead of failing the batch it would have been scored in.
+    """
+    jobs = []
+    pid_entries, pid_sessions = [], []
+    for entry in entries:
+        try:
+            data = read_entry(entry)
+        except (OSError, ValueError) as error:
+            failures.append((entry.path, repr(error)))
+            continue
+        if entry.instrument == 'pid':
+            try:
+                check_record(entry.instrument, data)
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                failures.append((entry.path, repr(error)))
+                continue
+            pid_entries.append(entry)
+            pid_sessions.append(data)
+        else:
+            jobs.append((entry, data))
+    if pid_sessions:
+        try:
+            jobs.extend(zip(pid_entries, rescore_pid(pid_sessions)))
+        except (KeyError, TypeError, ValueError, IndexError) as error:
+            failures.extend((entry.path, repr(error)) for entry in pid_entries)
+    return jobs
+
+
+def report_filename(output_dir, entry):
+    return os.path.join(output_dir, f"{entry.instrument}_{entry.user_id}_report.pdf")
+
+
+def hash_entries(entries, chart_backend, failures):
+    """{path: input hash} of every entry; files that cannot be read are added to failures."""
+    hashes = {}
+    for entry in entries:
+        try:
+            hashes[entry.path] = input_hash(entry.instrument, entry.path, chart_backend)
+        except OSError as error:
+            failures.append((entry.path, repr(error)))
+    return hashes
+
+
+def render_combined_files(args, output_dir, entries, hashes, manifest, failures, started):
+    """--combined: one worker per instrument, each writing all of that instrument's reports into one PDF."""
+    grouped, digests, outdated = {}, {}, []
+    for entry in entries:
+        grouped.setdefault(entry.instrument, []).append(entry)
+    for instrument, group in grouped.items():
+        digests[instrument] = combined_hash(instrument, [hashes[entry.path] for entry in group])
+        if args.force or not manifest.is_current(f"{instrument}_reports.pdf", digests[instrument]):
+            outdated.extend(group)
+    jobs = load_jobs(outdated, failures)
+    sessions = {}
+    for entry, data in jobs:
+        sessions.setdefault(entry.instrument, []).append((entry.user_id, data))
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(sessions)))) as pool:
+        futures = {pool.submit(render_combined, instrument, items,
+                               os.path.join(output_dir, f"{instrument}_reports.pdf"), args.charts): instrument
+                   for instrument, items in sessions.items()}
+        for future in as_completed(futures):
+            instrument = futures[future]
+            try:
+                filename, skipped = future.result()
+            except Exception as error:
+                failures.append((f"{instrument}_reports.pdf", repr(error)))
+                print(f"FAILED {instrument}_reports.pdf: {error!r}", flush=True)
+                continue
+            failures.extend((os.path.join(args.data_dir, f"{instrument}_{user_id}.json"), error)
+                            for user_id, error in skipped)
+            rendered += len(sessions[instrument]) - len(skipped)
+            # a file missing some sessions is rebuilt next time, so that they keep being reported
+            if not skipped and len(sessions[instrument]) == len(grouped[instrument]):
+                manifest.record(filename, digests[instrument], f"{len(grouped[instrument])} sessions")
+            print(f"ok {filename}: {len(sessions[instrument]) - len(skipped)} reports", flush=True)
+    manifest.save()
+
+    elapsed = time.perf_counter() - started
+    print(f"{rendered} reports rendered into {len(sessions)} files in {elapsed:.1f}s, "
+          f"{len(grouped) - len({entry.instrument for entry in outdated})} files up to date, {len(failures)} failed.")
+    for path, error in failures:
+        print(f"  {path}: {error}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_dir = args.output or args.data_dir
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    failures = []
+    manifest = BuildManifest(output_dir)
+    entries = list(iter_archive(args.data_dir, args.only))
+    hashes = hash_entries(entries, args.charts, failures)
+    entries = [entry for entry in entries if entry.path in hashes]
+    if args.combined:
+        return render_combined_files(args, output_dir, entries, hashes, manifest, failures, started)
+
+    outdated = [entry for entry in entries
+                if args.force or not manifest.is_current(report_filename(output_dir, entry), hashes[entry.path])]
+    up_to_date = len(entries) - len(outdated)
+    jobs = load_jobs(outdated, failures)
+    total = len(jobs) + len(failures)
+    done = 0
+    for path, error in failures:
+        done += 1
+        print(f"[{done}/{total}] FAILED {os.path.basename(path)}: {error}", flush=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {}
+            for entry, data in jobs:
+                futures[pool.submit(render_report, entry.instrument, entry.user_id, data,
+                                    report_filename(output_dir, entry), args.charts)] = entry
+            for future in as_completed(futures):
+                entry = futures[future]
+                done += 1
+                try:
+                    filename = future.result()
+                except Exception as error:
+                    failures.append((entry.path, repr(error)))
+                    print(f"[{done}/{total}] FAILED {os.path.basename(entry.path)}: {error!r}", flush=True)
+                else:
+                    manifest.record(filename, hashes[entry.path], os.path.basename(entry.path))
+                    print(f"[{done}/{total}] ok {os.path.basename(entry.path)} -> {filename}", flush=True)
+    finally:
+        # keep what was built, even when the run is interrupted
+        manifest.save()
+
+    elapsed = time.perf_counter() - started
+    print(f"{total - len(failures)} of {total} reports rendered in {elapsed:.1f}s, {len(failures)} failed, "
+          f"{up_to_date} up to date.")
+    for path, error in failures:
+        print(f"  {path}: {error}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Run the intake battery (LES, SSRS, PID-5) for one participant in a single window.
+
+    python battery.py [--instruments les ssrs pid] [--report-workers N] [--db FILE] [--trace DIR]
+
+The ID is asked once. The instruments then follow each other in one window,
+using the collectors' own Survey classes, and the answers are saved and
+journaled as the collectors do it. Instrument files are found through
+common.Instruments, so the battery runs from any working directory.
+
+While the participant answers one instrument, the battery prepares the next
+one. Its survey, with the first page, is built from an idle timer on the GUI
+thread. Its reporting modules and fonts are imported on a background thread.
+The reports are held back until the last instrument is submitted, or the
+window is closed. They are then all handed to the SubmissionPipeline together
+as <key>_<id>_report.pdf (or rendered in turn with --report-workers 0).
+"""
+import time
+startup_began = time.perf_counter()
+import sys
+
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QApplication, QLabel, QStackedWidget, QVBoxLayout, QWidget
+
+from common.Instruments import load_module, questions_path
+from common.Pages import PageCache
+from common.Reports import render_report
+from common.Startup import StartupTimer, Warmup
+from common.Station import Station, argument_parser, open_journal, open_pipeline, open_store
+from common.Trace import sample_event_loop_lag, span, tracer
+
+COLLECTORS = {'les': 'Collector', 'ssrs': 'ssrs', 'pid': 'Collector'}
+ORDER = ['les', 'ssrs', 'pid']
+
+
+class DeferredReports:
+    """Takes the collectors' place of the pipeline and keeps their reports until the battery ends."""
+
+    def __init__(self):
+        self.reports = []
+
+    def submit(self, instrument, user_id, record, filename, chart_backend='matplotlib'):
+        # every collector names its report <id>_report.pdf; the battery writes three of them
+        self.reports.append((instrument, user_id, record, f"{instrument}_{user_id}_report.pdf", chart_backend))
+
+
+def make_survey(key, user_id, journal, answers, reporting, store, reports, entry=False):
+    """The collector's Survey (EntrySurvey with entry) of key, set up as the collector's own main() would."""
+    collector = load_module(key, COLLECTORS[key])
+    survey = (collector.EntrySurvey if entry else collector.Survey)(questions_path(key))
+    survey.user_id = user_id
+    survey.reporting = reporting
+    survey.store = store
+    survey.journal = journal
+    survey.pipeline = reports
+    if key == 'les':
+        survey.responses_year.update(answers.get('year', {}))
+        survey.responses_week.update(answers.get('week', {}))
+    else:
+        survey.responses.update(answers.get('', {}))
+    return survey
+
+
+class BatteryWindow(QWidget):
+    """The surveys of one participant, one after the other.
+
+    build(index) returns the Survey of the index-th instrument. When a survey
+    is submitted it closes, and the next one is shown. The survey after the
+    one on screen is built ahead, once the event loop is idle.
+    """
+
+    def __init__(self, count, build, prepare=None):
+        super().__init__()
+        self.setGeometry(100, 100, 900, 900)
+        self.count = count
+        self.build = build
+        self.prepare = prepare
+        self.surveys = {}
+        self.current = -1
+        self.closing = False
+        layout = QVBoxLayout(self)
+        self.progress = QLabel()
+        layout.addWidget(self.progress)
+        self.stack = QStackedWidget()
+        layout.addWidget(self.stack)
+
+    def survey(self, index):
+        if index not in self.surveys:
+            with span('battery.build_survey', index=index):
+                survey = self.build(index)
+                survey.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+                survey.destroyed.connect(lambda _=None, index=index: self.survey_closed(index))
+                self.stack.addWidget(survey)
+                # build the first page now, so that showing the survey only switches widgets;
+                # an entry survey has no pages to build
+                if isinstance(survey.pages, PageCache):
+                    survey.pages.page(survey.current_page)
+            self.surveys[index] = survey
+        return self.surveys[index]
+
+    def preload(self, index):
+        if index < self.count and not self.closing:
+            if self.prepare is not None:
+                self.prepare(index)
+            self.survey(index)
+
+    def advance(self):
+        """Show the next survey, or close the window after the last one."""
+        self.current += 1
+        if self.current >= self.count:
+            self.close()
+            return
+        survey = self.survey(self.current)
+        self.stack.setCurrentWidget(survey)
+        title = survey.windowTitle()
+        self.setWindowTitle(title)
+        self.progress.setText(f"第 {self.current + 1}/{self.count} 部分：{title}")  # part n of m
+        survey.show_page(survey.current_page)
+        QTimer.singleShot(0, lambda index=self.current + 1: self.preload(index))
+
+    def survey_closed(self, index):
+        self.surveys.pop(index, None)
+        if index == self.current and not self.closing:
+            self.advance()
+
+    def closeEvent(self, event):
+        # the surveys still open go down with the window; their answers stay in the journals
+        self.closing = True
+        super().closeEvent(event)
+
+
+class BatteryStation(Station):
+    """A Station whose session is the whole battery; each instrument keeps its own journal."""
+
+    def __init__(self, args, instruments, dialog_class, reporting, store, pipeline=None):
+        super().__init__(args, 'battery', dialog_class, None, pipeline)
+        self.instruments = instruments
+        self.reporting = reporting
+        self.store = store
+
+    def begin_session(self):
+        user_id = self.dialog.get_id()
+        # the resume questions all come now, before the first survey, rather than between instruments
+        sessions = [(key,) + open_journal(self.args, key, user_id) for key in self.instruments]
+        reports = DeferredReports()
+
+        def build(index):
+            key, journal, answers = sessions[index]
+            return make_survey(key, user_id, journal, answers, self.reporting[key], self.store, reports,
+                               self.args.entry)
+
+        def prepare(index):
+            self.reporting[self.instruments[index]].start()
+
+        self.survey = BatteryWindow(len(self.instruments), build, prepare)
+        self.survey.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        self.survey.destroyed.connect(lambda: self.end_session([journal for _, journal, _ in sessions], reports))
+        self.survey.show()
+        self.survey.advance()
+
+    def end_session(self, journals, reports):
+        for journal in journals:
+            journal.close()
+        for instrument, user_id, record, filename, chart_backend in reports.reports:
+            if self.pipeline is not None:
+                self.pipeline.submit(instrument, user_id, record, filename, chart_backend)
+            else:
+                self.reporting[instrument].result()
+                render_report(instrument, user_id, record, filename, chart_backend)
+        self.survey = None
+        self.start()
+
+
+def main(argv=None):
+    parser = argument_parser("心理评估组套（LES、SSRS、PID-5）")
+    parser.add_argument('--instruments', nargs='+', choices=ORDER, default=ORDER,
+                        help="instruments to run, in this order (default: les ssrs pid)")
+    args, qt_args = parser.parse_known_args(argv)
+    first = args.instruments[0]
+    timer = StartupTimer(startup_began, enabled=args.startup_timing,
+                         expected=['first paint', f"{first} reporting ready"])
+    timer.mark('imports')
+    if args.trace:
+        tracer.configure(args.trace, 'battery')
+        tracer.record('startup.imports', time.perf_counter() - startup_began)
+    app = QApplication(sys.argv[:1] + qt_args)
+    lag_sampler = sample_event_loop_lag()
+
+    reporting = {key: Warmup(load_module(key, COLLECTORS[key]).load_reporting, timer, f"{key} reporting ready")
+                 for key in args.instruments}
+    store = open_store(args)
+    pipeline = open_pipeline(args)
+
+    station = BatteryStation(args, args.instruments, load_module(first, COLLECTORS[first]).StartDialog,
+                             reporting, store, pipeline)
+    station.start()
+    reporting[first].start_after_paint(station.dialog)
+    if pipeline is not None:
+        for key in args.instruments:
+            pipeline.prewarm(key)
+    return station.run(app)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Time the hot paths on fixed synthetic inputs and compare against a saved baseline.
+
+    python benchmark.py [--only pid] [--iterations 200] [--save baseline.json]
+    python benchmark.py --compare baseline.json [--threshold 0.15]
+
+The cases cover:
+- scoring: PID5Scorer construction and get_scores, LES scocer, SSRS scorer
+- every report's plot_radar_chart and generate_pdf, with both chart backends
+- Survey.show_page of each collector, on the Qt offscreen platform
+
+Each case runs a few warm-up calls, then times every call on its own. The
+latency percentiles and throughput come from those timings. A separate short
+pass under tracemalloc records the peak memory. The inputs come from a fixed
+seed, so runs on the same machine are comparable. --compare flags every case
+whose median or p95 latency, or peak memory, grew by more than --threshold
+over the baseline, and exits with status 1 if any did.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import platform
+import tempfile
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+from common.Instruments import load_module, questions_path
+from common.Registry import get_instrument
+
+SEED = 20240501
+
+
+def synthetic_responses(key, seed=SEED):
+    """One complete, reproducible set of answer codes in the shape the collectors save."""
+    rng = random.Random(seed)
+    instrument = get_instrument(key)
+    codes = {item: rng.choice(sorted(instrument.code_options[position]))
+             for position, item in enumerate(instrument.items)}
+    if key == 'les':
+        return {'year': codes, 'week': {item: rng.choice(sorted(instrument.code_options[position]))
+                                        for position, item in enumerate(instrument.items)}}
+    return codes
+
+
+def ssrs_answer_labels(num_responses):
+    """Rebuild the option text the SSRS report prints from the saved 1-4 codes."""
+    instrument = get_instrument('ssrs')
+    return {item: instrument.option(item, code) for item, code in num_responses.items()}
+
+
+def scoring_cases():
+    scorer_module = load_module('pid', 'Scorer')
+    pid = synthetic_responses('pid')
+    scorer = scorer_module.PID5Scorer(pid)
+    les = synthetic_responses('les')
+    les_report = load_module('les', 'Report').ReportGenerator('bench', les['year'], les['week'], questions_path('les'))
+    ssrs = synthetic_responses('ssrs')
+    ssrs_report = load_module('ssrs', 'SsrsRepo').ReportGenerator('bench', ssrs, ssrs_answer_labels(ssrs),
+                                                                   questions_path('ssrs'))
+    return {
+        'pid.PID5Scorer': lambda: scorer_module.PID5Scorer(pid),
+        'pid.get_scores': scorer.get_scores,
+        'les.scocer': les_report.scocer,
+        'ssrs.scorer': ssrs_report.scorer,
+    }
+
+
+def report_cases(directory):
+    pid = synthetic_responses('pid')
+    facet_scores, domain_scores = load_module('pid', 'Scorer').PID5Scorer(pid).get_scores()
+    les = synthetic_responses('les')
+    ssrs = synthetic_responses('ssrs')
+    les_report = load_module('les', 'Report').ReportGenerator('bench', les['year'], les['week'], questions_path('les'))
+    pid_report = load_module('pid', 'Report').ReportGenerator('bench', facet_scores, domain_scores)
+    ssrs_report = load_module('ssrs', 'SsrsRepo').ReportGenerator('bench', ssrs, ssrs_answer_labels(ssrs),
+                                                                   questions_path('ssrs'))
+    category_year = list(les_report.scocer()[0].values())
+    les_labels = list(les_report.categories)
+    pid_labels = [str(index) for index in range(len(facet_scores))]
+    pdf = os.path.join(directory, 'bench_report.pdf')
+    return {
+        'les.plot_radar_chart': lambda: les_report.plot_radar_chart(category_year, les_labels, "一年"),
+        'pid.plot_radar_chart': lambda: pid_report.plot_radar_chart(list(facet_scores.values()), pid_labels, "特质"),
+        'les.generate_pdf': lambda: les_report.generate_pdf(filename=pdf),
+        'les.generate_pdf[vector]': lambda: les_report.generate_pdf(filename=pdf, chart_backend='vector'),
+        'pid.generate_pdf': lambda: pid_report.generate_pdf(filename=pdf),
+        'pid.generate_pdf[vector]': lambda: pid_report.generate_pdf(filename=pdf, chart_backend='vector'),
+        'ssrs.generate_pdf': lambda: ssrs_report.generate_pdf(filename=pdf),
+    }
+
+
+COLLECTORS = {'les': 'Collector', 'pid': 'Collector', 'ssrs': 'ssrs'}
+
+
+def page_cases(app):
+    """Flip through every page of each Survey; the first pass builds the pages, the rest is the cached flip."""
+    cases = {}
+    for key, module_name in COLLECTORS.items():
+        survey = load_module(key, module_name).Survey(questions_path(key))
+        survey.show()
+
+        def flip(survey=survey, pages=itertools.cycle(range(survey.pages.page_count))):
+            survey.show_page(next(pages))
+            app.processEvents()
+
+        cases[f"{key}.show_page"] = flip
+    return cases
+
+
+def measure(function, iterations, warmup=3, memory_iterations=5):
+    for _ in range(warmup):
+        function()
+    timings = np.empty(iterations)
+    began = time.perf_counter()
+    for index in range(iterations):
+        start = time.perf_counter_ns()
+        function()
+        timings[index] = time.perf_counter_ns() - start
+    elapsed = time.perf_counter() - began
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p90, p95, p99 = np.percentile(timings / 1e6, [50, 90, 95, 99])
+    return {'iterations': iterations, 'mean_ms': float(timings.mean() / 1e6), 'p50_ms': float(p50),
+            'p90_ms': float(p90), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(timings.max() / 1e6),
+            'ops_per_s': iterations / elapsed, 'peak_kb': peak / 1024}
+
+
+def iterations_for(name, iterations):
+    # PDF pages and bitmap charts take tens of milliseconds; fewer calls keep the run short
+    if 'generate_pdf' in name or 'plot_radar_chart' in name:
+        return max(5, iterations // 10)
+    return iterations
+
+
+def run(args):
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as directory:
+        cases = {}
+        cases.update(scoring_cases())
+        cases.update(report_cases(directory))
+        cases.update(page_cases(app))
+        results = {}
+        for name, function in cases.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            results[name] = measure(function, iterations_for(name, args.iterations))
+            result = results[name]
+            print(f"{name:28s} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+                  f"p99 {result['p99_ms']:9.3f} ms  {result['ops_per_s']:10.1f} ops/s  "
+                  f"peak {result['peak_kb']:9.1f} KB", flush=True)
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'platform': platform.platform(),
+            'created_at': time.time(), 'seed': SEED, 'cases': results}
+
+
+# below these absolute differences a change is timer or allocator noise, whatever its percentage
+NOISE_FLOOR = {'p50_ms': 0.02, 'p95_ms': 0.05, 'peak_kb': 16}
+
+
+def compare(results, baseline, threshold):
+    """Descriptions of the cases that regressed against baseline by more than threshold."""
+    regressions = []
+    for name, result in results['cases'].items():
+        reference = baseline['cases'].get(name)
+        if reference is None:
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            if result[metric] > reference[metric] * (1 + threshold) and result[metric] - reference[metric] > floor:
+                regressions.append(f"{name}: {metric} {reference[metric]:.3f} -> {result[metric]:.3f} "
+                                   f"(+{100 * (result[metric] / reference[metric] - 1):.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scoring, charts, PDF reports and survey pages.")
+    parser.add_argument('--only', nargs='+', help="run only the cases whose name contains one of these")
+    parser.add_argument('--iterations', type=int, default=200, help="timed calls per fast case")
+    parser.add_argument('--save', help="write the results to this JSON file, to use as a baseline")
+    parser.add_argument('--compare', help="baseline JSON to check the results against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed slowdown before flagging (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"Saved to {args.save}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%} against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
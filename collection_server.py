@@ -0,0 +1,421 @@
+"""Serve the LES, SSRS and PID-5 questionnaires to browsers on the local network.
+
+    python collection_server.py [--host 0.0.0.0] [--port 8080] [--data-dir DIR] [--workers N] [--db PATH]
+                                [--session-timeout SECONDS] [--report-ttl SECONDS]
+
+One asyncio process handles every participant: it serves each instrument as
+a plain HTML page, records answers as they are given (journaled like the
+desktop collectors), saves the submitted record as <key>_<id>.json (an ID
+that already has a record is refused with 409, never overwritten), and
+queues the PDF report on a bounded pool of worker processes so rendering
+never holds up request handling.
+
+A session that gets no answer for --session-timeout seconds is dropped and
+its journal closed; the journal stays on disk as an unfinished session. The
+status of a finished report is kept for --report-ttl seconds, after which
+/api/report and /reports forget it (the PDF stays in DATA_DIR/reports).
+"""
+import os
+import sys
+import json
+import html
+import time
+import asyncio
+import sqlite3
+import secrets
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures.process import BrokenProcessPool
+
+from common.Archive import safe_id
+from common.Instruments import INSTRUMENTS, load_module
+from common.Journal import SessionJournal
+from common.Registry import get_instrument
+from common.Reports import render_report, report_pool, score_record, warm_up
+from common.Responses import ResponseSet, json_default
+from common.Store import ResponseStore
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY = 64 * 1024
+
+PAGE_SCRIPT = """
+const session = document.body.dataset.session;
+async function post(path, payload) {
+  const response = await fetch(path, {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                      body: JSON.stringify(Object.assign({session: session}, payload))});
+  return response.json();
+}
+document.querySelectorAll('select').forEach(select => select.addEventListener('change', () => {
+  post('/api/answer', {item: select.dataset.item, period: select.dataset.period,
+                       code: select.value === '' ? null : Number(select.value)});
+}));
+document.getElementById('submit').addEventListener('click', async () => {
+  const result = await post('/api/submit', {});
+  document.getElementById('result').textContent = result.error || '提交成功，报告生成中。';
+  if (!result.error) { document.getElementById('submit').disabled = true; }
+});
+"""
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    def __init__(self, instrument, user_id, journal):
+        self.instrument = instrument
+        self.user_id = user_id
+        self.journal = journal
+        # one ResponseSet per period; only LES has two
+        periods = ('year', 'week') if instrument == 'les' else ('',)
+        self.responses = {period: ResponseSet(get_instrument(instrument)) for period in periods}
+        # saving while the submission is written, submitted once it is
+        self.saving = False
+        self.submitted = False
+        self.last_seen = time.monotonic()
+
+
+class CollectionServer:
+    def __init__(self, data_dir, workers=None, max_pending=None, store=None, session_timeout=3600, report_ttl=86400):
+        self.data_dir = data_dir
+        self.reports_dir = os.path.join(data_dir, 'reports')
+        self.journal_dir = os.path.join(data_dir, 'journal')
+        os.makedirs(self.reports_dir, exist_ok=True)
+        self.store = store
+        self.sessions = {}
+        self.report_status = {}
+        # report -> when it was done or failed, for forgetting it after report_ttl
+        self.report_finished = {}
+        self.session_timeout = session_timeout
+        self.report_ttl = report_ttl
+        self.pages = {}
+        # record files being written, so that two submissions of one ID cannot both pass the existence check
+        self.saving = set()
+        self.saving_lock = threading.Lock()
+        self.workers = workers
+        self.executor = report_pool(workers)
+        # reports waiting beyond this wait in the event loop, not in the executor's queue
+        self.report_slots = asyncio.Semaphore(max_pending or 2 * (workers or os.cpu_count() or 1))
+        self.pid_scorer = load_module('pid', 'Scorer')
+        for key in INSTRUMENTS:
+            self.executor.submit(warm_up, key)
+
+    # ---- HTTP plumbing ----
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {'error': 'request too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    status, payload, content_type = await self.route(method, target, body)
+                except HttpError as error:
+                    status, payload, content_type = error.status, {'error': str(error)}, None
+                except (ValueError, KeyError, TypeError) as error:
+                    status, payload, content_type = 400, {'error': repr(error)}, None
+                await self.respond(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, content_type=None, keep_alive=True):
+        if isinstance(payload, (dict, list)):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            body = payload
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        if method == 'GET':
+            if not parts:
+                return 200, self.index_page(), 'text/html; charset=utf-8'
+            if len(parts) == 1 and parts[0] in INSTRUMENTS:
+                return 200, self.start_session(parts[0], query.get('id', '')), 'text/html; charset=utf-8'
+            if parts[:2] == ['api', 'instrument'] and len(parts) == 3 and parts[2] in INSTRUMENTS:
+                instrument = get_instrument(parts[2])
+                return 200, {'items': instrument.items, 'codes': [sorted(codes.values())
+                                                                  for codes in instrument.option_codes]}, None
+            if parts[:2] == ['api', 'report'] and len(parts) == 3:
+                return 200, {'status': self.report_status.get(parts[2], 'unknown')}, None
+            if parts[0] == 'reports' and len(parts) == 2 and parts[1] in self.report_status:
+                return 200, await self.report_pdf(parts[1]), 'application/pdf'
+            raise HttpError(404, 'not found')
+        if method != 'POST':
+            raise HttpError(405, 'method not allowed')
+        payload = json.loads(body or b'{}')
+        if parts == ['api', 'session']:
+            return 200, {'session': self.open_session(payload['instrument'], payload['user_id'])}, None
+        if parts == ['api', 'answer']:
+            self.answer(payload)
+            return 200, {'ok': True}, None
+        if parts == ['api', 'submit']:
+            return 200, await self.submit(payload['session']), None
+        raise HttpError(404, 'not found')
+
+    async def report_pdf(self, report):
+        status = self.report_status[report]
+        if status != 'done':
+            # queued, rendering or failed: there is no PDF to send yet
+            raise HttpError(409, f'report {status}')
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, read_bytes, os.path.join(self.reports_dir, f"{report}.pdf"))
+        except FileNotFoundError:
+            raise HttpError(404, 'not found')
+
+    # ---- sessions ----
+
+    def open_session(self, key, user_id):
+        if key not in INSTRUMENTS or not str(user_id):
+            raise HttpError(400, 'unknown instrument or empty ID')
+        token = secrets.token_urlsafe(12)
+        journal = SessionJournal(self.journal_dir, key, f"{user_id}-{token}")
+        journal.start()
+        self.sessions[token] = Session(key, str(user_id), journal)
+        return token
+
+    def answer(self, payload):
+        session = self.sessions.get(payload.get('session'))
+        if session is None or session.saving or session.submitted:
+            raise HttpError(400, 'unknown or finished session')
+        instrument = get_instrument(session.instrument)
+        item, period, code = str(payload['item']), payload.get('period') or '', payload.get('code')
+        if period not in session.responses:
+            raise HttpError(400, f'invalid period {period!r}')
+        # bool is an int subclass, so JSON true/false would otherwise pass as the codes 1 and 0
+        valid = code is None or isinstance(code, int) and not isinstance(code, bool)
+        if item not in instrument.position or not valid:
+            raise HttpError(400, f'invalid answer {code!r} for item {item}')
+        try:
+            session.responses[period][item] = code
+        except ValueError:
+            raise HttpError(400, f'invalid answer {code!r} for item {item}')
+        session.journal.record(item, code, period)
+        session.last_seen = time.monotonic()
+
+    def make_record(self, session):
+        if session.instrument == 'les':
+            return {'year': session.responses['year'], 'week': session.responses['week']}
+        if session.instrument == 'pid':
+            responses = session.responses['']
+            facet_scores, domain_scores = self.pid_scorer.PID5Scorer(responses).get_scores()
+            return {'responses': responses, 'facet_scores': facet_scores, 'domain_scores': domain_scores}
+        return {'response': session.responses['']}
+
+    async def submit(self, token):
+        session = self.sessions.get(token)
+        if session is None or session.saving or session.submitted:
+            raise HttpError(400, 'unknown or finished session')
+        record = self.make_record(session)
+        session.saving = True
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.save, session, record)
+        except (OSError, sqlite3.Error) as error:
+            # nothing was kept, so the participant can submit again
+            print(f"Saving {session.instrument} {session.user_id} failed: {error!r}", flush=True)
+            raise HttpError(500, f'could not save the record: {error!r}')
+        finally:
+            session.saving = False
+        session.submitted = True
+        report = f"{session.instrument}_{safe_id(session.user_id)}_{token}"
+        self.report_status[report] = 'queued'
+        asyncio.create_task(self.generate_report(session, record, report))
+        del self.sessions[token]
+        return {'report': report, 'scores': {key: value for key, value in record.items() if key.endswith('scores')}}
+
+    def save(self, session, record):
+        """Blocking part of a submission, run on a thread: the JSON file, the database and the journal.
+
+        An ID that already has a record file is refused rather than overwritten. The file is written to a
+        temporary name and moved into place once the database has the session, so a failed save keeps nothing.
+        """
+        path = os.path.join(self.data_dir, f"{session.instrument}_{safe_id(session.user_id)}.json")
+        with self.saving_lock:
+            if path in self.saving or os.path.exists(path):
+                raise HttpError(409, f'a record for ID {session.user_id} is already saved')
+            self.saving.add(path)
+        temporary = f"{path}.tmp"
+        try:
+            with open(temporary, 'w') as fp:
+                json.dump(record, fp, indent=4, default=json_default)
+                fp.flush()
+                os.fsync(fp.fileno())
+            if self.store is not None:
+                self.store.save_record(session.instrument, session.user_id, record,
+                                       score_record(session.instrument, record, session.user_id),
+                                       source='collection_server')
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        finally:
+            with self.saving_lock:
+                self.saving.discard(path)
+        session.journal.compact(record)
+
+    async def generate_report(self, session, record, report):
+        loop = asyncio.get_running_loop()
+        arguments = (render_report, session.instrument, session.user_id, record,
+                     os.path.join(self.reports_dir, f"{report}.pdf"))
+        async with self.report_slots:
+            self.report_status[report] = 'rendering'
+            try:
+                executor = self.executor
+                try:
+                    await loop.run_in_executor(executor, *arguments)
+                except BrokenProcessPool:
+                    # a worker died (killed, out of memory) and the pool refuses all work; replace it and retry once
+                    self.restart_executor(executor)
+                    await loop.run_in_executor(self.executor, *arguments)
+            except Exception as error:
+                self.report_status[report] = f'failed: {error!r}'
+                print(f"Report {report} failed: {error!r}", flush=True)
+            else:
+                self.report_status[report] = 'done'
+            self.report_finished[report] = time.monotonic()
+
+    def restart_executor(self, broken):
+        # every report that was in the broken pool gets here; only the first one replaces it
+        if self.executor is broken:
+            print("The report workers stopped; restarting them.", flush=True)
+            broken.shutdown(wait=False)
+            self.executor = report_pool(self.workers)
+
+    async def expire(self, interval=60):
+        """Every interval seconds, drop the idle sessions and forget the report statuses past report_ttl."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            idle = [token for token, session in self.sessions.items()
+                    if not (session.saving or session.submitted) and now - session.last_seen > self.session_timeout]
+            for token in idle:
+                session = self.sessions.pop(token)
+                # close() joins the writer thread after its last batch; that can wait on the disk
+                await loop.run_in_executor(None, session.journal.close)
+            for report, finished in list(self.report_finished.items()):
+                if now - finished > self.report_ttl:
+                    del self.report_finished[report]
+                    self.report_status.pop(report, None)
+
+    # ---- pages ----
+
+    def index_page(self):
+        links = "".join(f'<li><a href="/{key}">{html.escape(get_instrument(key).title)}</a></li>'
+                        for key in INSTRUMENTS)
+        return (f'<!doctype html><html><head><meta charset="utf-8"><title>问卷</title></head><body>'
+                f'<ul>{links}</ul></body></html>').encode('utf-8')
+
+    def start_session(self, key, user_id):
+        if not user_id:
+            title = html.escape(get_instrument(key).title)
+            return (f'<!doctype html><html><head><meta charset="utf-8"><title>{title}</title></head><body>'
+                    f'<h1>{title}</h1><form><label>ID: <input name="id" required></label>'
+                    f'<button>OK</button></form></body></html>').encode('utf-8')
+        token = self.open_session(key, user_id)
+        before, after = self.questionnaire(key)
+        return before + html.escape(token).encode('utf-8') + after
+
+    def questionnaire(self, key):
+        """The questionnaire page for key, split where the session token goes; built once."""
+        if key not in self.pages:
+            instrument = get_instrument(key)
+            periods = [('year', '请选择一年以来最符合真实情况的一项'), ('week', '请选择一周以来最符合真实情况的一项')] \
+                if key == 'les' else [('', '请选择最符合的一项')]
+            questions = []
+            for position, item in enumerate(instrument.items):
+                question = instrument.questions[position]
+                text = html.escape(f"{item}. {instrument.descriptions[position]}")
+                if 'english' in question:
+                    text += f"<br><small>{html.escape(question['english'])}</small>"
+                selects = ""
+                for period, prompt in periods:
+                    options = "".join(f'<option value="{code}">{html.escape(str(option))}</option>'
+                                      for option, code in instrument.option_codes[position].items())
+                    selects += (f'<select data-item="{item}" data-period="{period}">'
+                                f'<option value="">{prompt}</option>{options}</select> ')
+                questions.append(f'<p>{text}<br>{selects}</p>')
+            title = html.escape(instrument.title)
+            page = (f'<!doctype html><html><head><meta charset="utf-8"><title>{title}</title></head>'
+                    f'<body data-session="\0"><h1>{title}</h1>{"".join(questions)}'
+                    f'<button id="submit">提交</button><p id="result"></p><script>{PAGE_SCRIPT}</script></body></html>')
+            before, after = page.split('\0')
+            self.pages[key] = (before.encode('utf-8'), after.encode('utf-8'))
+        return self.pages[key]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the questionnaires to browsers on the local network.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--data-dir', default='collected', help="where records, journals and reports go")
+    parser.add_argument('--workers', type=int, default=None, help="report worker processes (default: CPU count)")
+    parser.add_argument('--db', help="also store each submission in this SQLite database")
+    parser.add_argument('--session-timeout', type=float, default=3600,
+                        help="drop a session after this many seconds without an answer (default: 3600)")
+    parser.add_argument('--report-ttl', type=float, default=86400,
+                        help="forget a finished report's status after this many seconds (default: 86400)")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    server = CollectionServer(args.data_dir, args.workers, store=ResponseStore(args.db) if args.db else None,
+                              session_timeout=args.session_timeout, report_ttl=args.report_ttl)
+    listener = await asyncio.start_server(server.handle_connection, args.host, args.port, limit=MAX_BODY)
+    expiry = asyncio.create_task(server.expire(min(60.0, args.session_timeout, args.report_ttl)))
+    print(f"Serving on http://{args.host}:{args.port}/", flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        expiry.cancel()
+        server.executor.shutdown(wait=True)
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import re
+import json
+from collections import namedtuple
+
+from common.Registry import get_instrument
+
+# les_<id>.json, pid_<id>.json and ssrs_<id>.json as written by the collectors' save_to_json
+ARCHIVE_PATTERN = re.compile(r'^(les|pid|ssrs)_(.+)\.json$')
+
+ArchiveEntry = namedtuple('ArchiveEntry', ['instrument', 'user_id', 'path'])
+
+
+def safe_id(user_id):
+    """user_id reduced to characters that are safe in a file name."""
+    return "".join(char if char.isalnum() or char in '-_.' else '_' for char in str(user_id))
+
+
+def iter_archive(directory, instruments=None):
+    """Yield an ArchiveEntry for every saved session in directory, sorted by file name."""
+    for name in sorted(os.listdir(directory)):
+        match = ARCHIVE_PATTERN.match(name)
+        if match is None:
+            continue
+        instrument, user_id = match.groups()
+        if instruments is not None and instrument not in instruments:
+            continue
+        yield ArchiveEntry(instrument, user_id, os.path.join(directory, name))
+
+
+def read_entry(entry):
+    with open(entry.path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def record_responses(instrument, data):
+    """The item codes of a saved record as {period: {item: code}}; only LES has two periods."""
+    if instrument == 'les':
+        return {'year': data['year'], 'week': data['week']}
+    if instrument == 'pid':
+        return {'': data['responses']}
+    if instrument == 'ssrs':
+        return {'': data['response']}
+    raise ValueError(f"unknown instrument: {instrument}")
+
+
+def check_record(instrument, data):
+    """Raise ValueError unless every answer of a saved record is an item of the instrument with one of its codes."""
+    registry = get_instrument(instrument)
+    for answers in record_responses(instrument, data).values():
+        if not isinstance(answers, dict):
+            raise ValueError(f"{instrument}: answers must be an object, not {type(answers).__name__}")
+        for item, code in answers.items():
+            if code is None:
+                continue
+            position = registry.position.get(str(item))
+            if position is None:
+                raise ValueError(f"{instrument}: unknown item {item!r}")
+            # bool is an int subclass: true/false must not pass as the codes 1 and 0
+            if isinstance(code, bool) or not isinstance(code, int) or code not in registry.code_options[position]:
+                raise ValueError(f"{instrument} item {item}: invalid code {code!r}")
+
+
+def record_scores(instrument, data):
+    """Scores saved in a record, flattened to {name: value}; PID-5 names are prefixed facet:/domain:."""
+    if instrument == 'pid':
+        scores = {f"facet:{name}": value for name, value in data.get('facet_scores', {}).items()}
+        scores.update({f"domain:{name}": value for name, value in data.get('domain_scores', {}).items()})
+        return scores
+    return dict(data.get('scores', {}))
+
+
+def make_record(instrument, responses, scores=None):
+    """Inverse of record_responses/record_scores: the dict save_to_json writes for instrument."""
+    scores = scores or {}
+    if instrument == 'les':
+        return {'year': responses.get('year', {}), 'week': responses.get('week', {})}
+    if instrument == 'pid':
+        return {'responses': responses.get('', {}),
+                'facet_scores': {name[6:]: value for name, value in scores.items() if name.startswith('facet:')},
+                'domain_scores': {name[7:]: value for name, value in scores.items() if name.startswith('domain:')}}
+    if instrument == 'ssrs':
+        return {'response': responses.get('', {})}
+    raise ValueError(f"unknown instrument: {instrument}")
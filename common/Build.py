@@ -0,0 +1,108 @@
+"""Build manifest for incremental report runs.
+
+Every report is recorded with a SHA-256 over everything that goes into it:
+- the saved response file
+- the instrument JSON
+- the source of the report module, of the PID-5 scorer and, for the
+  instruments with radar charts, of common/Charts.py; the scoring tables
+  live in these files too
+- the norm table, when there is one
+- the chart backend
+batch_reports.py only renders the reports whose hash changed or whose PDF is
+gone, so any edit to the scoring or the layout rebuilds every report of that
+instrument on the next run.
+"""
+import os
+import json
+import hashlib
+
+from common.Instruments import INSTRUMENTS, instrument_dir, questions_path
+from common.Norms import norms_path
+
+MANIFEST_NAME = '.build_manifest.json'
+MANIFEST_VERSION = 1
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_files(instrument):
+    """The code an instrument's reports are scored and drawn by."""
+    modules = [INSTRUMENTS[instrument]['report']] + ([INSTRUMENTS[instrument]['scorer']]
+                                                     if 'scorer' in INSTRUMENTS[instrument] else [])
+    paths = [os.path.join(instrument_dir(instrument), f"{module}.py") for module in modules]
+    if instrument != 'ssrs':
+        paths.append(os.path.join(COMMON_DIR, 'Charts.py'))
+    return paths
+
+
+_instrument_digests = {}
+
+
+def instrument_digest(instrument, chart_backend):
+    """Hash of the inputs shared by every report of an instrument; computed once per process and backend."""
+    key = (instrument, chart_backend)
+    if key not in _instrument_digests:
+        norms = norms_path(instrument)
+        parts = {
+            'instrument': file_digest(questions_path(instrument)),
+            'sources': [file_digest(path) for path in source_files(instrument)],
+            'norms': file_digest(norms) if os.path.exists(norms) else None,
+            'backend': chart_backend if instrument != 'ssrs' else None,
+        }
+        _instrument_digests[key] = hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True)
+                                                  .encode('utf-8')).hexdigest()
+    return _instrument_digests[key]
+
+
+def input_hash(instrument, response_path, chart_backend='matplotlib'):
+    """The hash recorded in the manifest for the report of one saved response file."""
+    digest = hashlib.sha256(instrument_digest(instrument, chart_backend).encode('ascii'))
+    digest.update(file_digest(response_path).encode('ascii'))
+    return digest.hexdigest()
+
+
+def combined_hash(instrument, hashes):
+    """The hash of a combined PDF, from the input hashes of the reports it holds, in page order."""
+    digest = hashlib.sha256(instrument.encode('utf-8'))
+    for value in hashes:
+        digest.update(value.encode('ascii'))
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """{report file name: {"hash": ..., "source": ...}} kept as JSON next to the reports."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.reports = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.reports = data.get('reports', {})
+
+    def is_current(self, filename, digest):
+        """True if filename was built from inputs with this hash and is still there."""
+        entry = self.reports.get(os.path.basename(filename))
+        return (entry is not None and entry['hash'] == digest
+                and os.path.exists(os.path.join(self.output_dir, os.path.basename(filename))))
+
+    def record(self, filename, digest, source=None):
+        self.reports[os.path.basename(filename)] = {'hash': digest, 'source': source}
+
+    def save(self):
+        """Write the manifest through a temporary file, so an interrupted run never leaves half of it."""
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'version': MANIFEST_VERSION, 'reports': self.reports}, file, ensure_ascii=False, indent=1)
+        os.replace(temporary, self.path)
@@ -0,0 +1,7 @@
+import os
+
+
+def cache_dir(name):
+    """Per-user cache directory for name, e.g. ~/.cache/SurveyCollector/fonts."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'SurveyCollector', name)
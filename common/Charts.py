@@ -0,0 +1,339 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import MaxNLocator
+from PIL import Image
+
+from common.Cache import cache_dir
+
+# bump when the look of the charts changes, so cached images and built reports are redone
+CHART_VERSION = 1
+
+
+class ChartCache:
+    """Rendered charts on disk, named by the hash of everything that goes into them.
+
+    Charts with the same data, labels, title, scale, size and fonts are the
+    same image, so a chart is rendered once and then read back, also by other
+    processes and later runs. When the directory grows past max_bytes, the
+    least recently used images are deleted until it is back under 90% of it.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get('SURVEY_CHART_CACHE') or cache_dir('charts')
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('SURVEY_CHART_CACHE_MB', 64)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(repr((CHART_VERSION,) + parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with Image.open(path) as image:
+                image.load()
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            image.save(temporary, format='PNG', compress_level=1)
+            os.replace(temporary, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if self._size is None:
+            self._size = self.total_size()
+        else:
+            self._size += size
+        if self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def entries(self):
+        """(last use, size, path) of every cached image."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith('.png'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def total_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, target):
+        """Delete the least recently used images until the cache holds at most target bytes."""
+        entries = sorted(self.entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
+
+
+
+class RadarChartRenderer:
+    """Radar charts drawn from cached templates on an object-oriented Agg canvas.
+
+    The polar grid, rotated CJK labels and title are drawn once per
+    (labels, title, radius) and kept as a bitmap; each render restores that
+    bitmap and only draws the data polygon on top. No pyplot state is used and
+    the result goes straight from the Agg buffer to PIL without a PNG round trip.
+    """
+
+    def __init__(self, label_font=None, title_font=None, max_templates=8, figsize=(6, 6), cache=None):
+        self.label_font = label_font
+        self.title_font = title_font
+        self.max_templates = max_templates
+        self.figsize = figsize
+        self.cache = cache
+        self.timings = deque(maxlen=1000)
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def nice_limit(data):
+        """Round the largest value up to a tick so that similar charts share a template."""
+        top = max(data) if len(data) else 0
+        if top <= 0:
+            return 1.0
+        return float(MaxNLocator(steps=[1, 2, 2.5, 5, 10]).tick_values(0, top * 1.05)[-1])
+
+    def _template(self, labels, title, rmax):
+        key = (tuple(labels), title, rmax)
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            return template
+
+        fig = Figure(figsize=self.figsize)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(polar=True)
+        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False)
+        closed = np.append(angles, angles[:1])
+        fill = ax.fill(closed, np.zeros(len(closed)), color='red', alpha=0.25)[0]
+        line = ax.plot(closed, np.zeros(len(closed)), color='red', linewidth=2)[0]
+        ax.set_xticks(angles)
+        ax.set_xticklabels(labels, fontsize=12, rotation=45, fontproperties=self.label_font)
+        ax.set_ylim(0, rmax)
+        ax.set_title(title, size=15, color='black', y=1.1, fontproperties=self.title_font)
+
+        fill.set_visible(False)
+        line.set_visible(False)
+        canvas.draw()
+        background = canvas.copy_from_bbox(fig.bbox)
+        fill.set_visible(True)
+        line.set_visible(True)
+
+        template = (canvas, ax, fill, line, closed, background)
+        self._templates[key] = template
+        if len(self._templates) > self.max_templates:
+            self._templates.popitem(last=False)
+        return template
+
+    def cache_key(self, values, labels, title, rmax):
+        fonts = tuple(font.get_file() if font is not None else None for font in (self.label_font, self.title_font))
+        return ChartCache.key(values.tolist(), list(labels), title, float(rmax), tuple(self.figsize), fonts)
+
+    def render(self, data, labels, title, rmax=None):
+        """Return the chart for data as an RGBA PIL image, from the chart cache when it has it."""
+        started = time.perf_counter()
+        check_radar_data(data, labels)
+        values = np.asarray(data, dtype=float)
+        if rmax is None:
+            rmax = self.nice_limit(values)
+        if self.cache is not None:
+            key = self.cache_key(values, labels, title, rmax)
+            image = self.cache.get(key)
+            if image is not None:
+                self.timings.append(time.perf_counter() - started)
+                return image
+        with self._lock:
+            canvas, ax, fill, line, closed, background = self._template(labels, title, rmax)
+            polygon = np.column_stack([closed, np.append(values, values[:1])])
+            canvas.restore_region(background)
+            fill.set_xy(polygon)
+            line.set_data(polygon[:, 0], polygon[:, 1])
+            ax.draw_artist(fill)
+            ax.draw_artist(line)
+            width, height = canvas.get_width_height()
+            image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).copy()
+        if self.cache is not None:
+            self.cache.put(key, image)
+        self.timings.append(time.perf_counter() - started)
+        return image
+
+    def latency_summary(self):
+        """Count, mean, median and max render time in milliseconds."""
+        if not self.timings:
+            return {'count': 0}
+        timings = np.array(self.timings) * 1000
+        return {'count': len(timings), 'mean_ms': float(timings.mean()),
+                'p50_ms': float(np.median(timings)), 'max_ms': float(timings.max())}
+
+
+def check_chart_backend(chart_backend):
+    """Raise ValueError unless chart_backend is 'matplotlib' (embedded bitmaps) or 'vector' (reportlab paths)."""
+    if chart_backend not in ('matplotlib', 'vector'):
+        raise ValueError(f"unknown chart_backend {chart_backend!r}")
+
+
+def check_radar_data(data, labels):
+    """Raise ValueError unless there is one value per label; the values are paired with the spokes by position."""
+    if len(data) != len(labels):
+        raise ValueError(f"radar chart: {len(data)} values for {len(labels)} labels")
+
+
+def draw_radar_chart(pdf, data, labels, title, x, y, width, height, font='NotoSansSC', rmax=None):
+    """Draw a radar chart as vector paths on a reportlab canvas, in the box at (x, y).
+
+    Mirrors the matplotlib chart (polar grid, red polygon, labels around the
+    rim, title on top) but stays text and paths, so nothing is rasterized and
+    the chart prints sharply. Only the polygon is drawn per chart; the rest is
+    a form shared by every chart with the same layout in the document.
+    """
+    check_radar_data(data, labels)
+    values = np.asarray(data, dtype=float)
+    if rmax is None:
+        rmax = RadarChartRenderer.nice_limit(values)
+    size = min(width, height)
+    radius = size * 0.385
+    cx, cy = x + width * 0.51, y + height * 0.495
+    angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False)
+    ticks = [tick for tick in MaxNLocator(steps=[1, 2, 2.5, 5, 10]).tick_values(0, rmax) if 0 < tick <= rmax]
+
+    # the grid, labels and title depend only on the layout, so they are drawn once per document as a
+    # form XObject and reused by every chart of that layout (all respondents in a batch PDF)
+    form = "radar-" + hashlib.md5(repr((list(labels), title, float(rmax), x, y, width, height, font))
+                                  .encode('utf-8')).hexdigest()
+    if not pdf.hasForm(form):
+        pdf.beginForm(form)
+        pdf.setLineWidth(0.4)
+        pdf.setStrokeColorRGB(0.69, 0.69, 0.69)
+        for tick in ticks:
+            if tick < rmax:
+                pdf.circle(cx, cy, radius * tick / rmax, stroke=1, fill=0)
+        for angle in angles:
+            pdf.line(cx, cy, cx + radius * np.cos(angle), cy + radius * np.sin(angle))
+        pdf.setStrokeColorRGB(0, 0, 0)
+        pdf.setLineWidth(0.6)
+        pdf.circle(cx, cy, radius, stroke=1, fill=0)
+
+        pdf.setFillColorRGB(0, 0, 0)
+        pdf.setFont(font, size * 0.023)
+        label_angle = np.radians(22.5)
+        for tick in ticks:
+            r = radius * tick / rmax
+            pdf.drawString(cx + r * np.cos(label_angle) + 1, cy + r * np.sin(label_angle) + 1, f"{tick:g}")
+
+        label_size = size * 0.028
+        pdf.setFont(font, label_size)
+        for angle, label in zip(angles, labels):
+            lx = cx + (radius + label_size * 1.2) * np.cos(angle)
+            ly = cy + (radius + label_size * 1.2) * np.sin(angle) - label_size * 0.35
+            if abs(np.cos(angle)) < 0.2:
+                pdf.drawCentredString(lx, ly, label)
+            elif np.cos(angle) > 0:
+                pdf.drawString(lx, ly, label)
+            else:
+                pdf.drawRightString(lx, ly, label)
+
+        title_size = size * 0.035
+        pdf.setFont(font, title_size)
+        pdf.drawCentredString(cx, cy + radius * 1.2 + label_size, title)
+        pdf.endForm()
+    pdf.saveState()
+    pdf.doForm(form)
+
+    if len(values):
+        path = pdf.beginPath()
+        points = [(cx + radius * min(value, rmax) / rmax * np.cos(angle),
+                   cy + radius * min(value, rmax) / rmax * np.sin(angle)) for value, angle in zip(values, angles)]
+        path.moveTo(*points[0])
+        for point in points[1:]:
+            path.lineTo(*point)
+        path.close()
+        pdf.setFillColorRGB(1, 0, 0)
+        pdf.setStrokeColorRGB(1, 0, 0)
+        pdf.setFillAlpha(0.25)
+        pdf.drawPath(path, stroke=0, fill=1)
+        pdf.setFillAlpha(1)
+        pdf.setLineWidth(1)
+        pdf.setLineJoin(1)
+        pdf.drawPath(path, stroke=1, fill=0)
+    pdf.restoreState()
+
+
+def main():
+    """Compare the template renderer with a fresh pyplot figure per chart."""
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    labels = [f"facet {i}" for i in range(25)]
+    rng = np.random.default_rng(0)
+    samples = [rng.uniform(0, 3, len(labels)).tolist() for _ in range(30)]
+
+    renderer = RadarChartRenderer()
+    for data in samples:
+        renderer.render(data, labels, "facets", rmax=3)
+
+    pyplot_timings = []
+    for data in samples:
+        started = time.perf_counter()
+        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
+        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
+        ax.fill(angles + angles[:1], data + data[:1], color='red', alpha=0.25)
+        ax.plot(angles + angles[:1], data + data[:1], color='red', linewidth=2)
+        ax.set_xticks(angles)
+        ax.set_xticklabels(labels, fontsize=12, rotation=45)
+        plt.title("facets", size=15, color='black', y=1.1)
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format='PNG')
+        plt.close(fig)
+        buffer.seek(0)
+        Image.open(buffer).load()
+        pyplot_timings.append((time.perf_counter() - started) * 1000)
+
+    print("template renderer:", renderer.latency_summary())
+    print(f"pyplot per chart: mean_ms={np.mean(pyplot_timings):.1f} p50_ms={np.median(pyplot_timings):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Keyboard data entry of paper forms, for the collectors' --entry mode.
+
+The whole form is one row of slots, one per item (two per LES item: year,
+then week). Typing a digit stores it as the code of the slot under the
+cursor and moves to the next slot; "." or "-" leaves a slot blank,
+Backspace clears the previous one, and the arrow, Home and End keys move
+without changing anything. A pasted string such as "0123301..." fills the
+slots from the cursor on; spaces, commas and line breaks in it are ignored.
+Every character is checked against the codes its item allows before
+anything is stored, so a bad paste changes nothing and names the first
+offending character. Ctrl+Enter submits.
+
+Nothing is paged: the prompt, the overview of all codes and the status line
+are labels updated in place. The status line shows the items keyed per
+minute, from the first key of the form. On submission, finish() prints that
+rate with the running total of the station and logs it as an entry.form span.
+
+EntryMixin turns a collector's Survey into the entry window of its --entry mode.
+"""
+import time
+
+from PyQt6.QtCore import Qt, pyqtSignal
+from PyQt6.QtGui import QFontDatabase, QKeySequence
+from PyQt6.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget
+
+from common.Trace import tracer
+
+BLANK = '.-'
+IGNORED = ' \t\r\n,'
+PERIOD_NAMES = {'': '', 'year': '一年内', 'week': '一周内'}
+ITEMS_PER_ROW = 10
+
+# forms, items and seconds entered at this station so far
+totals = {'forms': 0, 'items': 0, 'seconds': 0.0}
+
+
+class EntryPanel(QWidget):
+    """Digit entry into the ResponseSets of one session.
+
+    responses maps each period ('' except for LES) to its ResponseSet.
+    record(item, code, period) is called for every stored or cleared code,
+    so that the collector can journal it.
+    """
+
+    submit_requested = pyqtSignal()
+
+    def __init__(self, instrument, responses, record=None, parent=None):
+        super().__init__(parent)
+        self.instrument = instrument
+        self.responses = responses
+        self.record = record
+        self.slots = [(period, position) for position in range(len(instrument)) for period in responses]
+        self.cursor = 0
+        self.keyed = 0
+        self.started = None
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+        layout = QVBoxLayout(self)
+        self.prompt = QLabel()
+        self.prompt.setWordWrap(True)
+        layout.addWidget(self.prompt)
+        self.error = QLabel()
+        self.error.setStyleSheet("color: #c62828")
+        layout.addWidget(self.error)
+        self.overview = QLabel()
+        self.overview.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.overview.setTextFormat(Qt.TextFormat.RichText)
+        layout.addWidget(self.overview)
+        self.status = QLabel()
+        layout.addWidget(self.status)
+        layout.addStretch()
+
+    def start(self):
+        """Put the cursor on the first blank slot (after a resume) and take the keyboard."""
+        self.cursor = next((slot for slot in range(len(self.slots)) if self.code(slot) is None), len(self.slots))
+        self.refresh()
+        self.setFocus()
+
+    def code(self, slot):
+        period, position = self.slots[slot]
+        return self.responses[period].code_at(position)
+
+    def slot_name(self, slot):
+        period, position = self.slots[slot]
+        name = f"第 {self.instrument.items[position]} 题"  # item n
+        return f"{name}（{PERIOD_NAMES[period]}）" if period else name
+
+    def parse(self, text):
+        """The codes text gives the slots from the cursor on; ValueError names the first character that does not fit."""
+        codes = []
+        for char in text:
+            if char in IGNORED:
+                continue
+            slot = self.cursor + len(codes)
+            if slot >= len(self.slots):
+                raise ValueError(f"“{char}” 超出了最后一题")  # past the last item
+            if char in BLANK:
+                codes.append(None)
+                continue
+            valid = self.instrument.code_options[self.slots[slot][1]]
+            if char not in '0123456789' or int(char) not in valid:
+                raise ValueError(f"{self.slot_name(slot)}：“{char}” 不在 {min(valid)}–{max(valid)} 之内")
+            codes.append(int(char))
+        return codes
+
+    def store(self, slot, code):
+        period, position = self.slots[slot]
+        self.responses[period].set_code(position, code)
+        if self.record is not None:
+            self.record(self.instrument.items[position], code, period)
+
+    def enter(self, text):
+        """Store the codes of text from the cursor on, or nothing if any of them is invalid."""
+        try:
+            codes = self.parse(text)
+        except ValueError as error:
+            self.error.setText(str(error))
+            QApplication.beep()
+            return False
+        if self.started is None:
+            self.started = time.perf_counter()
+        for code in codes:
+            self.store(self.cursor, code)
+            self.cursor += 1
+        self.keyed += len(codes)
+        self.error.setText("")
+        self.refresh()
+        return True
+
+    def move(self, step):
+        # the cursor may stand after the last slot, once the form is through
+        self.cursor = max(0, min(len(self.slots), self.cursor + step))
+        self.refresh()
+
+    def keyPressEvent(self, event):
+        key, text = event.key(), event.text()
+        if event.matches(QKeySequence.StandardKey.Paste):
+            self.enter(QApplication.clipboard().text())
+        elif key in (Qt.Key.Key_Return, Qt.Key.Key_Enter) and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.submit_requested.emit()
+        elif key == Qt.Key.Key_Backspace and self.cursor > 0:
+            self.cursor -= 1
+            self.store(self.cursor, None)
+            self.refresh()
+        elif key == Qt.Key.Key_Left:
+            self.move(-1)
+        elif key == Qt.Key.Key_Right:
+            self.move(1)
+        elif key == Qt.Key.Key_Home:
+            self.move(-len(self.slots))
+        elif key == Qt.Key.Key_End:
+            self.move(len(self.slots))
+        elif text and (text in BLANK or text.isdigit()):
+            self.enter(text)
+        else:
+            super().keyPressEvent(event)
+
+    def rate(self):
+        """Items keyed per minute since the first key, or None before the first."""
+        if self.started is None:
+            return None
+        return self.keyed * 60 / max(time.perf_counter() - self.started, 1e-3)
+
+    def refresh(self):
+        if self.cursor < len(self.slots):
+            position = self.slots[self.cursor][1]
+            self.prompt.setText(f"{self.slot_name(self.cursor)}：{self.instrument.descriptions[position]}")
+        else:
+            self.prompt.setText("已到最后一题，核对无误后按 Ctrl+Enter 提交。")  # last item done, Ctrl+Enter submits
+        width = len(self.responses)
+        rows = []
+        for first in range(0, len(self.instrument), ITEMS_PER_ROW):
+            cells = []
+            for item in range(first, min(first + ITEMS_PER_ROW, len(self.instrument))):
+                cell = ''
+                for slot in range(item * width, item * width + width):
+                    code = self.code(slot)
+                    char = '·' if code is None else str(code)
+                    cell += f'<span style="background: #ffd54f">{char}</span>' if slot == self.cursor else char
+                cells.append(cell)
+            rows.append(f"{self.instrument.items[first]:>4} " + ' '.join(cells))
+        self.overview.setText('<pre>' + '\n'.join(rows) + '</pre>')
+        answered = sum(len(responses) for responses in self.responses.values())
+        rate = self.rate()
+        status = f"已录入 {answered}/{len(self.slots)}"  # entered n of m
+        self.status.setText(status if rate is None else f"{status}，{rate:.0f} 题/分钟")  # items per minute
+
+    def finish(self, instrument):
+        """Print and log the entry rate of this form and of the station so far."""
+        if self.started is None:
+            return
+        seconds = time.perf_counter() - self.started
+        totals['forms'] += 1
+        totals['items'] += self.keyed
+        totals['seconds'] += seconds
+        print(f"录入 {self.keyed} 题，用时 {seconds:.1f} 秒（{self.rate():.0f} 题/分钟）；"
+              f"本站共 {totals['forms']} 份，平均 {totals['items'] * 60 / max(totals['seconds'], 1e-3):.0f} 题/分钟")
+        tracer.record('entry.form', seconds, instrument=instrument, items=self.keyed)
+
+
+class EntryMixin:
+    """Entry mode of a collector's Survey: class EntrySurvey(EntryMixin, Survey).
+
+    entry_key is the instrument key and entry_periods maps each period to the
+    name of the Survey's ResponseSet attribute. The Survey gets its pages
+    from make_pages(), which here returns the EntryPanel, so the combo-box
+    pages are never built.
+    """
+
+    entry_key = None
+    entry_periods = {'': 'responses'}
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.setWindowTitle(f"{self.windowTitle()} - 录入")
+        self.prev_button.hide()
+        self.next_button.hide()
+
+    def make_pages(self):
+        responses = {period: getattr(self, name) for period, name in self.entry_periods.items()}
+        self.entry = EntryPanel(self.instrument, responses, self.record_code)
+        self.entry.submit_requested.connect(self.submit_answers)
+        return self.entry
+
+    def record_code(self, item, code, period):
+        if self.journal is not None:
+            self.journal.record(item, code, period)
+
+    def show_page(self, page):
+        # one page holds the whole form
+        self.submit_button.setEnabled(True)
+        self.entry.start()
+
+    def submit_answers(self):
+        self.entry.finish(self.entry_key)
+        super().submit_answers()
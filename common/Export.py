@@ -0,0 +1,275 @@
+"""Export every saved session to wide item and score tables, a chunk at a time.
+
+    python -m common.Export DATA_DIR OUT_DIR [--format csv|npy|npz] [--only pid ...] [--chunk-size 5000]
+
+Each instrument gets one row per session in two tables. The item table
+holds the item codes, with LES periods as separate columns ("year:1",
+"week:1", ...). The score table holds the score_record scales. CSV leaves
+unanswered items and unscored scales empty. The NumPy formats write:
+- <key>_codes.npy: uint8 codes
+- <key>_missing.npy: a bool missing mask
+- <key>_scores.npy: float64 scores, NaN where unscored
+- <key>_ids.npy: respondent IDs
+- the column names
+npz bundles those files into <key>.npz.
+
+Sessions are read lazily and written one chunk at a time, so memory stays
+at one chunk however large the archive is. The NumPy files are streamed to
+disk raw and given their header once the row count is known. A session with
+a code its item does not allow is left out and listed, like an unreadable
+file.
+"""
+import os
+import sys
+import csv
+import json
+import shutil
+import zipfile
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from common.Archive import check_record, iter_archive, read_entry, record_responses, record_scores
+from common.Instruments import INSTRUMENTS, load_module
+from common.Registry import get_instrument
+
+ExportChunk = namedtuple('ExportChunk', ['ids', 'codes', 'missing', 'scores'])
+
+
+def item_columns(key):
+    """(period, item) of every item column; only LES has two periods."""
+    items = get_instrument(key).items
+    periods = ('year', 'week') if key == 'les' else ('',)
+    return [(period, item) for period in periods for item in items]
+
+
+def column_name(period, item):
+    return f"{period}:{item}" if period else item
+
+
+class ChunkScorer:
+    """Vectorized score_record for a chunk of code rows; the score columns are self.names."""
+
+    def __init__(self, key):
+        self.key = key
+        self.columns = item_columns(key)
+        position = {column: index for index, column in enumerate(self.columns)}
+        if key == 'pid':
+            self.batch = load_module('pid', 'Scorer').PID5BatchScorer()
+            self.names = ([f"facet:{name}" for name in self.batch.facet_names] +
+                          [f"domain:{name}" for name in self.batch.domain_names])
+        elif key == 'les':
+            categories = load_module('les', 'Report').CATEGORIES
+            self.groups = [(f"{period}:{category}", [position[(period, str(item))] for item in items])
+                           for period in ('year', 'week') for category, items in categories.items()]
+            self.groups += [(f"{period}:total", [index for index, column in enumerate(self.columns)
+                                                 if column[0] == period]) for period in ('year', 'week')]
+            self.names = [name for name, _ in self.groups]
+        elif key == 'ssrs':
+            subscales = load_module('ssrs', 'SsrsRepo').SUBSCALES
+            self.groups = [('total', list(range(len(self.columns))))]
+            self.groups += [(name, [position[('', item)] for item in items]) for name, items in subscales.items()]
+            self.names = [name for name, _ in self.groups]
+        else:
+            raise ValueError(f"unknown instrument: {key}")
+
+    def score(self, codes, missing, saved=None):
+        """Scores of a chunk; saved maps rows to {name: value} scores to use instead of recomputing them."""
+        if self.key == 'pid':
+            facet_scores, domain_scores = self.batch.score(codes, missing)
+            scores = np.hstack([facet_scores, domain_scores])
+            for row, values in (saved or {}).items():
+                scores[row] = [values.get(name, np.nan) for name in self.names]
+            return scores
+        values = np.where(missing, 0, codes).astype(np.float64)
+        scores = np.column_stack([values[:, columns].sum(axis=1) for _, columns in self.groups])
+        if self.key == 'ssrs':
+            # SSRS scores are only defined for complete records, as in score_record
+            scores[missing.any(axis=1)] = np.nan
+        return scores
+
+
+def fill_row(key, data, position, codes, missing):
+    """Write the codes of a saved record into one row; position maps (period, item) to a column.
+
+    Raises ValueError, before anything is written, for a code its item does not allow: in a uint8 row it would
+    be scored as a valid answer or wrap around.
+    """
+    check_record(key, data)
+    for period, answers in record_responses(key, data).items():
+        for item, value in answers.items():
+            column = position.get((period, str(item)))
+            if column is not None and value is not None:
+                codes[column] = value
+                missing[column] = False
+
+
+def iter_chunks(directory, key, chunk_size=5000, failed=None):
+    """Yield ExportChunks of up to chunk_size sessions; unreadable or invalid files are appended to failed."""
+    columns = item_columns(key)
+    position = {column: index for index, column in enumerate(columns)}
+    scorer = ChunkScorer(key)
+    ids, saved = [], {}
+    codes = np.zeros((chunk_size, len(columns)), dtype=np.uint8)
+    missing = np.ones((chunk_size, len(columns)), dtype=bool)
+    for entry in iter_archive(directory, [key]):
+        row = len(ids)
+        try:
+            data = read_entry(entry)
+            fill_row(key, data, position, codes[row], missing[row])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, OverflowError) as error:
+            codes[row] = 0
+            missing[row] = True
+            if failed is not None:
+                failed.append((entry.path, repr(error)))
+            continue
+        if 'adaptive' in data:
+            # adaptive PID-5 sessions skipped most items; their saved scores are the model estimates
+            saved[row] = record_scores(key, data)
+        ids.append(entry.user_id)
+        if len(ids) == chunk_size:
+            yield ExportChunk(ids, codes, missing, scorer.score(codes, missing, saved))
+            ids, saved = [], {}
+            codes[:] = 0
+            missing[:] = True
+    if ids:
+        codes, missing = codes[:len(ids)], missing[:len(ids)]
+        yield ExportChunk(ids, codes, missing, scorer.score(codes, missing, saved))
+
+
+class NpyWriter:
+    """Append rows to a .npy file whose length is not known in advance.
+
+    Rows go to "<path>.part" as raw bytes; close() writes the header for the
+    final shape and copies the rows after it. String columns are kept as
+    JSON lines and converted to a fixed-width unicode dtype on close.
+    """
+
+    def __init__(self, path, dtype, width=None):
+        self.path = path
+        self.dtype = np.dtype(dtype) if dtype is not str else None
+        self.width = width
+        self.rows = 0
+        if self.dtype is None:
+            self.part = open(f"{path}.part", 'w', encoding='utf-8')
+        else:
+            self.part = open(f"{path}.part", 'wb')
+
+    def append(self, rows):
+        if self.dtype is None:
+            self.part.writelines(json.dumps(value) + '\n' for value in rows)
+        else:
+            self.part.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self.part.close()
+        part_path = f"{self.path}.part"
+        if self.dtype is None:
+            with open(part_path, 'r', encoding='utf-8') as part:
+                length = max((len(json.loads(line)) for line in part), default=1)
+            dtype, shape = np.dtype(f"<U{length}"), (self.rows,)
+        else:
+            dtype, shape = self.dtype, (self.rows,) if self.width is None else (self.rows, self.width)
+        with open(self.path, 'wb') as file:
+            np.lib.format.write_array_header_1_0(file, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                        'fortran_order': False, 'shape': shape})
+            if self.dtype is None:
+                with open(part_path, 'r', encoding='utf-8') as part:
+                    batch = []
+                    for line in part:
+                        batch.append(json.loads(line))
+                        if len(batch) == 10000:
+                            file.write(np.array(batch, dtype=dtype).tobytes())
+                            batch = []
+                    file.write(np.array(batch, dtype=dtype).tobytes())
+            else:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, file, 1 << 20)
+        os.remove(part_path)
+        return self.path
+
+
+def export_csv(chunks, output_dir, key, items, scores):
+    items_path = os.path.join(output_dir, f"{key}_items.csv")
+    scores_path = os.path.join(output_dir, f"{key}_scores.csv")
+    rows = 0
+    with open(items_path, 'w', newline='', encoding='utf-8') as items_file, \
+            open(scores_path, 'w', newline='', encoding='utf-8') as scores_file:
+        items_writer, scores_writer = csv.writer(items_file), csv.writer(scores_file)
+        items_writer.writerow(['id'] + items)
+        scores_writer.writerow(['id'] + scores)
+        for chunk in chunks:
+            text = chunk.codes.astype(str).astype(object)
+            text[chunk.missing] = ''
+            items_writer.writerows([user_id] + row for user_id, row in zip(chunk.ids, text.tolist()))
+            values = np.where(np.isnan(chunk.scores), '', chunk.scores.astype(str)).tolist()
+            scores_writer.writerows([user_id] + row for user_id, row in zip(chunk.ids, values))
+            rows += len(chunk.ids)
+    return rows, [items_path, scores_path]
+
+
+def export_npy(chunks, output_dir, key, items, scores):
+    writers = {
+        'ids': NpyWriter(os.path.join(output_dir, f"{key}_ids.npy"), str),
+        'codes': NpyWriter(os.path.join(output_dir, f"{key}_codes.npy"), np.uint8, len(items)),
+        'missing': NpyWriter(os.path.join(output_dir, f"{key}_missing.npy"), np.bool_, len(items)),
+        'scores': NpyWriter(os.path.join(output_dir, f"{key}_scores.npy"), np.float64, len(scores)),
+    }
+    for chunk in chunks:
+        for name, writer in writers.items():
+            writer.append(getattr(chunk, name))
+    paths = [writer.close() for writer in writers.values()]
+    for name, columns in (('item_names', items), ('score_names', scores)):
+        path = os.path.join(output_dir, f"{key}_{name}.npy")
+        np.save(path, np.array(columns))
+        paths.append(path)
+    return writers['ids'].rows, paths
+
+
+def export_npz(chunks, output_dir, key, items, scores):
+    rows, paths = export_npy(chunks, output_dir, key, items, scores)
+    archive_path = os.path.join(output_dir, f"{key}.npz")
+    prefix = f"{key}_"
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path)[len(prefix):])
+            os.remove(path)
+    return rows, [archive_path]
+
+
+EXPORTERS = {'csv': export_csv, 'npy': export_npy, 'npz': export_npz}
+
+
+def export(directory, output_dir, key, fmt='csv', chunk_size=5000):
+    """Export one instrument; returns (rows, written paths, failed paths)."""
+    os.makedirs(output_dir, exist_ok=True)
+    failed = []
+    items = [column_name(period, item) for period, item in item_columns(key)]
+    scores = ChunkScorer(key).names
+    rows, paths = EXPORTERS[fmt](iter_chunks(directory, key, chunk_size, failed), output_dir, key, items, scores)
+    return rows, paths, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export saved sessions to wide CSV or NumPy tables.")
+    parser.add_argument('data_dir', help="directory with les_*.json, pid_*.json and ssrs_*.json files")
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=list(EXPORTERS), default='csv')
+    parser.add_argument('--only', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    parser.add_argument('--chunk-size', type=int, default=5000, help="sessions held in memory at a time")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for key in args.only:
+        rows, paths, failed = export(args.data_dir, args.output_dir, key, args.format, args.chunk_size)
+        print(f"{key}: {rows} sessions -> {', '.join(paths)}, {len(failed)} rejected")
+        for path, error in failed:
+            print(f"  {path}: {error}")
+        status = status or (1 if failed else 0)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import os
+import pickle
+import hashlib
+import threading
+from fnmatch import fnmatch
+from weakref import WeakKeyDictionary
+
+from reportlab import Version as reportlab_version, rl_config
+from reportlab.pdfbase import pdfmetrics, ttfonts
+from reportlab.pdfbase.ttfonts import TTFont, TTFontFace, TTEncoding
+
+from common.Cache import cache_dir as default_cache_dir
+
+# bump when the cached face layout changes
+CACHE_VERSION = 1
+# CachedTTFont and the face cache copy TTFont/TTFontFace internals of this
+# reportlab release; under any other, fonts are built with plain TTFont
+TESTED_REPORTLAB = '5.0.1'
+REUSE_FACES = reportlab_version == TESTED_REPORTLAB
+
+
+def pdf_scale(units_per_em):
+    """Glyph units to PDF's 1000-unit em, as TTFontFile.extractInfo sets up."""
+    if units_per_em == 1000:
+        return lambda x: x
+    factor = 1000 / units_per_em
+    return lambda x: x * factor
+
+
+class CachedTTFont(TTFont):
+    """A reportlab TTFont built around an already parsed face.
+
+    Mirrors TTFont.__init__ of reportlab TESTED_REPORTLAB without re-reading
+    the file; FontService only uses it under that release. reportlab embeds
+    TrueType fonts as per-document subsets holding only the glyphs drawn, so
+    a report carries a few KB of each face rather than the whole file.
+    """
+
+    def __init__(self, name, face):
+        self.fontName = name
+        self.face = face
+        self.encoding = TTEncoding()
+        self.state = WeakKeyDictionary()
+        self._asciiReadable = rl_config.ttfAsciiReadable
+        self.shapable = not any(fnmatch(name, pattern) for pattern in getattr(ttfonts, 'unShapedFontGlob', ()))
+
+
+class FontService:
+    """Parses each TrueType face once per process and caches the parsed metrics on disk.
+
+    Cache entries are keyed by the SHA-256 of the font file, so replacing a
+    font invalidates its entry. The same parsed face backs every reportlab
+    name registered for that file, and matplotlib FontProperties are shared
+    per path. Under a reportlab other than TESTED_REPORTLAB, faces are
+    neither shared nor cached and each name is a plain TTFont of its file.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.environ.get('SURVEY_FONT_CACHE') or default_cache_dir('fonts')
+        self._faces = {}
+        self._properties = {}
+        self._lock = threading.RLock()
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.v{CACHE_VERSION}.pickle")
+
+    def face(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._faces:
+                return self._faces[path]
+            if not REUSE_FACES:
+                return TTFontFace(path)
+            with open(path, 'rb') as file:
+                data = file.read()
+            digest = hashlib.sha256(data).hexdigest()
+            face = self._load_cached(digest, data)
+            if face is None:
+                face = TTFontFace(path)
+                self._store_cached(digest, face)
+            self._faces[path] = face
+            return face
+
+    def _load_cached(self, digest, data):
+        try:
+            with open(self._cache_path(digest), 'rb') as file:
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        face = TTFontFace.__new__(TTFontFace)
+        face.__dict__.update(state)
+        face._ttf_data = data
+        face._pdfScale = pdf_scale(face.unitsPerEm)
+        return face
+
+    def _store_cached(self, digest, face):
+        # the file bytes are re-read on load and the scale function is not picklable
+        state = {key: value for key, value in vars(face).items() if key not in ('_ttf_data', '_pdfScale')}
+        path = self._cache_path(digest)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{path}.{os.getpid()}.tmp", 'wb') as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        except OSError:
+            pass
+
+    def register(self, name, path):
+        """Register path with reportlab as name, unless it already is."""
+        with self._lock:
+            try:
+                font = pdfmetrics.getFont(name)
+            except KeyError:
+                font = None
+            if not REUSE_FACES:
+                path = os.path.abspath(path)
+                if getattr(getattr(font, 'face', None), 'filename', None) != path:
+                    pdfmetrics.registerFont(TTFont(name, path))
+                return pdfmetrics.getFont(name)
+            face = self.face(path)
+            if getattr(font, 'face', None) is not face:
+                pdfmetrics.registerFont(CachedTTFont(name, face))
+            # reportlab maps a new name for an already registered face to that face's first font
+            return pdfmetrics.getFont(name)
+
+    def properties(self, path):
+        """A shared matplotlib FontProperties for path."""
+        from matplotlib.font_manager import FontProperties
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self._properties:
+                self._properties[path] = FontProperties(fname=path)
+            return self._properties[path]
+
+
+font_service = FontService()
@@ -0,0 +1,41 @@
+import os
+import sys
+import importlib.util
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# key -> where the instrument lives; the key is also the prefix of the saved "<key>_<id>.json" files
+INSTRUMENTS = {
+    'les': {'directory': 'LES', 'questions': 'LES.json', 'report': 'Report'},
+    'pid': {'directory': 'PID-5', 'questions': 'PID-5.json', 'report': 'Report', 'scorer': 'Scorer'},
+    'ssrs': {'directory': 'SSRS', 'questions': 'SSRS.json', 'report': 'SsrsRepo'},
+}
+
+_load_lock = threading.RLock()
+
+
+def instrument_dir(key):
+    return os.path.join(ROOT, INSTRUMENTS[key]['directory'])
+
+
+def questions_path(key):
+    return os.path.join(instrument_dir(key), INSTRUMENTS[key]['questions'])
+
+
+def load_module(key, name):
+    """Import a module from an instrument directory, e.g. load_module('pid', 'Scorer').
+
+    The instrument directories reuse module names (LES and PID-5 both have a
+    Report.py), so each one is registered as "<key>_<name>" to let several
+    instruments live in the same process.
+    """
+    module_name = f"{key}_{name}"
+    with _load_lock:
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(instrument_dir(key), f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+        return module
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import queue
+import threading
+
+from common.Archive import safe_id
+from common.Responses import json_default
+
+
+class SessionJournal:
+    """Crash-safe, append-only log of one session's answer changes.
+
+    record() only queues the change; a background thread appends queued
+    changes as JSON lines in batches and fsyncs each batch, so the GUI never
+    waits on the disk. After a crash, replay() rebuilds the answers, and
+    compact() replaces the log with the final record once it is submitted.
+    """
+
+    def __init__(self, directory, instrument, user_id, flush_interval=0.25):
+        self.directory = directory
+        self.instrument = instrument
+        self.user_id = user_id
+        self.flush_interval = flush_interval
+        self.path = os.path.join(directory, f"{instrument}_{safe_id(user_id)}.journal")
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # a line torn by the crash; everything before it is intact
+                break
+        return entries
+
+    def unfinished(self):
+        """True if an earlier session for this ID recorded answers but was never submitted."""
+        entries = self._entries()
+        return bool(entries) and 'final' not in entries[-1]
+
+    def replay(self):
+        """The journaled answers as {period: {item: value}}; period is '' except for LES."""
+        responses = {}
+        for entry in self._entries():
+            if 'item' in entry:
+                responses.setdefault(entry.get('period', ''), {})[entry['item']] = entry['value']
+        return responses
+
+    def start(self, resume=False):
+        """Begin journaling; without resume an earlier log for this ID is set aside (or dropped if final).
+
+        With resume, the log is continued after cutting off a line torn by the crash.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if resume:
+            self._drop_torn_line()
+        elif os.path.exists(self.path):
+            if self.unfinished():
+                os.replace(self.path, f"{self.path}.abandoned-{int(time.time())}")
+            else:
+                os.remove(self.path)
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='journal', daemon=True)
+                self._writer.start()
+
+    def _drop_torn_line(self):
+        # appending after half a line would tear the first new entry too, and replay stops at a torn line
+        try:
+            with open(self.path, 'rb+') as file:
+                data = file.read()
+                if data and not data.endswith(b'\n'):
+                    file.truncate(data.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
+
+    def record(self, item, value, period=''):
+        self._queue.put({'item': item, 'value': value, 'period': period, 'time': time.time()})
+
+    def _write_loop(self):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            while True:
+                entry = self._queue.get()
+                batch = [entry]
+                deadline = time.monotonic() + self.flush_interval
+                while entry is not None:
+                    try:
+                        entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    batch.append(entry)
+                lines = [json.dumps(entry, ensure_ascii=False) + '\n' for entry in batch if entry is not None]
+                if lines:
+                    file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                if batch[-1] is None:
+                    return
+
+    def close(self):
+        """Write out everything queued and stop the writer thread."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    def compact(self, record):
+        """Atomically replace the log with the submitted record; the session is then finished."""
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'final': record, 'time': time.time()}, ensure_ascii=False, default=json_default) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
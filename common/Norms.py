@@ -0,0 +1,208 @@
+"""Reference-group norms: T-scores and percentile ranks for every scored scale.
+
+    python -m common.Norms build DATA_DIR [--only pid ...]    # build <key>_norms.npz from an archive
+    python -m common.Norms show pid
+
+A norm table keeps, for each scale named as in score_record ("facet:...",
+"domain:...", "year:total", "objective", ...), the cohort's scores sorted
+ascending. All scales share one float32 array with per-scale offsets, next
+to each scale's mean and SD. Conversion is vectorized over respondents: a
+percentile rank is two searchsorted calls per scale, a T-score one
+multiply-add, so a whole batch goes through in one call.
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from common.Archive import iter_archive, read_entry
+from common.Instruments import INSTRUMENTS, instrument_dir
+
+NORMS_VERSION = 1
+
+
+class NormTable:
+    def __init__(self, instrument, names, offsets, values, mean, sd):
+        self.instrument = instrument
+        self.names = list(names)
+        self.column = {name: index for index, name in enumerate(self.names)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.sd = np.asarray(sd, dtype=np.float64)
+
+    @classmethod
+    def build(cls, instrument, scores, names=None):
+        """A table from a cohort; scores is a list of {name: value} dicts as returned by score_record."""
+        if names is None:
+            names = sorted({name for row in scores for name in row})
+        matrix = cls.to_matrix(scores, names)
+        offsets, columns, mean, sd = [0], [], [], []
+        for column in matrix.T:
+            column = np.sort(column[~np.isnan(column)])
+            columns.append(column.astype(np.float32))
+            offsets.append(offsets[-1] + len(column))
+            mean.append(column.mean() if len(column) else np.nan)
+            sd.append(column.std(ddof=1) if len(column) > 1 else np.nan)
+        values = np.concatenate(columns) if columns else np.empty(0, dtype=np.float32)
+        return cls(instrument, names, offsets, values, mean, sd)
+
+    @staticmethod
+    def to_matrix(scores, names):
+        """Stack {name: value} dicts into an N x len(names) float array, NaN where a score is absent."""
+        matrix = np.full((len(scores), len(names)), np.nan)
+        column = {name: index for index, name in enumerate(names)}
+        for row, values in enumerate(scores):
+            for name, value in values.items():
+                if name in column and value is not None:
+                    matrix[row, column[name]] = value
+        return matrix
+
+    def sample(self, name):
+        """The sorted cohort scores of one scale (a view into the shared array)."""
+        index = self.column[name]
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def t_scores(self, matrix):
+        """T = 50 + 10z against the cohort mean and SD; matrix columns follow self.names."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 50 + 10 * (np.asarray(matrix, dtype=np.float64) - self.mean) / self.sd
+
+    def percentiles(self, matrix):
+        """Mid-rank percentile: the share of the cohort scoring below, plus half of those tied, times 100."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        ranks = np.full(matrix.shape, np.nan)
+        for index in range(len(self.names)):
+            sample = self.values[self.offsets[index]:self.offsets[index + 1]]
+            column = matrix[:, index]
+            present = ~np.isnan(column)
+            if not len(sample) or not present.any():
+                continue
+            # compare in the table's float32 so a score equal to a cohort score counts as tied
+            scores = column[present].astype(np.float32)
+            below = np.searchsorted(sample, scores, side='left')
+            tied = np.searchsorted(sample, scores, side='right') - below
+            ranks[present, index] = 100.0 * (below + 0.5 * tied) / len(sample)
+        return ranks
+
+    def convert(self, scores):
+        """T-scores and percentile ranks for a list of {name: value} dicts, as two N x len(names) arrays."""
+        matrix = self.to_matrix(scores, self.names)
+        return self.t_scores(matrix), self.percentiles(matrix)
+
+    def lookup(self, scores):
+        """{name: (T, percentile)} for one respondent's scores; scales without norms are left out."""
+        t_scores, ranks = self.convert([scores])
+        return {name: (float(t_scores[0, index]), float(ranks[0, index]))
+                for index, name in enumerate(self.names)
+                if name in scores and not np.isnan(ranks[0, index])}
+
+    def save(self, path):
+        np.savez_compressed(path, version=NORMS_VERSION, instrument=self.instrument, names=np.array(self.names),
+                            offsets=self.offsets, values=self.values, mean=self.mean, sd=self.sd)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != NORMS_VERSION:
+                raise ValueError(f"{path}: norm table version {int(data['version'])}, expected {NORMS_VERSION}")
+            return cls(str(data['instrument']), data['names'].tolist(), data['offsets'], data['values'],
+                       data['mean'], data['sd'])
+
+
+def norm_text(norms, name):
+    """The T-score and percentile of one scale as printed in the reports, or "" without norms."""
+    if name not in norms:
+        return ""
+    t_score, rank = norms[name]
+    return f"  (T={t_score:.0f}，百分位 {rank:.0f})"
+
+
+def norms_path(key):
+    return os.path.join(instrument_dir(key), f"{key}_norms.npz")
+
+
+_norms = {}
+
+
+def load_norms(key, path=None):
+    """The norm table of an instrument, or None if none has been built; loaded once per process."""
+    path = path or norms_path(key)
+    if path not in _norms:
+        _norms[path] = NormTable.load(path) if os.path.exists(path) else None
+    return _norms[path]
+
+
+def build_from_archive(directory, key):
+    """Score every saved <key>_<id>.json in directory and build a table; returns (table, failed paths)."""
+    from common.Reports import score_record, rescore_pid
+
+    sessions, failed = [], []
+    for entry in iter_archive(directory, [key]):
+        try:
+            sessions.append((entry, read_entry(entry)))
+        except (OSError, ValueError) as error:
+            failed.append((entry.path, repr(error)))
+    if key == 'pid':
+        valid = []
+        for entry, data in sessions:
+            if isinstance(data.get('responses'), dict):
+                valid.append((entry, data))
+            else:
+                failed.append((entry.path, "no responses"))
+        sessions = list(zip([entry for entry, _ in valid], rescore_pid([data for _, data in valid])))
+    scores = []
+    for entry, data in sessions:
+        try:
+            row = score_record(key, data, entry.user_id)
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
+            failed.append((entry.path, repr(error)))
+            continue
+        if row:
+            scores.append(row)
+        else:
+            failed.append((entry.path, "incomplete"))
+    return NormTable.build(key, scores), failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the norm tables used for T-scores and percentiles.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build norm tables from a directory of saved sessions")
+    build.add_argument('data_dir')
+    build.add_argument('--only', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    build.add_argument('--output', help="directory for the <key>_norms.npz files (default: the instrument's own)")
+    show = commands.add_parser('show', help="print the size, mean and SD of every scale of a norm table")
+    show.add_argument('instrument', choices=list(INSTRUMENTS))
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        table = load_norms(args.instrument)
+        if table is None:
+            print(f"No norm table at {norms_path(args.instrument)}")
+            return 1
+        for index, name in enumerate(table.names):
+            print(f"{name}: n={len(table.sample(name))} mean={table.mean[index]:.3f} sd={table.sd[index]:.3f}")
+        return 0
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    status = 0
+    for key in args.only:
+        table, failed = build_from_archive(args.data_dir, key)
+        path = os.path.join(args.output, f"{key}_norms.npz") if args.output else norms_path(key)
+        counts = table.offsets[1:] - table.offsets[:-1]
+        if not counts.any():
+            print(f"{key}: no usable sessions, nothing written.")
+            status = 1
+            continue
+        table.save(path)
+        print(f"{key}: {len(table.names)} scales from up to {counts.max()} sessions -> {path}, {len(failed)} skipped.")
+        for skipped, error in failed:
+            print(f"  {skipped}: {error}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,589 @@
+"""Bubble-sheet answer forms and an optical mark reader for their scans.
+
+    python -m common.Omr sheet pid sheets.pdf [--copies 30]
+    python -m common.Omr synth pid SCAN_DIR [--count 20] [--dpi 150] [--seed 0]
+    python -m common.Omr read SCAN_DIR OUT_DIR [--workers N] [--truth SCAN_DIR/truth.json]
+
+sheet prints the answer forms of an instrument with reportlab. Every page
+has:
+- a solid registration mark in each corner
+- a strip of small squares between the top marks, encoding the instrument
+  and the page number
+- one row of bubbles per item (LES: year bubbles, then week bubbles)
+The first page also has a grid for the respondent ID, one column per digit.
+When the items do not all share their options (SSRS), the options are
+listed per group of items next to the ID grid instead of in the header.
+All positions come from layout(), in points from the top left corner of a
+letter page, so that the printer, the reader and the synthetic scans agree.
+
+read loads each scanned page with PIL as a NumPy darkness array and finds
+the four registration marks with a box filter in the corners. The affine
+transform fitted to them maps every bubble of the layout onto the scan,
+whatever the shift, scale and small rotation. A bubble's darkness is the
+mean over a disk inside its outline. Pages are read in a process pool. The
+pages are then put together into forms: a first page opens a form and the
+following pages of the same instrument join it. Each form is saved as
+<key>_<id>.json, in the shape the collectors save. An item with one
+clearly filled bubble gets its code. An item with two filled bubbles, or
+with a faint (erased or light) mark, is left unanswered and listed in
+omr_flags.json, to be checked on the paper form. The ID is read from the
+left; a blank column before a filled one makes it unreadable. A form whose
+file already exists in OUT_DIR, or whose ID an earlier form of the same run
+had, is not written: it goes to the problems in omr_flags.json, with its
+record, so that nothing is overwritten.
+
+synth draws filled-in pages straight from the layout with PIL: random
+answers, some blank items, some double or faint marks, and a random
+rotation, shift, scale and noise per page. It writes truth.json next to
+them, and read --truth compares its result against it.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from common.Archive import make_record, safe_id
+from common.Instruments import INSTRUMENTS, instrument_dir
+from common.Registry import get_instrument
+from common.Responses import ResponseSet, json_default
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARK_SIZE = 18
+MARKS = np.array([(30, 30), (PAGE_WIDTH - 30, 30), (30, PAGE_HEIGHT - 30), (PAGE_WIDTH - 30, PAGE_HEIGHT - 30)],
+                 dtype=np.float64)
+# page code: 2 bits instrument, 4 bits page, 3 bits count of the set bits before them
+STRIP_X, STRIP_Y, STRIP_STEP, STRIP_SIZE, STRIP_BITS = 120, 30, 14, 8, 9
+BUBBLE_RADIUS = 5
+ROW_HEIGHT = 15
+BUBBLE_PITCH = 15
+LABEL_WIDTH = 26
+PERIOD_GAP = 10
+CONTENT_LEFT, CONTENT_RIGHT, CONTENT_TOP, CONTENT_BOTTOM = 50, 562, 110, 730
+ID_DIGITS = 8
+ID_LEFT, ID_TOP, ID_PITCH = 90, 130, 13
+# darkness inside a bubble: from FILLED on it is a mark, between FAINT and FILLED it needs a look
+FILLED = 0.45
+FAINT = 0.18
+PERIODS = {'les': ('year', 'week')}
+# the per-item option legend goes right of the ID grid on the first page
+LEGEND_LEFT = ID_LEFT + ID_DIGITS * BUBBLE_PITCH + 20
+LEGEND_SIZE, LEGEND_LEADING = 7, 9
+
+PageLayout = namedtuple('PageLayout', ['number', 'slots', 'codes', 'centers', 'id_centers', 'labels', 'headers'])
+PageResult = namedtuple('PageResult', ['path', 'instrument', 'page', 'user_id', 'answers', 'flags', 'error'])
+
+
+def instrument_number(key):
+    return list(INSTRUMENTS).index(key)
+
+
+def page_bits(key, page):
+    value = instrument_number(key) | page << 2
+    return [value >> bit & 1 for bit in range(6)] + [bin(value).count('1') >> bit & 1 for bit in range(3)]
+
+
+def decode_bits(bits):
+    """(instrument key, page) of a page-code strip; ValueError if the strip does not check out."""
+    value = sum(bit << index for index, bit in enumerate(bits[:6]))
+    check = sum(bit << index for index, bit in enumerate(bits[6:]))
+    if check != bin(value).count('1') or (value & 3) >= len(INSTRUMENTS):
+        raise ValueError(f"unreadable page code {bits}")
+    return list(INSTRUMENTS)[value & 3], value >> 2
+
+
+def strip_centers():
+    return np.array([(STRIP_X + STRIP_STEP * bit, STRIP_Y) for bit in range(STRIP_BITS)], dtype=np.float64)
+
+
+def id_centers():
+    """(ID_DIGITS, 10, 2) centers of the ID grid: one column per digit, 0 to 9 downwards."""
+    return np.array([[(ID_LEFT + BUBBLE_PITCH * column, ID_TOP + ID_PITCH * digit) for digit in range(10)]
+                     for column in range(ID_DIGITS)], dtype=np.float64)
+
+
+_layouts = {}
+
+
+def layout(key):
+    """The PageLayouts of an instrument's answer form; computed once per process."""
+    if key in _layouts:
+        return _layouts[key]
+    instrument = get_instrument(key)
+    periods = PERIODS.get(key, ('',))
+    options = max(instrument.option_counts)
+    period_width = options * BUBBLE_PITCH
+    # code headers over the bubble columns only make sense if every item has the same codes
+    code_sets = {tuple(sorted(codes)) for codes in instrument.code_options}
+    shared_codes = code_sets.pop() if len(code_sets) == 1 else ()
+    column_width = LABEL_WIDTH + len(periods) * period_width + (len(periods) - 1) * PERIOD_GAP + 14
+    columns = max(1, (CONTENT_RIGHT - CONTENT_LEFT) // column_width)
+    pages, position = [], 0
+    while position < len(instrument):
+        number = len(pages)
+        # the first page gives room to the ID grid
+        top = ID_TOP + 10 * ID_PITCH + 20 if number == 0 else CONTENT_TOP
+        rows = int((CONTENT_BOTTOM - top - ROW_HEIGHT) // ROW_HEIGHT)
+        slots, codes, centers, labels, headers = [], [], [], [], []
+        for column in range(columns):
+            if position >= len(instrument):
+                break
+            left = CONTENT_LEFT + column * column_width
+            for index, period in enumerate(periods):
+                x0 = left + LABEL_WIDTH + index * (period_width + PERIOD_GAP)
+                caption = {'year': '年', 'week': '周'}.get(period, '')
+                for code_index, code in enumerate(shared_codes):
+                    headers.append((x0 + code_index * BUBBLE_PITCH + BUBBLE_PITCH / 2, top, str(code)))
+                if caption:
+                    headers.append((x0 + period_width / 2, top - ROW_HEIGHT * 0.8, caption))
+            for row in range(rows):
+                if position >= len(instrument):
+                    break
+                y = top + ROW_HEIGHT * (row + 1)
+                labels.append((left, y, str(instrument.items[position])))
+                for index, period in enumerate(periods):
+                    x0 = left + LABEL_WIDTH + index * (period_width + PERIOD_GAP)
+                    item_codes = sorted(instrument.code_options[position])
+                    slots.append((period, position))
+                    codes.append(item_codes)
+                    centers.append([(x0 + code_index * BUBBLE_PITCH + BUBBLE_PITCH / 2, y)
+                                    for code_index in range(options)])
+                position += 1
+        pages.append(PageLayout(number, slots, codes, np.array(centers, dtype=np.float64),
+                                id_centers() if number == 0 else None, labels, headers))
+    _layouts[key] = pages
+    return pages
+
+
+def option_legends(instrument):
+    """[(item numbers, "1 = ...；2 = ...")] for each distinct set of options, in item order."""
+    groups = {}
+    for item, options in zip(instrument.items, instrument.code_options):
+        text = '；'.join(f"{code} = {option}" for code, option in sorted(options.items()))
+        groups.setdefault(text, []).append(item)
+    return [(items, text) for text, items in groups.items()]
+
+
+def wrap(pdf, text, font, size, width):
+    """text in lines of at most width points; CJK text has no spaces, so any character may end a line."""
+    lines, line = [], ''
+    for char in text:
+        if line and pdf.stringWidth(line + char, font, size) > width:
+            lines.append(line)
+            line = ''
+        line += char
+    return lines + [line]
+
+
+def write_sheets(key, filename, copies=1):
+    """Print copies of the blank answer form of key to a PDF."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from common.Fonts import font_service
+
+    font_service.register('NotoSansSC', os.path.join(instrument_dir(key), 'font', 'NotoSansSC-Regular.ttf'))
+    instrument = get_instrument(key)
+    pdf = canvas.Canvas(filename, pagesize=letter)
+    pdf.setTitle(f"{instrument.title} 答题卡")
+
+    def flip(y):
+        return PAGE_HEIGHT - y
+
+    legends = option_legends(instrument)
+    instruction = "请用铅笔涂满圆圈，每题只涂一个"
+    legend_lines = []
+    if len(legends) == 1:
+        instruction += f"：{legends[0][1]}"
+    else:
+        for items, text in legends:
+            legend_lines += wrap(pdf, f"第 {'、'.join(items)} 题：{text}", 'NotoSansSC', LEGEND_SIZE,
+                                 CONTENT_RIGHT - LEGEND_LEFT)
+        if len(legend_lines) * LEGEND_LEADING > 11 * ID_PITCH:
+            # no room next to the ID grid: better no legend than a wrong one
+            legend_lines = []
+            instruction += "，各题选项见问卷"  # options: see the questionnaire
+        instruction += "。"
+    for _ in range(copies):
+        for page in layout(key):
+            for x, y in MARKS:
+                pdf.rect(x - MARK_SIZE / 2, flip(y) - MARK_SIZE / 2, MARK_SIZE, MARK_SIZE, stroke=0, fill=1)
+            for (x, y), bit in zip(strip_centers(), page_bits(key, page.number)):
+                pdf.rect(x - STRIP_SIZE / 2, flip(y) - STRIP_SIZE / 2, STRIP_SIZE, STRIP_SIZE, stroke=1, fill=bit)
+            pdf.setFont('NotoSansSC', 11)
+            pdf.drawString(100, flip(62), f"{instrument.title} 答题卡 第 {page.number + 1}/{len(layout(key))} 页")
+            pdf.setFont('NotoSansSC', 7)
+            pdf.drawString(100, flip(78), instruction)
+            pdf.setLineWidth(0.8)
+            pdf.setStrokeGray(0.35)
+            if page.id_centers is not None:
+                pdf.drawString(CONTENT_LEFT, flip(ID_TOP - 14), "编号（每列涂一位数字）")
+                for column in page.id_centers:
+                    for digit, (x, y) in enumerate(column):
+                        pdf.circle(x, flip(y), BUBBLE_RADIUS, stroke=1, fill=0)
+                        pdf.drawRightString(ID_LEFT - 10, flip(y) - 2.5, str(digit))
+                for line, text in enumerate(legend_lines):
+                    pdf.drawString(LEGEND_LEFT, flip(ID_TOP - 14 + line * LEGEND_LEADING), text)
+            for x, y, text in page.headers:
+                pdf.drawCentredString(x, flip(y) - 2.5, text)
+            for x, y, text in page.labels:
+                pdf.drawString(x, flip(y) - 2.5, text)
+            for centers in page.centers:
+                for x, y in centers:
+                    pdf.circle(x, flip(y), BUBBLE_RADIUS, stroke=1, fill=0)
+            pdf.showPage()
+    pdf.save()
+    return filename
+
+
+def load_darkness(path):
+    """A scanned page as a float32 array, 0 for white paper and 1 for black."""
+    with Image.open(path) as image:
+        return 1 - np.asarray(image.convert('L'), dtype=np.float32) / 255
+
+
+def find_mark(darkness, box, left, top):
+    """Center (x, y) of the darkest box x box square of darkness, offset by (left, top)."""
+    dark = (darkness > 0.5).astype(np.int32)
+    integral = np.zeros((dark.shape[0] + 1, dark.shape[1] + 1), dtype=np.int32)
+    integral[1:, 1:] = dark.cumsum(axis=0).cumsum(axis=1)
+    sums = integral[box:, box:] - integral[:-box, box:] - integral[box:, :-box] + integral[:-box, :-box]
+    y, x = np.unravel_index(np.argmax(sums), sums.shape)
+    if sums[y, x] < box * box * 0.6:
+        raise ValueError("registration mark not found")
+    # refine with the centroid of the dark pixels around the best box
+    margin = box // 2
+    y0, x0 = max(0, y - margin), max(0, x - margin)
+    window = darkness[y0:y + box + margin, x0:x + box + margin] > 0.5
+    ys, xs = np.nonzero(window)
+    return left + x0 + xs.mean() + 0.5, top + y0 + ys.mean() + 0.5
+
+
+def register(darkness):
+    """The 2 x 3 affine matrix taking page points to pixel (x, y) of darkness."""
+    height, width = darkness.shape
+    scale = width / PAGE_WIDTH
+    box = max(3, int(MARK_SIZE * scale * 0.8))
+    window_x, window_y = int(width * 0.15), int(height * 0.12)
+    found = []
+    for x, y in MARKS:
+        left = 0 if x < PAGE_WIDTH / 2 else width - window_x
+        top = 0 if y < PAGE_HEIGHT / 2 else height - window_y
+        found.append(find_mark(darkness[top:top + window_y, left:left + window_x], box, left, top))
+    source = np.column_stack([MARKS, np.ones(len(MARKS))])
+    matrix, _, _, _ = np.linalg.lstsq(source, np.array(found), rcond=None)
+    residual = np.abs(source @ matrix - np.array(found)).max()
+    if residual > MARK_SIZE * scale * 0.25:
+        raise ValueError(f"registration marks do not line up (off by {residual:.1f} px)")
+    return matrix.T
+
+
+def disk_offsets(radius, step=1.0):
+    grid = np.arange(-radius, radius + step / 2, step)
+    xs, ys = np.meshgrid(grid, grid)
+    inside = xs ** 2 + ys ** 2 <= radius ** 2
+    return np.column_stack([xs[inside], ys[inside]])
+
+
+def sample(darkness, matrix, centers, radius):
+    """Mean darkness of disks of radius (points) around centers (..., 2), one value per center."""
+    offsets = disk_offsets(radius, radius / 3)
+    points = centers[..., None, :] + offsets
+    pixels = points @ matrix[:, :2].T + matrix[:, 2]
+    height, width = darkness.shape
+    xs = np.clip(np.rint(pixels[..., 0] - 0.5).astype(np.intp), 0, width - 1)
+    ys = np.clip(np.rint(pixels[..., 1] - 0.5).astype(np.intp), 0, height - 1)
+    return darkness[ys, xs].mean(axis=-1)
+
+
+def decide(darkness):
+    """Chosen option index per row of darkness (N x options): -1 blank, -2 ambiguous."""
+    filled = darkness >= FILLED
+    faint = (darkness >= FAINT) & ~filled
+    count = filled.sum(axis=1)
+    choice = np.where(count == 1, darkness.argmax(axis=1), -1)
+    return np.where((count > 1) | faint.any(axis=1), -2, choice)
+
+
+def rounded(values):
+    return [round(float(value), 2) for value in np.ravel(values)]
+
+
+def read_page(path):
+    """Read one scanned page; runs in a worker process."""
+    try:
+        darkness = load_darkness(path)
+        matrix = register(darkness)
+        bits = (sample(darkness, matrix, strip_centers(), STRIP_SIZE / 2 - 1.5) > 0.5).astype(int).tolist()
+        key, number = decode_bits(bits)
+        pages = layout(key)
+        if number >= len(pages):
+            raise ValueError(f"{key} has no page {number + 1}")
+        page = pages[number]
+        flags = []
+        user_id = None
+        if page.id_centers is not None:
+            values = sample(darkness, matrix, page.id_centers, BUBBLE_RADIUS * 0.6)
+            digits = decide(values)
+            if (digits == -2).any():
+                flags.append({'item': 'id', 'darkness': rounded(values[digits == -2])})
+            # "_" marks a blank column; only the blank columns after the last digit are dropped
+            user_id = ''.join({-2: '?', -1: '_'}.get(digit, str(digit)) for digit in digits).rstrip('_')
+        values = sample(darkness, matrix, page.centers, BUBBLE_RADIUS * 0.6)
+        choices = decide(values)
+        instrument = get_instrument(key)
+        answers = {}
+        for (period, position), codes, choice, row in zip(page.slots, page.codes, choices, values):
+            item = instrument.items[position]
+            if choice == -2:
+                flags.append({'item': item, 'period': period, 'darkness': rounded(row)})
+            elif choice >= 0:
+                answers.setdefault(period, {})[item] = codes[choice]
+        return PageResult(path, key, number, user_id, answers, flags, None)
+    except (OSError, ValueError) as error:
+        return PageResult(path, None, None, None, {}, [], repr(error))
+
+
+def assemble(results):
+    """Group page results, in scan order, into forms: [(key, user_id, {period: {item: code}}, flags, paths)]."""
+    forms, open_forms, problems = [], {}, []
+    for result in results:
+        if result.error is not None:
+            problems.append({'scan': result.path, 'error': result.error})
+            continue
+        if result.page == 0:
+            user_id = result.user_id
+            if not user_id or '?' in user_id or '_' in user_id:
+                problems.append({'scan': result.path, 'error': f"unreadable ID {user_id!r}"
+                                 + (" (blank column between digits)" if '_' in user_id else "")})
+                user_id = safe_id(f"omr-{os.path.splitext(os.path.basename(result.path))[0]}")
+            open_forms[result.instrument] = (result.instrument, user_id, {}, [], [])
+            forms.append(open_forms[result.instrument])
+        form = open_forms.get(result.instrument)
+        if form is None or len(form[4]) != result.page:
+            problems.append({'scan': result.path, 'error': f"page {result.page + 1} out of order"})
+            continue
+        for period, answers in result.answers.items():
+            form[2].setdefault(period, {}).update(answers)
+        form[3].extend(dict(flag, scan=result.path) for flag in result.flags)
+        form[4].append(result.path)
+    for key, user_id, _, _, paths in forms:
+        if len(paths) != len(layout(key)):
+            problems.append({'scan': paths[0], 'error': f"{key} {user_id}: {len(paths)} of {len(layout(key))} pages"})
+    return forms, problems
+
+
+def form_record(key, answers):
+    """The record the collector would have saved for these answers."""
+    instrument = get_instrument(key)
+    responses = {period: ResponseSet.from_dict(instrument, answers.get(period, {}))
+                 for period in PERIODS.get(key, ('',))}
+    record = make_record(key, responses)
+    if key == 'pid':
+        from common.Reports import rescore_pid
+        record = rescore_pid([record])[0]
+    return record
+
+
+def read_scans(scan_dir, output_dir, workers=1):
+    """Read every image of scan_dir and save the forms to output_dir; returns (forms, flags, problems)."""
+    paths = sorted(os.path.join(scan_dir, name) for name in os.listdir(scan_dir)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(read_page, paths, chunksize=4))
+    else:
+        results = [read_page(path) for path in paths]
+    forms, problems = assemble(results)
+    os.makedirs(output_dir, exist_ok=True)
+    flags, written = [], set()
+    for key, user_id, answers, form_flags, paths in forms:
+        filename = f"{key}_{user_id}.json"
+        record = form_record(key, answers)
+        flags.extend(dict(flag, instrument=key, id=user_id) for flag in form_flags)
+        if filename in written or os.path.exists(os.path.join(output_dir, filename)):
+            # two forms with one ID, or a session already saved: keep both, for someone to sort out
+            error = "ID read twice in this run" if filename in written else f"{filename} already exists"
+            problems.append({'scan': paths[0], 'error': f"{key} {user_id}: {error}", 'record': record})
+            continue
+        with open(os.path.join(output_dir, filename), 'w') as file:
+            json.dump(record, file, indent=4, default=json_default)
+        written.add(filename)
+    with open(os.path.join(output_dir, 'omr_flags.json'), 'w', encoding='utf-8') as file:
+        json.dump({'flags': flags, 'problems': problems}, file, ensure_ascii=False, indent=1, default=json_default)
+    return forms, flags, problems
+
+
+def render_page(key, page, user_id, answers, marks, scale, rng):
+    """A filled-in page drawn with PIL at scale pixels per point.
+
+    marks maps (period, position) to 'double' (a second filled bubble) or 'faint' (an erased one).
+    """
+    image = Image.new('L', (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+
+    def box(x, y, half):
+        return [(x - half) * scale, (y - half) * scale, (x + half) * scale, (y + half) * scale]
+
+    def pencil(x, y):
+        radius = BUBBLE_RADIUS * rng.uniform(0.8, 1.05)
+        draw.ellipse(box(x + rng.uniform(-0.6, 0.6), y + rng.uniform(-0.6, 0.6), radius), fill=rng.randint(20, 90))
+
+    for x, y in MARKS:
+        draw.rectangle(box(x, y, MARK_SIZE / 2), fill=0)
+    for (x, y), bit in zip(strip_centers(), page_bits(key, page.number)):
+        draw.rectangle(box(x, y, STRIP_SIZE / 2), fill=0 if bit else None, outline=0)
+    draw.text((100 * scale, 56 * scale), f"{key} {page.number + 1}", fill=0, font=font)
+    for x, y, text in page.labels + page.headers:
+        draw.text((x * scale, (y - 4) * scale), text, fill=80, font=font)
+    if page.id_centers is not None:
+        for column in page.id_centers:
+            for x, y in column:
+                draw.ellipse(box(x, y, BUBBLE_RADIUS), outline=90, width=max(1, int(scale * 0.8)))
+        for column, digit in enumerate(user_id):
+            if digit.isdigit():  # anything else leaves the column blank
+                pencil(*page.id_centers[column][int(digit)])
+    for (period, position), codes, centers in zip(page.slots, page.codes, page.centers):
+        for x, y in centers:
+            draw.ellipse(box(x, y, BUBBLE_RADIUS), outline=90, width=max(1, int(scale * 0.8)))
+        code = answers.get(period, {}).get(get_instrument(key).items[position])
+        if code is None:
+            continue
+        chosen = codes.index(code)
+        pencil(*centers[chosen])
+        kind = marks.get((period, position))
+        if kind == 'double':
+            pencil(*centers[(chosen + 1) % len(codes)])
+        elif kind == 'faint':
+            # an answer rubbed out next to the chosen one
+            x, y = centers[(chosen + 1) % len(codes)]
+            draw.ellipse(box(x, y, BUBBLE_RADIUS * 0.9), fill=rng.randint(175, 200))
+    # the sheet as a scanner sees it: rotated, shifted, slightly scaled, with noise
+    angle = math.radians(rng.uniform(-1.5, 1.5))
+    zoom = rng.uniform(0.98, 1.02)
+    shift_x, shift_y = rng.uniform(-8, 8) * scale, rng.uniform(-8, 8) * scale
+    cos, sin = math.cos(angle) / zoom, math.sin(angle) / zoom
+    cx, cy = image.width / 2, image.height / 2
+    inverse = (cos, sin, cx - cos * (cx + shift_x) - sin * (cy + shift_y),
+               -sin, cos, cy + sin * (cx + shift_x) - cos * (cy + shift_y))
+    image = image.transform(image.size, Image.Transform.AFFINE, inverse, resample=Image.Resampling.BILINEAR,
+                            fillcolor=255)
+    pixels = np.asarray(image, dtype=np.float32)
+    noise = np.random.default_rng(rng.getrandbits(32)).normal(0, 10, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+def synthesize(key, scan_dir, count=20, dpi=150, seed=0, blank=0.02, ambiguous=0.01):
+    """Write count filled-in forms of key to scan_dir as PNG pages, and their answers to truth.json."""
+    rng = random.Random(seed)
+    instrument = get_instrument(key)
+    os.makedirs(scan_dir, exist_ok=True)
+    truth_path = os.path.join(scan_dir, 'truth.json')
+    try:
+        with open(truth_path, 'r', encoding='utf-8') as file:
+            truth = json.load(file)
+    except FileNotFoundError:
+        truth = {}
+    for number in range(count):
+        user_id = f"{seed:02d}{number + 1:04d}"
+        answers, marks = {}, {}
+        for period in PERIODS.get(key, ('',)):
+            for position, item in enumerate(instrument.items):
+                if rng.random() < blank:
+                    continue
+                answers.setdefault(period, {})[item] = rng.choice(sorted(instrument.code_options[position]))
+                if rng.random() < ambiguous:
+                    marks[(period, position)] = rng.choice(['double', 'faint'])
+        for page in layout(key):
+            image = render_page(key, page, user_id, answers, marks, dpi / 72, rng)
+            # noise compresses badly; the fastest level keeps drawing, not zlib, the bulk of the time
+            image.save(os.path.join(scan_dir, f"{key}-{user_id}-{page.number + 1}.png"), compress_level=1)
+        truth[f"{key}_{user_id}"] = {'answers': answers, 'ambiguous': [[period, instrument.items[position]]
+                                                                     for period, position in marks]}
+    with open(truth_path, 'w', encoding='utf-8') as file:
+        json.dump(truth, file, ensure_ascii=False)
+    return count
+
+
+def compare_truth(forms, truth):
+    """Counts of correct, wrong, missed and flagged items of the forms against a synth truth.json."""
+    counts = {'correct': 0, 'wrong': 0, 'missed': 0, 'flagged': 0, 'false flags': 0, 'unmatched forms': 0}
+    for key, user_id, answers, flags, _ in forms:
+        expected = truth.get(f"{key}_{user_id}")
+        if expected is None:
+            counts['unmatched forms'] += 1
+            continue
+        ambiguous = {tuple(entry) for entry in expected['ambiguous']}
+        flagged = {(flag.get('period', ''), flag['item']) for flag in flags if flag['item'] != 'id'}
+        counts['flagged'] += len(flagged & ambiguous)
+        counts['false flags'] += len(flagged - ambiguous)
+        for period, codes in expected['answers'].items():
+            for item, code in codes.items():
+                if (period, item) in ambiguous:
+                    continue
+                found = answers.get(period, {}).get(item)
+                if found is None:
+                    counts['missed'] += 1
+                else:
+                    counts['correct' if found == code else 'wrong'] += 1
+            counts['wrong'] += sum(1 for item in answers.get(period, {}) if item not in codes)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print bubble-sheet answer forms and read their scans.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    sheet = commands.add_parser('sheet', help="print blank answer forms to a PDF")
+    sheet.add_argument('instrument', choices=list(INSTRUMENTS))
+    sheet.add_argument('output')
+    sheet.add_argument('--copies', type=int, default=1)
+    synth = commands.add_parser('synth', help="draw filled-in synthetic scans, with their answers in truth.json")
+    synth.add_argument('instrument', choices=list(INSTRUMENTS))
+    synth.add_argument('scan_dir')
+    synth.add_argument('--count', type=int, default=20, help="forms to draw")
+    synth.add_argument('--dpi', type=int, default=150)
+    synth.add_argument('--seed', type=int, default=0)
+    synth.add_argument('--blank', type=float, default=0.02, help="share of items left blank")
+    synth.add_argument('--ambiguous', type=float, default=0.01, help="share of items with a double or faint mark")
+    read = commands.add_parser('read', help="read scanned pages and save the forms as <key>_<id>.json")
+    read.add_argument('scan_dir')
+    read.add_argument('output_dir')
+    read.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes reading pages")
+    read.add_argument('--truth', help="truth.json written by synth, to check the result against")
+    args = parser.parse_args(argv)
+
+    if args.command == 'sheet':
+        write_sheets(args.instrument, args.output, args.copies)
+        print(f"{len(layout(args.instrument)) * args.copies} pages -> {args.output}")
+        return 0
+    if args.command == 'synth':
+        began = time.perf_counter()
+        synthesize(args.instrument, args.scan_dir, args.count, args.dpi, args.seed, args.blank, args.ambiguous)
+        print(f"{args.count} {args.instrument} forms ({args.count * len(layout(args.instrument))} pages) -> "
+              f"{args.scan_dir} in {time.perf_counter() - began:.1f} s")
+        return 0
+
+    began = time.perf_counter()
+    forms, flags, problems = read_scans(args.scan_dir, args.output_dir, args.workers)
+    elapsed = time.perf_counter() - began
+    pages = sum(len(form[4]) for form in forms)
+    print(f"{len(forms)} forms from {pages} pages in {elapsed:.1f} s ({pages / max(elapsed, 1e-9):.1f} pages/s), "
+          f"{len(flags)} marks to check, {len(problems)} problems -> {args.output_dir}")
+    for problem in problems:
+        print(f"  {problem['scan']}: {problem['error']}")
+    if args.truth:
+        with open(args.truth, 'r', encoding='utf-8') as file:
+            counts = compare_truth(forms, json.load(file))
+        print("  " + ", ".join(f"{name} {value}" for name, value in counts.items()))
+    return 1 if flags or problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QStackedWidget
+
+
+class PageCache(QStackedWidget):
+    """Survey pages that are built once and then kept alive.
+
+    build_page(index) returns the QWidget for a page. Pages are built on first
+    use, and the neighbours of the page being shown are built ahead from an
+    idle timer, so flipping pages only switches the visible widget and the
+    combo boxes keep their selections.
+    """
+
+    def __init__(self, page_count, build_page, parent=None):
+        super().__init__(parent)
+        self.page_count = page_count
+        self.build_page = build_page
+        self._pages = {}
+
+    def page(self, index):
+        if index not in self._pages:
+            widget = self.build_page(index)
+            self._pages[index] = widget
+            self.addWidget(widget)
+        return self._pages[index]
+
+    def show_page(self, index):
+        self.setCurrentWidget(self.page(index))
+        self.updateGeometry()
+        QTimer.singleShot(0, lambda: self.prebuild(index + 1))
+        QTimer.singleShot(0, lambda: self.prebuild(index - 1))
+
+    def prebuild(self, index):
+        if 0 <= index < self.page_count:
+            self.page(index)
+
+    # size to the visible page rather than the largest one in the stack
+    def sizeHint(self):
+        current = self.currentWidget()
+        return current.sizeHint() if current is not None else super().sizeHint()
+
+    def minimumSizeHint(self):
+        current = self.currentWidget()
+        return current.minimumSizeHint() if current is not None else super().minimumSizeHint()
@@ -0,0 +1,255 @@
+"""One-pass cohort statistics: item descriptives, Cronbach's alpha and item-total correlations.
+
+    python -m common.Psychometrics DATA_DIR [--only pid] [--chunk-size 2000] [--workers N] [--json OUT]
+    python -m common.Psychometrics SNAPSHOT_DIR --snapshot [--only pid] [--json OUT]
+
+The archive is read a chunk of files at a time, and each chunk is folded
+into one ScaleAccumulator per scale: the respondent count, the item sums
+and the item cross-product sums. Item codes are small integers, so these
+sums are exact int64 values. Accumulators built from separate chunks (or
+in separate processes) therefore merge bit-for-bit, whatever the order,
+which running float means (Welford/Chan) cannot promise. Means, SDs,
+covariances and everything derived from them are only computed in
+statistics(). Respondents missing any item of a scale are left out of
+that scale (listwise deletion). A file that cannot be read, or that has a
+code its item does not allow, is rejected and listed. With --snapshot the
+item matrix comes from a common.Snapshot instead of the JSON files.
+"""
+import sys
+import json
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from common.Archive import check_record, iter_archive, read_entry, record_responses
+from common.Instruments import INSTRUMENTS, load_module
+from common.Registry import get_instrument
+
+
+class ScaleAccumulator:
+    def __init__(self, items):
+        self.items = list(items)
+        self.n = 0
+        self.sums = np.zeros(len(self.items), dtype=np.int64)
+        self.products = np.zeros((len(self.items), len(self.items)), dtype=np.int64)
+        self.incomplete = 0
+
+    def update(self, codes, missing):
+        """Fold in an N x k chunk of (already keyed) codes; rows with a missing item are counted and skipped."""
+        complete = ~missing.any(axis=1)
+        values = codes[complete].astype(np.int64)
+        self.n += len(values)
+        self.sums += values.sum(axis=0)
+        self.products += values.T @ values
+        self.incomplete += int((~complete).sum())
+
+    def merge(self, other):
+        self.n += other.n
+        self.sums += other.sums
+        self.products += other.products
+        self.incomplete += other.incomplete
+        return self
+
+    def covariance(self):
+        """Sample covariance of the items, from the exact co-moment n*sum(xy) - sum(x)sum(y)."""
+        comoments = self.n * self.products - np.outer(self.sums, self.sums)
+        return comoments / (self.n * (self.n - 1))
+
+    def statistics(self):
+        k = len(self.items)
+        result = {'n': self.n, 'incomplete': self.incomplete, 'items': self.items}
+        if self.n < 2:
+            return result
+        covariance = self.covariance()
+        item_variance = np.diag(covariance)
+        total_variance = covariance.sum()
+        # covariance of each item with the sum of the other items of the scale
+        rest_covariance = covariance.sum(axis=1) - item_variance
+        rest_variance = total_variance - 2 * covariance.sum(axis=1) + item_variance
+        with np.errstate(invalid='ignore', divide='ignore'):
+            item_total = rest_covariance / np.sqrt(item_variance * rest_variance)
+            alpha = k / (k - 1) * (1 - item_variance.sum() / total_variance) if k > 1 else np.nan
+        result.update({
+            'item_mean': (self.sums / self.n).tolist(),
+            'item_sd': np.sqrt(item_variance).tolist(),
+            'item_total_r': item_total.tolist(),
+            'scale_mean': float(self.sums.sum() / self.n),
+            'scale_sd': float(np.sqrt(total_variance)),
+            'alpha': float(alpha),
+        })
+        return result
+
+
+def scale_items(key):
+    """{scale: [(period, item), ...]} for the scales analysed per instrument, items keyed as scored."""
+    if key == 'pid':
+        scorer_module = load_module('pid', 'Scorer')
+        return {facet: [('', str(item)) for item in items] for facet, items in scorer_module.FACETS.items()}
+    if key == 'les':
+        categories = load_module('les', 'Report').CATEGORIES
+        return {f"{period}:{category}": [(period, str(item)) for item in items]
+                for period in ('year', 'week') for category, items in categories.items()}
+    if key == 'ssrs':
+        subscales = load_module('ssrs', 'SsrsRepo').SUBSCALES
+        scales = {name: [('', item) for item in items] for name, items in subscales.items()}
+        scales['total'] = [('', item) for item in get_instrument('ssrs').items]
+        return scales
+    raise ValueError(f"unknown instrument: {key}")
+
+
+class CohortAnalysis:
+    """One accumulator per scale of an instrument; feed it chunks of saved records, merge, report."""
+
+    def __init__(self, key):
+        self.key = key
+        scales = scale_items(key)
+        self.scales = {name: ScaleAccumulator(f"{period}:{item}" if period else item for period, item in items)
+                       for name, items in scales.items()}
+        self.columns = {}
+        for items in scales.values():
+            for column in items:
+                self.columns.setdefault(column, len(self.columns))
+        self.index = {name: np.array([self.columns[column] for column in items]) for name, items in scales.items()}
+        self.reverse = np.zeros(len(self.columns), dtype=bool)
+        if key == 'pid':
+            reverse_items = {str(item) for item in load_module('pid', 'Scorer').REVERSE_ITEMS}
+            for (period, item), column in self.columns.items():
+                self.reverse[column] = item in reverse_items
+        self.records = 0
+
+    def to_matrix(self, records):
+        """Codes and missing mask (N x columns) of a list of saved records, PID-5 reverse items keyed."""
+        codes = np.zeros((len(records), len(self.columns)), dtype=np.int64)
+        missing = np.ones((len(records), len(self.columns)), dtype=bool)
+        for row, data in enumerate(records):
+            for period, answers in record_responses(self.key, data).items():
+                for item, value in answers.items():
+                    column = self.columns.get((period, str(item)))
+                    if column is not None and value is not None:
+                        codes[row, column] = value
+                        missing[row, column] = False
+        codes = np.where(self.reverse, 3 - codes, codes)
+        return codes, missing
+
+    def update(self, records):
+        self.update_matrix(*self.to_matrix(records))
+
+    def update_matrix(self, codes, missing):
+        """Fold in codes and missing mask already in self.columns order and keyed."""
+        for name, accumulator in self.scales.items():
+            accumulator.update(codes[:, self.index[name]], missing[:, self.index[name]])
+        self.records += len(codes)
+
+    def merge(self, other):
+        for name, accumulator in self.scales.items():
+            accumulator.merge(other.scales[name])
+        self.records += other.records
+        return self
+
+    def statistics(self):
+        return {name: accumulator.statistics() for name, accumulator in self.scales.items()}
+
+
+def analyse_files(key, paths):
+    """Accumulate one chunk of archive files; runs in a worker process. Returns (analysis, rejected paths)."""
+    analysis = CohortAnalysis(key)
+    records, failed = [], []
+    for entry in paths:
+        try:
+            data = read_entry(entry)
+            check_record(key, data)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            failed.append((entry.path, repr(error)))
+            continue
+        records.append(data)
+    analysis.update(records)
+    return analysis, failed
+
+
+def analyse_archive(directory, key, chunk_size=2000, workers=1):
+    """Stream every <key>_<id>.json of directory through a CohortAnalysis; returns (analysis, failed paths)."""
+    entries = list(iter_archive(directory, [key]))
+    chunks = [entries[start:start + chunk_size] for start in range(0, len(entries), chunk_size)]
+    analysis, failed = CohortAnalysis(key), []
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(analyse_files, [key] * len(chunks), chunks)
+            for partial, partial_failed in results:
+                analysis.merge(partial)
+                failed.extend(partial_failed)
+    else:
+        for chunk in chunks:
+            partial, partial_failed = analyse_files(key, chunk)
+            analysis.merge(partial)
+            failed.extend(partial_failed)
+    return analysis, failed
+
+
+def analyse_snapshot(directory, key, chunk_size=50000):
+    """The CohortAnalysis of every row of a common.Snapshot, paged through its memmap a chunk at a time."""
+    from common.Snapshot import Snapshot
+
+    snapshot = Snapshot(directory, key)
+    analysis = CohortAnalysis(key)
+    position = {column: index for index, column in enumerate(snapshot.columns)}
+    take = np.array([position[column] for column in analysis.columns])
+    for _, codes, missing in snapshot.chunks(chunk_size):
+        codes = codes[:, take].astype(np.int64)
+        analysis.update_matrix(np.where(analysis.reverse, 3 - codes, codes), missing[:, take])
+    return analysis, []
+
+
+def finite(value):
+    """value with NaN and infinities (no variance, too few sessions) as None, so that the JSON is valid."""
+    if isinstance(value, dict):
+        return {name: finite(item) for name, item in value.items()}
+    if isinstance(value, list):
+        return [finite(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Item statistics, Cronbach's alpha and item-total correlations per scale.")
+    parser.add_argument('data_dir', help="directory with les_*.json, pid_*.json and ssrs_*.json files")
+    parser.add_argument('--only', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    parser.add_argument('--chunk-size', type=int, default=2000, help="files read per chunk")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes, one chunk each at a time")
+    parser.add_argument('--json', help="also write every statistic to this file")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="DATA_DIR is a common.Snapshot directory rather than the saved sessions")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for key in args.only:
+        if args.snapshot:
+            analysis, failed = analyse_snapshot(args.data_dir, key)
+        else:
+            analysis, failed = analyse_archive(args.data_dir, key, args.chunk_size, args.workers)
+        statistics = analysis.statistics()
+        report[key] = statistics
+        print(f"{key}: {analysis.records} sessions, {len(failed)} rejected")
+        for name, values in statistics.items():
+            if 'alpha' not in values:
+                print(f"  {name}: too few complete sessions ({values['n']})")
+                continue
+            line = (f"  {name}: n={values['n']} mean={values['scale_mean']:.2f} sd={values['scale_sd']:.2f} "
+                    f"alpha={values['alpha']:.3f}")
+            correlations = np.array(values['item_total_r'])
+            if not np.isnan(correlations).all():
+                lowest = int(np.nanargmin(correlations))
+                line += f" lowest item-total r={correlations[lowest]:.3f} (item {values['items'][lowest]})"
+            print(line)
+        for path, error in failed:
+            print(f"  {path}: {error}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(finite(report), file, ensure_ascii=False, indent=2, allow_nan=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import os
+import json
+import threading
+from array import array
+
+from common.Instruments import questions_path
+
+# option -> saved code: PID-5 options are already the 0-3 codes, LES codes are
+# the option position (0-4) and SSRS codes are the position plus one (1-4)
+CODE_BASE = {'les': 0, 'pid': 0, 'ssrs': 1}
+
+
+class Instrument:
+    """An instrument JSON compiled into dense per-item tables.
+
+    Items are addressed by position (0..n-1); the lookups by item number
+    ("1", "2", ...) go through one dict, so description, brief text and
+    option <-> code conversions are O(1).
+    """
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.title = data.get('title', '')
+        self.questions = data['questions']
+        self.items = [question['item'] for question in self.questions]
+        self.position = {item: index for index, item in enumerate(self.items)}
+        self.descriptions = [question.get('description', question.get('translation')) for question in self.questions]
+        self.briefs = [question.get('brief') for question in self.questions]
+        self.options = [list(question['options']) for question in self.questions]
+        self.option_counts = array('B', [len(options) for options in self.options])
+        base = CODE_BASE[key]
+        self.option_codes = [{option: (option if isinstance(option, int) else index + base)
+                              for index, option in enumerate(options)} for options in self.options]
+        self.code_options = [{code: option for option, code in codes.items()} for codes in self.option_codes]
+
+    def __len__(self):
+        return len(self.items)
+
+    def index(self, item):
+        return self.position[str(item)]
+
+    def description(self, item):
+        position = self.position.get(str(item))
+        return None if position is None else self.descriptions[position]
+
+    def brief(self, item):
+        position = self.position.get(str(item))
+        return None if position is None else self.briefs[position]
+
+    def code(self, item, option):
+        return self.option_codes[self.position[str(item)]][option]
+
+    def option(self, item, code):
+        return self.code_options[self.position[str(item)]][code]
+
+
+_instruments = {}
+_lock = threading.Lock()
+
+
+def _compile(key, path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return Instrument(key, json.load(file))
+
+
+def get_instrument(key, path=None):
+    """The compiled instrument for key ('les', 'pid' or 'ssrs'), loaded once per process.
+
+    Compiling is a JSON read and a few list comprehensions, so nothing is
+    cached on disk: a shared cache of pickles could be made to run code.
+    """
+    path = os.path.abspath(path or questions_path(key))
+    with _lock:
+        if path not in _instruments:
+            _instruments[path] = _compile(key, path)
+        return _instruments[path]
@@ -0,0 +1,133 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from common.Instruments import INSTRUMENTS, load_module, questions_path
+from common.Archive import record_scores
+from common.Norms import load_norms
+from common.Registry import get_instrument
+from common.Trace import span
+
+
+def make_report(instrument, user_id, data, norms=None):
+    """The instrument's ReportGenerator for one saved session (PID-5 sessions carry their scores)."""
+    report_module = load_module(instrument, INSTRUMENTS[instrument]['report'])
+    if instrument == 'les':
+        return report_module.ReportGenerator(user_id, data['year'], data['week'], questions_path('les'), norms)
+    if instrument == 'pid':
+        return report_module.ReportGenerator(user_id, data['facet_scores'], data['domain_scores'], norms)
+    if instrument == 'ssrs':
+        return report_module.ReportGenerator(user_id, data['response'], None, questions_path('ssrs'), norms)
+    raise ValueError(f"unknown instrument: {instrument}")
+
+
+def render_report(instrument, user_id, data, filename, chart_backend='matplotlib'):
+    """Render one saved session to a PDF; runs in a worker process of the batch tools.
+
+    data is what the collector saved, except that PID-5 sessions carry the
+    freshly computed facet_scores and domain_scores. T-scores and percentiles
+    are added when the instrument has a norm table.
+    """
+    with span(f"{instrument}.render_report"):
+        report = make_report(instrument, user_id, data, load_norms(instrument))
+        if instrument == 'ssrs':
+            report.generate_pdf(filename=filename)
+        else:
+            report.generate_pdf(filename=filename, chart_backend=chart_backend)
+    return filename
+
+
+def render_combined(instrument, sessions, filename, chart_backend='vector'):
+    """Render many sessions of one instrument into a single PDF, one page and one bookmark per respondent.
+
+    sessions is a list of (user_id, data). The fonts, the chart grids (vector
+    charts) and identical chart bitmaps are embedded once and shared by all
+    pages. Returns (filename, [(user_id, error)] for the sessions left out).
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    norms = load_norms(instrument)
+    title = get_instrument(instrument).title
+    pdf = canvas.Canvas(filename, pagesize=letter)
+    pdf.setTitle(title)
+    failed = []
+    with span(f"{instrument}.render_combined", sessions=len(sessions)):
+        for number, (user_id, data) in enumerate(sessions):
+            try:
+                report = make_report(instrument, user_id, data, norms)
+                # the reports check their data before drawing, so a refused session leaves the page blank
+                if instrument == 'ssrs':
+                    report.draw(pdf)
+                else:
+                    report.draw(pdf, chart_backend=chart_backend)
+            except (KeyError, TypeError, ValueError) as error:
+                failed.append((user_id, repr(error)))
+                continue
+            key = f"report-{number}"
+            pdf.bookmarkPage(key)
+            pdf.addOutlineEntry(f"ID {user_id}", key, level=0)
+            pdf.showPage()
+        pdf.showOutline()
+        pdf.save()
+    return filename, failed
+
+
+def rescore_pid(sessions):
+    """Rescore saved PID-5 sessions in one batch; returns them with fresh facet and domain scores.
+
+    Adaptive sessions keep their saved scores: most of their items were never
+    asked, and their scores are model estimates rather than item means.
+    """
+    scorer_module = load_module('pid', 'Scorer')
+    scorer = scorer_module.PID5BatchScorer()
+    codes, missing = scorer.to_matrix([data['responses'] for data in sessions])
+    facet_scores, domain_scores = scorer.score(codes, missing)
+    rescored = []
+    for row, data in enumerate(sessions):
+        if 'adaptive' in data:
+            rescored.append(data)
+            continue
+        facets, domains = scorer.to_dicts(facet_scores[row], domain_scores[row])
+        rescored.append(dict(data, facet_scores=facets, domain_scores=domains))
+    return rescored
+
+
+def score_record(instrument, data, user_id=''):
+    """Computed scores of a saved record as a flat {name: value} dict, for storage and export.
+
+    LES and SSRS records do not carry their scores, so they are recomputed
+    with the report generators' own scorers; an incomplete SSRS record has none.
+    """
+    if instrument == 'pid':
+        if 'facet_scores' not in data:
+            data = rescore_pid([data])[0]
+        return record_scores('pid', data)
+    report_module = load_module(instrument, INSTRUMENTS[instrument]['report'])
+    if instrument == 'les':
+        report = report_module.ReportGenerator(user_id, data['year'], data['week'], questions_path('les'))
+        category_year, category_week, _, _, year_total, week_total = report.scocer()
+        scores = {f"year:{name}": value for name, value in category_year.items()}
+        scores.update({f"week:{name}": value for name, value in category_week.items()})
+        scores.update({'year:total': year_total, 'week:total': week_total})
+        return scores
+    if instrument == 'ssrs':
+        report = report_module.ReportGenerator(user_id, data['response'], None, questions_path('ssrs'))
+        if report.num_response.missing():
+            return {}
+        total, obj, sub, ult = report.scorer()
+        return {'total': total, 'objective': obj, 'subjective': sub, 'utilization': ult}
+    raise ValueError(f"unknown instrument: {instrument}")
+
+
+def warm_up(instrument):
+    """Import an instrument's report module; submitted to a fresh worker so its first report starts warm."""
+    load_module(instrument, INSTRUMENTS[instrument]['report'])
+    return instrument
+
+
+def report_pool(workers=None):
+    """A process pool for render_report, for callers that run threads (Qt, journal writers).
+
+    It uses spawn rather than fork: forking a process that runs threads is unsafe.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
@@ -0,0 +1,152 @@
+from array import array
+
+from common.Registry import get_instrument
+
+
+def _restore(key, codes, answered):
+    return ResponseSet(get_instrument(key), codes, answered)
+
+
+class ResponseSet:
+    """The answers of one session (one LES period) as codes indexed by item position.
+
+    codes holds one uint8 code per item and answered is a bitmask with bit
+    i % 8 of byte i // 8 set once item i has an answer, so a PID-5 session
+    is 220 + 28 bytes however it was answered. The set reads like a
+    {item: code} dict of the answered items (in, [], get, items, len), so
+    it can be passed wherever such a dict was. Batch code can stack the
+    codes of many sets into one numpy array (see stack).
+    """
+
+    __slots__ = ('instrument', 'codes', 'answered')
+
+    def __init__(self, instrument, codes=None, answered=None):
+        self.instrument = instrument
+        self.codes = array('B', codes if codes is not None else bytes(len(instrument)))
+        self.answered = bytearray(answered if answered is not None else (len(instrument) + 7) // 8)
+
+    @classmethod
+    def from_dict(cls, instrument, answers):
+        responses = cls(instrument)
+        responses.update(answers)
+        return responses
+
+    @classmethod
+    def of(cls, instrument, answers):
+        """answers as a ResponseSet: returned as is if it already is one, converted from {item: code} otherwise."""
+        return answers if isinstance(answers, cls) else cls.from_dict(instrument, answers)
+
+    def __reduce__(self):
+        # the instrument travels as its key; a worker process loads it from its own registry
+        return _restore, (self.instrument.key, self.codes.tobytes(), bytes(self.answered))
+
+    def is_answered(self, position):
+        return bool(self.answered[position >> 3] & (1 << (position & 7)))
+
+    def set_code(self, position, code):
+        """Answer the item at position; None clears the answer."""
+        if code is None:
+            self.codes[position] = 0
+            self.answered[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+            return
+        if code not in self.instrument.code_options[position]:
+            raise ValueError(f"{self.instrument.key} item {self.instrument.items[position]}: invalid code {code!r}")
+        self.codes[position] = code
+        self.answered[position >> 3] |= 1 << (position & 7)
+
+    def code_at(self, position):
+        return self.codes[position] if self.is_answered(position) else None
+
+    def __setitem__(self, item, code):
+        self.set_code(self.instrument.index(item), code)
+
+    def __getitem__(self, item):
+        position = self.instrument.index(item)
+        if not self.is_answered(position):
+            raise KeyError(item)
+        return self.codes[position]
+
+    def get(self, item, default=None):
+        position = self.instrument.position.get(str(item))
+        if position is None or not self.is_answered(position):
+            return default
+        return self.codes[position]
+
+    def __contains__(self, item):
+        position = self.instrument.position.get(str(item))
+        return position is not None and self.is_answered(position)
+
+    def __len__(self):
+        """The number of answered items, as for the dict it replaces."""
+        return sum(bin(byte).count('1') for byte in self.answered)
+
+    def positions(self):
+        """Positions of the answered items, in item order."""
+        return [position for position in range(len(self.codes)) if self.is_answered(position)]
+
+    def items(self):
+        """(item, code) of the answered items, in item order."""
+        return [(self.instrument.items[position], self.codes[position]) for position in self.positions()]
+
+    def keys(self):
+        return [self.instrument.items[position] for position in self.positions()]
+
+    def values(self):
+        return [self.codes[position] for position in self.positions()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def update(self, answers):
+        """Copy in {item: code} answers; None values are skipped.
+
+        Journals written before the collectors journaled codes hold option
+        labels, which are converted here.
+        """
+        for item, value in answers.items():
+            if value is None:
+                continue
+            if isinstance(value, str):
+                value = self.instrument.code(item, value)
+            self[item] = value
+
+    def missing(self):
+        """The items without an answer, in item order."""
+        return [item for position, item in enumerate(self.instrument.items) if not self.is_answered(position)]
+
+    def complete(self):
+        return len(self) == len(self.codes)
+
+    def total(self, positions=None):
+        """Sum of the codes at positions (all items by default); unanswered items count as 0."""
+        if positions is None:
+            return sum(self.codes)
+        codes = self.codes
+        return sum(codes[position] for position in positions)
+
+    def to_dict(self):
+        """{item: code} of the answered items, the shape the JSON files hold."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"ResponseSet({self.instrument.key}, {len(self)}/{len(self.codes)} answered)"
+
+    @staticmethod
+    def stack(sets):
+        """Codes (N x items uint8) and missing mask (N x items bool) of sets of one instrument."""
+        import numpy as np
+
+        size = len(sets[0].codes) if sets else 0
+        codes = np.frombuffer(b''.join(responses.codes.tobytes() for responses in sets),
+                              dtype=np.uint8).reshape(len(sets), size)
+        answered = np.frombuffer(b''.join(bytes(responses.answered) for responses in sets),
+                                 dtype=np.uint8).reshape(len(sets), -1)
+        missing = ~np.unpackbits(answered, axis=1, count=size, bitorder='little').astype(bool)
+        return codes, missing
+
+
+def json_default(value):
+    """json.dump hook writing a ResponseSet as its {item: code} dict."""
+    if isinstance(value, ResponseSet):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,283 @@
+"""Columnar snapshot of the archive: one fixed-width item matrix per instrument, opened with numpy.memmap.
+
+    python -m common.Snapshot update DATA_DIR SNAPSHOT_DIR [--only pid ...] [--chunk-size 5000]
+    python -m common.Snapshot info SNAPSHOT_DIR
+    python -m common.Snapshot score SNAPSHOT_DIR [--only pid ...] [--output OUT_DIR]
+
+Each instrument has five files in SNAPSHOT_DIR:
+- <key>.codes: N x items uint8 codes, row after row, no header
+- <key>.missing: N x ceil(items / 8) bytes, bit i % 8 of byte i // 8 set
+  when item column i is unanswered (the ResponseSet layout, inverted)
+- <key>.index: one "<time>\\t<respondent id>\\t<source file>" line per row
+- <key>.saved: one "<row>\\t<scores as JSON>" line per adaptive PID-5 row
+- <key>.json: version, item columns, row count and index and saved lengths
+The columns are Export.item_columns, so LES rows hold the year and then the
+week answers. Rows are only ever appended: update adds the archive files
+whose name and modification time are not in the index yet, and a
+re-submitted session becomes a new row. The row count in <key>.json is
+written last, through a temporary file; whatever an interrupted append left
+after it is cut off by the next one, and readers never see it.
+
+Snapshot.codes and Snapshot.missing_bits are read-only memmaps, so scoring
+and the cohort statistics page through the file instead of loading it, and
+chunks() hands out row slices of them without copying. Adaptive PID-5
+sessions are stored with the items they skipped missing, and their saved
+scores (model estimates, not item means) go to <key>.saved; score_snapshot
+uses those, as the exporter does.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from common.Archive import iter_archive, read_entry, record_scores
+from common.Export import ChunkScorer, NpyWriter, column_name, fill_row, item_columns
+from common.Instruments import INSTRUMENTS
+
+SNAPSHOT_VERSION = 2
+
+
+class Snapshot:
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        self.columns = item_columns(key)
+        self.width = len(self.columns)
+        self.mask_width = (self.width + 7) // 8
+        self.names = [column_name(period, item) for period, item in self.columns]
+        self.meta = {'version': SNAPSHOT_VERSION, 'instrument': key, 'columns': self.names,
+                     'rows': 0, 'index_bytes': 0, 'saved_bytes': 0}
+        try:
+            with open(self.path('json'), 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return
+        if meta.get('version') != SNAPSHOT_VERSION or meta.get('columns') != self.names:
+            raise ValueError(f"{self.path('json')}: written for other item columns or another version; "
+                             f"remove the {key}.* files to rebuild it")
+        self.meta = meta
+
+    def path(self, suffix):
+        return os.path.join(self.directory, f"{self.key}.{suffix}")
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def _memmap(self, suffix, width):
+        if not self.rows:
+            return np.zeros((0, width), dtype=np.uint8)
+        return np.memmap(self.path(suffix), dtype=np.uint8, mode='r', shape=(self.rows, width))
+
+    @property
+    def codes(self):
+        """N x items uint8 codes; unanswered items hold 0."""
+        return self._memmap('codes', self.width)
+
+    @property
+    def missing_bits(self):
+        return self._memmap('missing', self.mask_width)
+
+    def missing(self, start=0, stop=None):
+        """The bool missing mask of rows start:stop, unpacked from the bitmap."""
+        return np.unpackbits(self.missing_bits[start:stop], axis=1, count=self.width, bitorder='little').astype(bool)
+
+    def chunks(self, chunk_size=50000):
+        """Yield (start row, codes, missing) for consecutive slices of chunk_size rows; codes is a memmap view."""
+        codes = self.codes
+        for start in range(0, self.rows, chunk_size):
+            yield start, codes[start:start + chunk_size], self.missing(start, start + chunk_size)
+
+    def index(self):
+        """(times, respondent ids, source files) of every row; times is a float64 array of epoch seconds."""
+        times, ids, sources = [], [], []
+        if self.rows:
+            with open(self.path('index'), 'rb') as file:
+                text = file.read(self.meta['index_bytes']).decode('utf-8')
+            for line in text.splitlines():
+                stamp, user_id, source = line.split('\t')
+                times.append(float(stamp))
+                ids.append(user_id)
+                sources.append(source)
+        return np.array(times, dtype=np.float64), ids, sources
+
+    def saved_scores(self):
+        """{row: {score name: value}} of the rows whose saved scores stand in for scoring their items."""
+        saved = {}
+        if self.meta['saved_bytes']:
+            with open(self.path('saved'), 'rb') as file:
+                text = file.read(self.meta['saved_bytes']).decode('utf-8')
+            for line in text.splitlines():
+                row, scores = line.split('\t', 1)
+                saved[int(row)] = json.loads(scores)
+        return saved
+
+    def append(self, codes, missing, ids, times, sources, saved=None):
+        """Add rows at the end of the files; nothing already written is rewritten.
+
+        saved maps rows of this batch (from 0) to the scores to keep for them.
+        """
+        codes = np.ascontiguousarray(codes, dtype=np.uint8)
+        if codes.ndim != 2 or codes.shape[1] != self.width:
+            raise ValueError(f"{self.key}: expected rows of {self.width} codes, got shape {codes.shape}")
+        bits = np.packbits(np.asarray(missing, dtype=bool), axis=1, bitorder='little')
+        index = ''.join(f"{stamp!r}\t{user_id}\t{source}\n"
+                        for stamp, user_id, source in zip(times, ids, sources)).encode('utf-8')
+        scores = ''.join(f"{self.rows + row}\t{json.dumps(values, ensure_ascii=False)}\n"
+                         for row, values in sorted((saved or {}).items())).encode('utf-8')
+        if not (len(codes) == len(bits) == len(ids)):
+            raise ValueError(f"{self.key}: codes, missing and ids differ in length")
+        if not len(codes):
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        for suffix, data, committed in (('codes', codes.tobytes(), self.rows * self.width),
+                                        ('missing', bits.tobytes(), self.rows * self.mask_width),
+                                        ('index', index, self.meta['index_bytes']),
+                                        ('saved', scores, self.meta['saved_bytes'])):
+            with open(self.path(suffix), 'ab') as file:
+                # drop the tail of an append that was interrupted before the row count was written
+                file.truncate(committed)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+        self.meta['rows'] += len(codes)
+        self.meta['index_bytes'] += len(index)
+        self.meta['saved_bytes'] += len(scores)
+        temporary = f"{self.path('json')}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.meta, file, ensure_ascii=False)
+        os.replace(temporary, self.path('json'))
+        return len(codes)
+
+    def update(self, data_dir, chunk_size=5000, failed=None):
+        """Append the sessions of data_dir not in the snapshot yet; returns the number of rows added."""
+        times, _, sources = self.index()
+        seen = set(zip(sources, times.tolist()))
+        position = {column: index for index, column in enumerate(self.columns)}
+        added = 0
+        codes = np.zeros((chunk_size, self.width), dtype=np.uint8)
+        missing = np.ones((chunk_size, self.width), dtype=bool)
+        ids, times, names, saved = [], [], [], {}
+        for entry in iter_archive(data_dir, [self.key]):
+            try:
+                modified = os.path.getmtime(entry.path)
+            except OSError:
+                continue
+            source = os.path.basename(entry.path)
+            if (source, modified) in seen:
+                continue
+            row = len(ids)
+            try:
+                data = read_entry(entry)
+                fill_row(self.key, data, position, codes[row], missing[row])
+            except (OSError, ValueError, KeyError, TypeError, AttributeError, OverflowError) as error:
+                codes[row] = 0
+                missing[row] = True
+                if failed is not None:
+                    failed.append((entry.path, repr(error)))
+                continue
+            if 'adaptive' in data:
+                # adaptive PID-5 sessions skipped most items; their saved scores are the model estimates
+                saved[row] = record_scores(self.key, data)
+            ids.append(entry.user_id)
+            times.append(modified)
+            names.append(source)
+            if len(ids) == chunk_size:
+                added += self.append(codes, missing, ids, times, names, saved)
+                ids, times, names, saved = [], [], [], {}
+                codes[:] = 0
+                missing[:] = True
+        added += self.append(codes[:len(ids)], missing[:len(ids)], ids, times, names, saved)
+        return added
+
+    def size(self):
+        return sum(os.path.getsize(self.path(suffix)) for suffix in ('codes', 'missing', 'index', 'saved', 'json')
+                   if os.path.exists(self.path(suffix)))
+
+
+def score_snapshot(snapshot, output_dir=None, chunk_size=50000):
+    """Score every row with the Export ChunkScorer; returns (score names, per-scale sums, scored counts).
+
+    Rows with saved scores (adaptive PID-5 sessions) keep them, as in the export.
+    """
+    scorer = ChunkScorer(snapshot.key)
+    saved = snapshot.saved_scores()
+    writer = None
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        writer = NpyWriter(os.path.join(output_dir, f"{snapshot.key}_scores.npy"), np.float64, len(scorer.names))
+    sums = np.zeros(len(scorer.names))
+    counts = np.zeros(len(scorer.names), dtype=np.int64)
+    for start, codes, missing in snapshot.chunks(chunk_size):
+        chunk_saved = {row - start: values for row, values in saved.items() if start <= row < start + len(codes)}
+        scores = scorer.score(codes, missing, chunk_saved)
+        sums += np.nansum(scores, axis=0)
+        counts += (~np.isnan(scores)).sum(axis=0)
+        if writer is not None:
+            writer.append(scores)
+    if writer is not None:
+        writer.close()
+    return scorer.names, sums, counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and read the memory-mapped columnar snapshot of the archive.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    update = commands.add_parser('update', help="append the sessions of DATA_DIR that are not in the snapshot yet")
+    update.add_argument('data_dir', help="directory with les_*.json, pid_*.json and ssrs_*.json files")
+    update.add_argument('snapshot_dir')
+    update.add_argument('--only', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    update.add_argument('--chunk-size', type=int, default=5000, help="sessions held in memory at a time")
+    info = commands.add_parser('info', help="print the rows, size and time range of every instrument")
+    info.add_argument('snapshot_dir')
+    score = commands.add_parser('score', help="score every row and print the mean of each scale")
+    score.add_argument('snapshot_dir')
+    score.add_argument('--only', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    score.add_argument('--chunk-size', type=int, default=50000, help="rows scored at a time")
+    score.add_argument('--output', help="also write <key>_scores.npy, one row per snapshot row, to this directory")
+    args = parser.parse_args(argv)
+
+    if args.command == 'update':
+        status = 0
+        for key in args.only:
+            failed = []
+            snapshot = Snapshot(args.snapshot_dir, key)
+            began = time.perf_counter()
+            added = snapshot.update(args.data_dir, args.chunk_size, failed)
+            print(f"{key}: {added} sessions added, {snapshot.rows} in total "
+                  f"({time.perf_counter() - began:.1f} s), {len(failed)} rejected")
+            for path, error in failed:
+                print(f"  {path}: {error}")
+            status = status or (1 if failed else 0)
+        return status
+
+    if args.command == 'info':
+        for key in INSTRUMENTS:
+            snapshot = Snapshot(args.snapshot_dir, key)
+            if not snapshot.rows:
+                print(f"{key}: empty")
+                continue
+            times, ids, _ = snapshot.index()
+            first, last = (time.strftime('%Y-%m-%d %H:%M', time.localtime(stamp)) for stamp in (times.min(), times.max()))
+            print(f"{key}: {snapshot.rows} rows x {snapshot.width} items, {len(set(ids))} respondents, "
+                  f"{len(snapshot.saved_scores())} with saved scores, {snapshot.size() / 1e6:.1f} MB, "
+                  f"{first} to {last}")
+        return 0
+
+    for key in args.only:
+        snapshot = Snapshot(args.snapshot_dir, key)
+        began = time.perf_counter()
+        names, sums, counts = score_snapshot(snapshot, args.output, args.chunk_size)
+        elapsed = time.perf_counter() - began
+        print(f"{key}: {snapshot.rows} rows scored in {elapsed:.2f} s")
+        for name, total, count in zip(names, sums, counts):
+            mean = f"{total / count:.3f}" if count else "-"
+            print(f"  {name}: n={count} mean={mean}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
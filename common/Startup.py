@@ -0,0 +1,94 @@
+import time
+import threading
+
+from PyQt6.QtCore import QObject, QEvent, QTimer
+
+
+class StartupTimer:
+    """Collects named timestamps (seconds since process start) for --startup-timing."""
+
+    def __init__(self, origin, enabled=False, expected=()):
+        self.origin = origin
+        self.enabled = enabled
+        self.expected = set(expected)
+        self.marks = {}
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.origin)
+            ready = not self._reported and self.expected <= set(self.marks)
+            self._reported = self._reported or ready
+        if ready:
+            self.report()
+
+    def report(self):
+        print("Startup timings:")
+        for name, seconds in sorted(self.marks.items(), key=lambda mark: mark[1]):
+            print(f"  {name:<20} {seconds * 1000:8.1f} ms")
+
+
+class Warmup:
+    """Run target (typically heavy imports) on a background thread.
+
+    result() waits for the thread and returns what target returned, re-raising
+    its exception; if the warm-up was never started it runs inline.
+    """
+
+    def __init__(self, target, timer=None, name='reporting ready'):
+        self.target = target
+        self.timer = timer
+        self.name = name
+        self._thread = None
+        self._result = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        try:
+            self._result = self.target()
+        except BaseException as error:
+            self._error = error
+        if self.timer is not None:
+            self.timer.mark(self.name)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+                self._thread.start()
+
+    def start_after_paint(self, widget):
+        """Start once widget has painted, so the dialog is on screen before the imports run."""
+        def on_paint():
+            if self.timer is not None:
+                self.timer.mark('first paint')
+            self.start()
+        FirstPaint(widget, on_paint)
+
+    def result(self):
+        self.start()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class FirstPaint(QObject):
+    """Call callback once, right after widget has painted for the first time."""
+
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self.callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self.callback is not None:
+            callback, self.callback = self.callback, None
+            obj.removeEventFilter(self)
+            # let the paint finish before doing anything else
+            QTimer.singleShot(0, callback)
+        return False
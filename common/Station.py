@@ -0,0 +1,124 @@
+import argparse
+
+from PyQt6.QtCore import QObject, Qt
+from PyQt6.QtWidgets import QApplication, QLabel, QMessageBox
+
+from common.Journal import SessionJournal
+from common.Store import ResponseStore
+
+
+def argument_parser(description):
+    """Command-line options shared by the collectors; unknown arguments are left for Qt."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--startup-timing', action='store_true',
+                        help="print import, first-paint and warm-up timings")
+    parser.add_argument('--db', help="also store each submission in this SQLite database")
+    parser.add_argument('--journal-dir', default='journal',
+                        help="where answers are journaled until submission (default: ./journal)")
+    parser.add_argument('--report-workers', type=int, default=1,
+                        help="processes generating reports in the background; 0 generates them before "
+                             "the next participant can start (default: 1)")
+    parser.add_argument('--entry', action='store_true',
+                        help="keyboard data entry of paper forms: digits and pasted strings fill the items in order")
+    parser.add_argument('--trace', metavar='DIR',
+                        help="log stage timings and event-loop lag to rotating files in DIR")
+    return parser
+
+
+def open_store(args):
+    """The ResponseStore selected with --db, or None to keep to the JSON files only."""
+    return ResponseStore(args.db) if args.db else None
+
+
+def open_journal(args, instrument, user_id):
+    """Start the answer journal for user_id, offering to resume an unfinished session.
+
+    Returns (journal, answers) where answers is {period: {item: value}}, empty
+    unless the participant chose to resume.
+    """
+    journal = SessionJournal(args.journal_dir, instrument, user_id)
+    answers = {}
+    if journal.unfinished():
+        choice = QMessageBox.question(None, "继续未完成的问卷", f"ID {user_id} 有一份未完成的问卷，是否从上次中断处继续？")
+        if choice == QMessageBox.StandardButton.Yes:
+            answers = journal.replay()
+    journal.start(resume=bool(answers))
+    return journal, answers
+
+
+class Station(QObject):
+    """Runs sessions back to back: ID dialog, survey, then a fresh ID dialog.
+
+    make_survey(user_id, journal, answers) builds the collector's Survey
+    window. Reports handed to the pipeline keep generating while the next
+    participant starts; the dialog shows how many are still in progress and
+    a failed report is reported in a message box. Cancelling the ID dialog
+    ends the station once the pending reports are done.
+    """
+
+    def __init__(self, args, instrument, dialog_class, make_survey, pipeline=None):
+        super().__init__()
+        self.args = args
+        self.instrument = instrument
+        self.dialog_class = dialog_class
+        self.make_survey = make_survey
+        self.pipeline = pipeline
+        self.dialog = None
+        self.survey = None
+        self.messages = []
+        if pipeline is not None:
+            pipeline.changed.connect(self.show_status)
+            pipeline.failed.connect(self.show_failure)
+
+    def start(self):
+        self.dialog = self.dialog_class()
+        self.status = QLabel()
+        self.dialog.layout.addRow(self.status)
+        self.show_status(self.pipeline.pending if self.pipeline is not None else 0)
+        self.dialog.accepted.connect(self.begin_session)
+        self.dialog.rejected.connect(self.finish)
+        self.dialog.show()
+
+    def begin_session(self):
+        user_id = self.dialog.get_id()
+        journal, answers = open_journal(self.args, self.instrument, user_id)
+        self.survey = self.make_survey(user_id, journal, answers)
+        self.survey.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        self.survey.destroyed.connect(lambda: self.end_session(journal))
+        self.survey.show()
+        self.survey.show_page(self.survey.current_page)
+
+    def end_session(self, journal):
+        # flushes the journal; a session closed without submitting stays resumable
+        journal.close()
+        self.survey = None
+        self.start()
+
+    def show_status(self, pending):
+        if self.dialog is not None:
+            self.status.setText(f"后台正在生成 {pending} 份报告" if pending else "")
+
+    def show_failure(self, description, error):
+        message = QMessageBox(QMessageBox.Icon.Warning, "报告生成失败", f"{description}\n{error}")
+        message.setModal(False)
+        message.show()
+        self.messages.append(message)
+
+    def finish(self):
+        QApplication.instance().quit()
+
+    def run(self, app):
+        """Show the first ID dialog and run until the station is closed; returns the exit status."""
+        app.setQuitOnLastWindowClosed(False)
+        if self.dialog is None:
+            self.start()
+        status = app.exec()
+        if self.pipeline is not None:
+            self.pipeline.shutdown()
+        return status
+
+
+def open_pipeline(args):
+    """The background SubmissionPipeline, or None when --report-workers is 0."""
+    from common.Submit import SubmissionPipeline
+    return SubmissionPipeline(args.report_workers) if args.report_workers > 0 else None
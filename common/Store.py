@@ -0,0 +1,208 @@
+"""Optional SQLite storage for collected sessions.
+
+    python -m common.Store DB_PATH DATA_DIR    # bulk-load an existing JSON archive
+
+Every submission becomes a new row in sessions, so a repeated ID never
+overwrites earlier data. Item answers are stored as integer codes and
+computed scores alongside them. The database runs in WAL mode with a busy
+timeout and every write is a single IMMEDIATE transaction, so several
+collection stations can write to the same file; WAL needs the stations to
+share one host's local disk, so pass wal=False for a network share.
+
+Imported archive files are stored with source "archive:<file name>" and
+their modification time as created_at, under a unique index, so importing
+the same archive again only adds the files that are new or were rewritten.
+"""
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+from common.Archive import iter_archive, read_entry, record_responses, make_record
+
+ARCHIVE_SOURCE = 'archive:'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    respondent_id TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS responses (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    period TEXT NOT NULL,
+    item INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    PRIMARY KEY (session_id, period, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scores (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (session_id, name)
+);
+CREATE INDEX IF NOT EXISTS sessions_respondent ON sessions (respondent_id, instrument);
+CREATE INDEX IF NOT EXISTS sessions_instrument ON sessions (instrument, created_at);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS sessions_archive_source ON sessions (source, created_at)
+    WHERE source LIKE 'archive:%';
+"""
+
+
+class ResponseStore:
+    def __init__(self, path, wal=True, timeout=30.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        if wal:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = FULL")
+        with self._lock:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _insert(self, cursor, instrument, respondent_id, responses, scores, created_at, source, skip_existing=False):
+        cursor.execute(f"INSERT {'OR IGNORE ' if skip_existing else ''}INTO sessions "
+                       "(respondent_id, instrument, created_at, source) VALUES (?, ?, ?, ?)",
+                       (str(respondent_id), instrument, created_at or time.time(), source))
+        if not cursor.rowcount:
+            # already stored under the same source and time
+            return None
+        session_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO responses (session_id, period, item, code) VALUES (?, ?, ?, ?)",
+                           [(session_id, period, int(item), int(code))
+                            for period, answers in responses.items()
+                            for item, code in answers.items() if code is not None])
+        cursor.executemany("INSERT INTO scores (session_id, name, value) VALUES (?, ?, ?)",
+                           [(session_id, name, value) for name, value in (scores or {}).items()])
+        return session_id
+
+    def save_many(self, sessions, skip_existing=False):
+        """Insert (instrument, respondent_id, responses, scores, created_at, source) tuples in one transaction.
+
+        responses is {period: {item: code}} as returned by Archive.record_responses.
+        With skip_existing, a session that an existing archive row already has
+        is left out and its id is None.
+        """
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [self._insert(cursor, *session, skip_existing=skip_existing) for session in sessions]
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            return ids
+
+    def save_session(self, instrument, respondent_id, responses, scores=None, created_at=None, source=None):
+        return self.save_many([(instrument, respondent_id, responses, scores, created_at, source)])[0]
+
+    def save_record(self, instrument, respondent_id, record, scores=None, source=None):
+        """Store a record in the shape the collectors pass to save_to_json."""
+        return self.save_session(instrument, respondent_id, record_responses(instrument, record), scores,
+                                 source=source)
+
+    def sessions(self, instrument=None, respondent_id=None, since=None):
+        """(id, respondent_id, instrument, created_at) rows, oldest first."""
+        query = "SELECT id, respondent_id, instrument, created_at FROM sessions WHERE 1 = 1"
+        parameters = []
+        if instrument is not None:
+            query += " AND instrument = ?"
+            parameters.append(instrument)
+        if respondent_id is not None:
+            query += " AND respondent_id = ?"
+            parameters.append(str(respondent_id))
+        if since is not None:
+            query += " AND created_at >= ?"
+            parameters.append(since)
+        with self._lock:
+            return self.connection.execute(query + " ORDER BY created_at, id", parameters).fetchall()
+
+    def load_responses(self, session_id):
+        with self._lock:
+            rows = self.connection.execute("SELECT period, item, code FROM responses WHERE session_id = ?",
+                                           (session_id,)).fetchall()
+        responses = {}
+        for period, item, code in rows:
+            responses.setdefault(period, {})[str(item)] = code
+        return responses
+
+    def load_scores(self, session_id):
+        with self._lock:
+            return dict(self.connection.execute("SELECT name, value FROM scores WHERE session_id = ? ORDER BY rowid",
+                                                (session_id,)).fetchall())
+
+    def archive_sources(self):
+        """(source, created_at) of the sessions imported from archive files."""
+        with self._lock:
+            return set(self.connection.execute("SELECT source, created_at FROM sessions WHERE source LIKE ?",
+                                               (f"{ARCHIVE_SOURCE}%",)).fetchall())
+
+    def load_record(self, session_id):
+        """A stored session back in the collectors' save_to_json shape."""
+        with self._lock:
+            instrument, = self.connection.execute("SELECT instrument FROM sessions WHERE id = ?",
+                                                  (session_id,)).fetchone()
+        return make_record(instrument, self.load_responses(session_id), self.load_scores(session_id))
+
+
+def import_archive(store, directory, batch_size=500):
+    """Bulk-load the les_/pid_/ssrs_ JSON files of a directory that are not in the store yet.
+
+    Returns (imported, skipped as already imported, failed paths).
+    """
+    from common.Reports import score_record
+
+    seen = store.archive_sources()
+    imported, skipped, failed, batch = 0, 0, [], []
+
+    def flush():
+        ids = store.save_many(batch, skip_existing=True)
+        stored = sum(1 for session_id in ids if session_id is not None)
+        return stored, len(ids) - stored
+
+    for entry in iter_archive(directory):
+        try:
+            source, modified = ARCHIVE_SOURCE + os.path.basename(entry.path), os.path.getmtime(entry.path)
+            if (source, modified) in seen:
+                skipped += 1
+                continue
+            data = read_entry(entry)
+            batch.append((entry.instrument, entry.user_id, record_responses(entry.instrument, data),
+                          score_record(entry.instrument, data, entry.user_id), modified, source))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            failed.append((entry.path, repr(error)))
+        if len(batch) >= batch_size:
+            stored, existing = flush()
+            imported, skipped, batch = imported + stored, skipped + existing, []
+    if batch:
+        stored, existing = flush()
+        imported, skipped = imported + stored, skipped + existing
+    return imported, skipped, failed
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: python -m common.Store DB_PATH DATA_DIR")
+        return 2
+    store = ResponseStore(argv[0])
+    imported, skipped, failed = import_archive(store, argv[1])
+    store.close()
+    print(f"Imported {imported} sessions into {argv[0]}, {skipped} already there, {len(failed)} failed.")
+    for path, error in failed:
+        print(f"  {path}: {error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from common.Reports import render_report, report_pool, warm_up
+
+
+class SubmissionPipeline(QObject):
+    """Generates submitted sessions' reports in worker processes.
+
+    The collector saves the record itself (that is quick and must not be
+    lost), then hands the report to submit() and can reset for the next
+    participant right away. Signals arrive on the GUI thread:
+    changed(pending) whenever the number of reports in progress changes,
+    finished(filename) and failed(description, error).
+
+    If a worker process dies, the pool refuses new work; the reports it had
+    fail, and submit() starts a fresh pool for the next one.
+    """
+
+    changed = pyqtSignal(int)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+    _done = pyqtSignal(object, str)
+
+    def __init__(self, workers=1):
+        super().__init__()
+        self.workers = workers
+        self.executor = report_pool(workers)
+        self.pending = 0
+        self.failures = []
+        self._done.connect(self._on_done)
+
+    def prewarm(self, instrument):
+        """Have a worker import the report module before the first submission."""
+        self.executor.submit(warm_up, instrument)
+
+    def submit(self, instrument, user_id, record, filename, chart_backend='matplotlib'):
+        filename = os.path.abspath(filename)
+        try:
+            future = self.executor.submit(render_report, instrument, user_id, record, filename, chart_backend)
+        except BrokenProcessPool:
+            # a worker died (killed, out of memory); the record is saved, so restart the pool and carry on
+            print("The report workers stopped; restarting them.")
+            self.executor.shutdown(wait=False)
+            self.executor = report_pool(self.workers)
+            future = self.executor.submit(render_report, instrument, user_id, record, filename, chart_backend)
+        self.pending += 1
+        self.changed.emit(self.pending)
+        description = f"{instrument} report for ID {user_id}"
+        future.add_done_callback(lambda done: self._done.emit(done, description))
+        return future
+
+    def _on_done(self, future, description):
+        self.pending -= 1
+        try:
+            filename = future.result()
+        except Exception as error:
+            self.failures.append((description, repr(error)))
+            print(f"Failed to generate the {description}: {error!r}")
+            self.failed.emit(description, repr(error))
+        else:
+            self.finished.emit(filename)
+        self.changed.emit(self.pending)
+
+    def shutdown(self):
+        """Wait for the reports still in progress."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,238 @@
+"""Stage timing spans and Qt event-loop lag, written to a rotating JSON-lines log.
+
+    python -m common.Trace TRACE_DIR [TRACE_DIR ...]    # per-stage latency tables and histograms
+
+Tracing is off unless a collector runs with --trace DIR (or SURVEY_TRACE=DIR
+is set). While it is off, span() hands back one shared do-nothing context
+manager and @traced functions make a single attribute check before running,
+so the instrumentation can stay in the hot paths.
+
+When it is on, each process appends one JSON object per span to
+DIR/trace-<host>-<pid>.jsonl: time, host, station, pid, stage, ms and any
+extra fields. The file rotates at 5 MB and keeps three old files. Report
+workers inherit SURVEY_TRACE, so their spans land next to the station's.
+The event-loop lag sampler adds every sample to a histogram, which is
+written out once a minute. Only a lag above 50 ms is logged on its own.
+Copy the trace directories of all stations into one place and run this
+module on them to get the combined tables.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import logging
+import functools
+import threading
+from logging.handlers import RotatingFileHandler
+
+import numpy as np
+
+TRACE_ENV = 'SURVEY_TRACE'
+STATION_ENV = 'SURVEY_TRACE_STATION'
+# histogram bucket b holds durations in [2**(b-1), 2**b) microseconds; bucket 0 is under 1 us
+BUCKETS = 32
+SLOW_LAG = 0.05
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'stage', 'fields', 'began')
+
+    def __init__(self, tracer, stage, fields):
+        self.tracer = tracer
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fields = self.fields if exc_type is None else dict(self.fields, error=exc_type.__name__)
+        self.tracer.record(self.stage, time.perf_counter() - self.began, **fields)
+        return False
+
+
+def bucket(seconds):
+    return min(BUCKETS - 1, max(0, int(seconds * 1e6)).bit_length())
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.station = ''
+        self.logger = None
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def configure(self, directory, station=''):
+        """Start logging spans under directory; child processes started afterwards follow suit."""
+        os.makedirs(directory, exist_ok=True)
+        os.environ[TRACE_ENV] = os.path.abspath(directory)
+        os.environ[STATION_ENV] = station
+        path = os.path.join(directory, f"trace-{socket.gethostname()}-{os.getpid()}.jsonl")
+        handler = RotatingFileHandler(path, maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.getLogger(f"survey.trace.{os.getpid()}")
+        self.logger.handlers[:] = [handler]
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.station = station
+        if not self.enabled:
+            atexit.register(self.flush_histograms)
+        self.enabled = True
+
+    def span(self, stage, **fields):
+        """Time a with-block as one span of stage."""
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, stage, fields)
+
+    def record(self, stage, seconds, **fields):
+        if not self.enabled:
+            return
+        self.logger.info(json.dumps(dict({'time': time.time(), 'host': socket.gethostname(),
+                                          'station': self.station, 'pid': os.getpid(), 'stage': stage,
+                                          'ms': round(seconds * 1000, 4)}, **fields), ensure_ascii=False))
+
+    def count(self, stage, seconds):
+        """Add a sample to the in-memory histogram of stage, for events too frequent to log one by one."""
+        if not self.enabled:
+            return
+        with self._lock:
+            counts = self.histograms.setdefault(stage, [0] * BUCKETS)
+            counts[bucket(seconds)] += 1
+
+    def flush_histograms(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        for stage, counts in histograms.items():
+            self.logger.info(json.dumps({'time': time.time(), 'host': socket.gethostname(), 'station': self.station,
+                                         'pid': os.getpid(), 'histogram': stage, 'counts': counts}, ensure_ascii=False))
+
+
+tracer = Tracer()
+if os.environ.get(TRACE_ENV):
+    tracer.configure(os.environ[TRACE_ENV], os.environ.get(STATION_ENV, ''))
+
+
+def span(stage, **fields):
+    return tracer.span(stage, **fields)
+
+
+def traced(stage):
+    """Decorator recording every call of the function as a span of stage."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with _Span(tracer, stage, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def sample_event_loop_lag(interval=0.1, flush_every=60.0):
+    """Measure how late a repeating QTimer fires; returns the timer, or None when tracing is off.
+
+    Keep a reference to the timer for as long as sampling should go on.
+    """
+    if not tracer.enabled:
+        return None
+    from PyQt6.QtCore import QTimer
+
+    timer = QTimer()
+    timer.setInterval(int(interval * 1000))
+    state = {'due': time.perf_counter() + interval, 'flush': time.perf_counter() + flush_every}
+
+    def tick():
+        now = time.perf_counter()
+        lag = max(0.0, now - state['due'])
+        tracer.count('qt.event_loop_lag', lag)
+        if lag > SLOW_LAG:
+            tracer.record('qt.event_loop_lag', lag)
+        if now >= state['flush']:
+            tracer.flush_histograms()
+            state['flush'] = now + flush_every
+        state['due'] = now + interval
+
+    timer.timeout.connect(tick)
+    timer.start()
+    return timer
+
+
+def read_trace(directories):
+    """Yield every record of the trace files (rotated ones included) under directories."""
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            if not name.startswith('trace-') or '.jsonl' not in name:
+                continue
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+def bucket_label(index):
+    upper = 2 ** index
+    return f"<{upper} us" if upper < 1000 else f"<{upper / 1000:g} ms"
+
+
+def print_histogram(counts, width=40):
+    counts = np.asarray(counts)
+    nonzero = np.nonzero(counts)[0]
+    if not len(nonzero):
+        return
+    for index in range(nonzero[0], nonzero[-1] + 1):
+        bar = '#' * int(round(width * counts[index] / counts.max()))
+        print(f"    {bucket_label(index):>12s} {counts[index]:8d} {bar}")
+
+
+def main(argv=None):
+    directories = sys.argv[1:] if argv is None else argv
+    if not directories:
+        print("usage: python -m common.Trace TRACE_DIR [TRACE_DIR ...]")
+        return 2
+    spans, histograms, stations = {}, {}, set()
+    for entry in read_trace(directories):
+        stations.add(entry.get('host', ''))
+        if 'histogram' in entry:
+            counts = histograms.setdefault(entry['histogram'], np.zeros(BUCKETS, dtype=np.int64))
+            counts += np.asarray(entry['counts'], dtype=np.int64)
+        elif 'stage' in entry:
+            spans.setdefault(entry['stage'], []).append(entry['ms'])
+    print(f"{sum(len(values) for values in spans.values())} spans from {len(stations)} hosts")
+    print(f"{'stage':32s} {'count':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s} {'total s':>9s}")
+    for stage in sorted(spans, key=lambda name: -sum(spans[name])):
+        values = np.asarray(spans[stage])
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{stage:32s} {len(values):7d} {p50:9.2f} {p95:9.2f} {p99:9.2f} {values.max():9.2f} "
+              f"{values.sum() / 1000:9.2f}")
+    for stage in sorted(spans):
+        print(f"  {stage}")
+        print_histogram(np.bincount([bucket(ms / 1000) for ms in spans[stage]], minlength=BUCKETS))
+    for stage, counts in histograms.items():
+        print(f"  {stage} (all samples, {counts.sum()} in total)")
+        print_histogram(counts)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Code shared by the LES, PID-5 and SSRS collectors and the batch tools."""
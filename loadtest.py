@@ -0,0 +1,108 @@
+"""Simulate many participants filling in questionnaires on collection_server.py at once.
+
+    python loadtest.py [--host 127.0.0.1] [--port 8080] [--clients 200] [--instrument pid]
+
+Each simulated participant keeps one HTTP/1.1 connection open, loads the
+questionnaire page, opens a session, posts every answer one by one as the
+browser page does, and submits. Per-request latency percentiles and the
+overall throughput are printed at the end.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+from common.Registry import get_instrument
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return status, await self.reader.readexactly(length)
+
+    def close(self):
+        self.writer.close()
+
+
+async def participant(args, number, instrument, latencies, errors):
+    client = Client(args.host, args.port)
+    await client.connect()
+
+    async def timed(kind, method, path, payload=None):
+        began = time.perf_counter()
+        status, body = await client.request(method, path, payload)
+        latencies.setdefault(kind, []).append(time.perf_counter() - began)
+        if status != 200:
+            errors.append(f"{kind} {status} {body[:200]!r}")
+        return body
+
+    try:
+        await timed('page', 'GET', f"/{args.instrument}")
+        session = json.loads(await timed('session', 'POST', '/api/session',
+                                         {'instrument': args.instrument, 'user_id': f"load{number}"}))['session']
+        periods = ('year', 'week') if args.instrument == 'les' else ('',)
+        for period in periods:
+            for position, item in enumerate(instrument.items):
+                code = random.choice(sorted(instrument.code_options[position]))
+                await timed('answer', 'POST', '/api/answer',
+                            {'session': session, 'item': item, 'period': period, 'code': code})
+                if args.think:
+                    await asyncio.sleep(random.uniform(0, args.think))
+        await timed('submit', 'POST', '/api/submit', {'session': session})
+    finally:
+        client.close()
+
+
+async def run(args):
+    instrument = get_instrument(args.instrument)
+    latencies, errors = {}, []
+    began = time.perf_counter()
+    await asyncio.gather(*(participant(args, number, instrument, latencies, errors) for number in range(args.clients)))
+    elapsed = time.perf_counter() - began
+    total = sum(len(values) for values in latencies.values())
+    print(f"{args.clients} participants, {total} requests in {elapsed:.2f} s ({total / elapsed:.0f} requests/s), "
+          f"{len(errors)} errors")
+    for kind, values in latencies.items():
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        print(f"  {kind:8s} n={len(values):6d}  p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms")
+    for error in errors[:10]:
+        print(f"  {error}")
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test collection_server.py with simulated participants.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--instrument', choices=['les', 'pid', 'ssrs'], default='pid')
+    parser.add_argument('--think', type=float, default=0.0, help="max pause between answers, in seconds")
+    return asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import io
+import os
+import re
+
+import pytest
+import reportlab
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from common import Fonts
+from common.Fonts import CachedTTFont, FontService
+
+FONT = os.path.join(os.path.dirname(reportlab.__file__), 'fonts', 'Vera.ttf')
+TEXT = "Life events 2024: 42 (A+B) / ssrs"
+# the stream dictionary of an embedded TrueType program: /Length1 is its unpacked size
+FONT_FILE = re.compile(rb'<<[^>]*/Length (\d+) /Length1 \d+[^>]*>>\s*stream\r?\n')
+
+
+@pytest.fixture(autouse=True)
+def font_registry(monkeypatch):
+    """Gives the test an empty reportlab font registry; calling the fixture empties it again."""
+    def clean_registry():
+        # reportlab keeps the first font registered for a face and aliases later names to it
+        monkeypatch.setattr(pdfmetrics, '_fonts', {})
+        monkeypatch.setattr(pdfmetrics, '_dynFaceNames', {})
+    clean_registry()
+    return clean_registry
+
+
+def draw(font):
+    """The PDF bytes of TEXT drawn in font, which is registered first."""
+    pdfmetrics.registerFont(font)
+    assert pdfmetrics.getFont(font.fontName) is font
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer, invariant=1, pageCompression=0)
+    page.setFont(font.fontName, 12)
+    page.drawString(72, 720, TEXT)
+    page.showPage()
+    page.save()
+    return buffer.getvalue()
+
+
+def embedded_subsets(pdf):
+    """The glyph subsets (FontFile2 streams) embedded in pdf."""
+    return [pdf[match.end():match.end() + int(match.group(1))] for match in FONT_FILE.finditer(pdf)]
+
+
+@pytest.mark.skipif(not Fonts.REUSE_FACES, reason="CachedTTFont is only used under the tested reportlab")
+@pytest.mark.parametrize('from_disk', [False, True])
+def test_cached_font_embeds_the_same_subsets(tmp_path, font_registry, from_disk):
+    face = FontService(str(tmp_path)).face(FONT)
+    if from_disk:
+        # a second service reads the face back from the pickle the first one wrote
+        face = FontService(str(tmp_path)).face(FONT)
+    cached = draw(CachedTTFont('FontsTest', face))
+    font_registry()
+    fresh = draw(TTFont('FontsTest', FONT))
+    assert embedded_subsets(fresh)
+    assert embedded_subsets(cached) == embedded_subsets(fresh)
+    assert cached == fresh
+
+
+def test_other_reportlab_falls_back_to_ttfont(tmp_path, font_registry, monkeypatch):
+    monkeypatch.setattr(Fonts, 'REUSE_FACES', False)
+    service = FontService(str(tmp_path))
+    font = service.register('FontsFallback', FONT)
+    assert type(font) is TTFont
+    assert service.register('FontsFallback', FONT) is font
+    assert os.listdir(tmp_path) == []
+    pdf = draw(font)
+    font_registry()
+    assert embedded_subsets(pdf) == embedded_subsets(draw(TTFont('FontsFallback', FONT)))
@@ -0,0 +1,63 @@
+import json
+
+from common.Journal import SessionJournal
+
+
+def write_session(directory):
+    journal = SessionJournal(str(directory), 'les', 'p 1', flush_interval=0.01)
+    journal.start()
+    journal.record('1', 2, 'year')
+    journal.record('1', 0, 'week')
+    journal.record('2', 1, 'year')
+    journal.record('2', 3, 'year')  # changed answer: the last one counts
+    journal.record('3', None, 'year')
+    journal.record('4', 1, 'week')
+    journal.close()
+    return journal
+
+
+def tear_last_line(path):
+    """Cut the last line half-way, as a crash in the middle of a write would."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    last = data.rstrip(b'\n').rfind(b'\n') + 1
+    with open(path, 'wb') as file:
+        file.write(data[:last + (len(data) - last) // 2])
+
+
+def test_replay_after_torn_write(tmp_path):
+    journal = write_session(tmp_path)
+    assert journal.replay() == {'year': {'1': 2, '2': 3, '3': None}, 'week': {'1': 0, '4': 1}}
+    tear_last_line(journal.path)
+
+    reopened = SessionJournal(str(tmp_path), 'les', 'p 1')
+    assert reopened.unfinished()
+    assert reopened.replay() == {'year': {'1': 2, '2': 3, '3': None}, 'week': {'1': 0}}
+
+
+def test_resume_after_torn_write_keeps_new_answers(tmp_path):
+    journal = write_session(tmp_path)
+    tear_last_line(journal.path)
+
+    resumed = SessionJournal(str(tmp_path), 'les', 'p 1', flush_interval=0.01)
+    resumed.start(resume=True)
+    resumed.record('4', 2, 'week')
+    resumed.record('5', 1, 'year')
+    resumed.close()
+    assert resumed.replay() == {'year': {'1': 2, '2': 3, '3': None, '5': 1}, 'week': {'1': 0, '4': 2}}
+
+
+def test_compact_leaves_only_the_final_record(tmp_path):
+    journal = write_session(tmp_path)
+    tear_last_line(journal.path)
+    record = {'year': {'1': 2, '2': 3}, 'week': {'1': 0}}
+    journal.compact(record)
+
+    with open(journal.path, encoding='utf-8') as file:
+        lines = file.readlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['final'] == record
+    assert [path.name for path in tmp_path.iterdir()] == ["les_p_1.journal"]
+    assert not journal.unfinished()
+    assert journal.replay() == {}
+
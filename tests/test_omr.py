@@ -0,0 +1,71 @@
+import json
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from common import Omr
+from common.Registry import get_instrument
+
+SCALE = 150 / 72
+
+
+def known_answers(key, seed=1):
+    """A code for every item of every period, and one item left blank."""
+    rng = random.Random(seed)
+    instrument = get_instrument(key)
+    answers = {period: {item: rng.choice(sorted(instrument.code_options[position]))
+                        for position, item in enumerate(instrument.items)}
+               for period in Omr.PERIODS.get(key, ('',))}
+    del answers[next(iter(answers))][instrument.items[-1]]
+    return answers
+
+
+def skewed(image, shear=0.01):
+    """image with a small shear on top of the rotation and shift render_page applies."""
+    return image.transform(image.size, Image.Transform.AFFINE, (1, shear, -shear * image.height / 2, shear, 1, 0),
+                           resample=Image.Resampling.BILINEAR, fillcolor=255)
+
+
+@pytest.mark.parametrize('key', ['ssrs', 'les'])
+def test_skewed_page_reads_back(tmp_path, key):
+    answers = known_answers(key)
+    page = Omr.layout(key)[0]
+    image = Omr.render_page(key, page, '12345', answers, {}, SCALE, random.Random(2))
+    path = tmp_path / 'page.png'
+    skewed(image).save(path)
+    result = Omr.read_page(str(path))
+    assert result.error is None
+    assert (result.instrument, result.page, result.user_id) == (key, 0, '12345')
+    assert result.flags == []
+    on_page = {position for _, position in page.slots}
+    items = [get_instrument(key).items[position] for position in sorted(on_page)]
+    for period, codes in answers.items():
+        assert result.answers.get(period, {}) == {item: codes[item] for item in items if item in codes}
+
+
+def test_synthetic_forms_match_truth(tmp_path):
+    scans, output = tmp_path / 'scans', tmp_path / 'out'
+    Omr.synthesize('pid', str(scans), count=2, seed=3, blank=0.02, ambiguous=0.01)
+    forms, _, problems = Omr.read_scans(str(scans), str(output))
+    assert problems == []
+    truth = json.loads((scans / 'truth.json').read_text(encoding='utf-8'))
+    counts = Omr.compare_truth(forms, truth)
+    assert counts['wrong'] == counts['missed'] == counts['false flags'] == counts['unmatched forms'] == 0
+    assert counts['correct'] > 0
+    assert sorted(path.name for path in output.glob('pid_*.json')) == ['pid_030001.json', 'pid_030002.json']
+
+
+def test_missing_registration_mark(tmp_path):
+    page = Omr.layout('ssrs')[0]
+    image = Omr.render_page('ssrs', page, '1', known_answers('ssrs'), {}, SCALE, random.Random(4))
+    # paint over the top right corner, where its mark is
+    pixels = np.asarray(image).copy()
+    pixels[:int(pixels.shape[0] * 0.12), -int(pixels.shape[1] * 0.15):] = 255
+    path = tmp_path / 'page.png'
+    Image.fromarray(pixels).save(path)
+    with pytest.raises(ValueError, match="registration mark not found"):
+        Omr.register(Omr.load_darkness(str(path)))
+    result = Omr.read_page(str(path))
+    assert "registration mark not found" in result.error
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from common.Instruments import load_module
+from common.Registry import get_instrument
+from common.Responses import ResponseSet
+
+scorer = load_module('pid', 'Scorer')
+
+
+def random_responses(rng, answered):
+    """Codes 0-3 for a random answered share of the 220 items, as the collectors save them."""
+    return {str(item): rng.randint(0, 3) for item in range(1, scorer.N_ITEMS + 1) if rng.random() < answered}
+
+
+def cases():
+    rng = random.Random(20240501)
+    sessions = [random_responses(rng, 1.0) for _ in range(50)]
+    sessions += [random_responses(rng, rng.choice([0.02, 0.1, 0.5, 0.9])) for _ in range(250)]
+    # only reverse-keyed items, only the others, and nothing at all
+    sessions.append({str(item): rng.randint(0, 3) for item in scorer.REVERSE_ITEMS})
+    sessions.append({str(item): rng.randint(0, 3) for item in range(1, scorer.N_ITEMS + 1)
+                     if item not in scorer.REVERSE_ITEMS})
+    sessions.append({})
+    return sessions
+
+
+def assert_same(actual, expected):
+    assert list(actual) == list(expected)
+    for name, value in expected.items():
+        assert actual[name] == pytest.approx(value, rel=0, abs=1e-12), name
+
+
+def test_batch_scorer_matches_dict_scorer():
+    sessions = cases()
+    batch = scorer.PID5BatchScorer()
+    facet_rows, domain_rows = batch.score(*batch.to_matrix(sessions))
+    for responses, facet_row, domain_row in zip(sessions, facet_rows, domain_rows):
+        expected_facets, expected_domains = scorer.PID5Scorer(responses).get_scores()
+        facet_scores, domain_scores = batch.to_dicts(facet_row, domain_row)
+        assert_same(facet_scores, expected_facets)
+        assert_same(domain_scores, expected_domains)
+
+
+def test_reverse_keyed_items_are_reversed():
+    batch = scorer.PID5BatchScorer()
+    # every answer 0: reverse-keyed items count as 3
+    facet_rows, domain_rows = batch.score(*batch.to_matrix([{str(item): 0 for item in range(1, scorer.N_ITEMS + 1)}]))
+    facet_scores, _ = batch.to_dicts(facet_rows[0], domain_rows[0])
+    for facet, items in scorer.FACETS.items():
+        reversed_share = sum(item in scorer.REVERSE_ITEMS for item in items) / len(items)
+        assert facet_scores[facet] == pytest.approx(3 * reversed_share)
+
+
+def test_response_set_scorer_matches_dict_scorer():
+    instrument = get_instrument('pid')
+    for responses in cases()[::25]:
+        from_set = scorer.PID5Scorer(ResponseSet.from_dict(instrument, responses)).get_scores()
+        from_dict = scorer.PID5Scorer(responses).get_scores()
+        assert_same(from_set[0], from_dict[0])
+        assert_same(from_set[1], from_dict[1])
+